@@ -18,7 +18,7 @@ import argparse
 import logging
 import traceback
 from .log import log, logger
-from . import cli, config
+from . import cli, config, daemon
 from .cli import get_sid
 from .engine import Running
 # from .utils import unhandled_exception_message, create_github_issue
@@ -51,6 +51,20 @@ def main():
         parser_group_scan.add_argument('-d', '--debug', dest='debug', action='store_true', default=False, help='open debug mode')
         parser_group_scan.add_argument('-lan', '--language', dest='language', action='store', default=None, help='set target language')
         parser_group_scan.add_argument('-b', '--blackpath', dest='black_path', action='store', default=None, help='black path list')
+        parser_group_scan.add_argument('--step-budget', dest='step_budget', action='store', type=int, default=None, metavar='<steps>', help='max ast trace steps for each vulnerability (0 for unlimited)')
+        parser_group_scan.add_argument('--time-budget', dest='time_budget', action='store', type=int, default=None, metavar='<seconds>', help='max ast trace seconds for each vulnerability (0 for unlimited)')
+        parser_group_scan.add_argument('--engine', dest='engine', action='store', default='backward', metavar='<engine>', choices=['backward', 'forward'], help='taint analysis engine for php (engines: %(choices)s)')
+        parser_group_scan.add_argument('-j', '--jobs', dest='jobs', action='store', type=int, default=1, metavar='<jobs>', help='number of processes to scan rules')
+        parser_group_scan.add_argument('--deadline', dest='deadline', action='store', type=int, default=None, metavar='<seconds>', help='max seconds for rules scan, return partial result when exceeded')
+        parser_group_scan.add_argument('--resume', dest='resume', action='store', default=None, metavar='<sid>', help='resume an interrupted scan by its scan sid, skip completed rules and unchanged files')
+        parser_group_scan.add_argument('--progress', dest='progress', action='store_true', default=False, help='print scan progress, throughput and ETA in a single updating line')
+        parser_group_scan.add_argument('--report', dest='report_mode', action='store', default='summary', metavar='<report>', choices=['summary', 'full'], help='console report mode, full prints all vulnerabilities with chains (modes: %(choices)s)')
+
+        parser_group_daemon = parser.add_argument_group('Daemon')
+        parser_group_daemon.add_argument('--daemon', dest='daemon', action='store_true', default=False, help='keep rules, parser tables and ast caches loaded and accept scans from a local HTTP API')
+        parser_group_daemon.add_argument('-H', '--host', dest='host', action='store', default='127.0.0.1', metavar='<host>', help='daemon listen host')
+        parser_group_daemon.add_argument('-P', '--port', dest='port', action='store', type=int, default=5000, metavar='<port>', help='daemon listen port')
+        parser_group_daemon.add_argument('--unix-socket', dest='unix_socket', action='store', default=None, metavar='<path>', help='daemon listen on a unix socket instead of host and port')
 
         args = parser.parse_args()
 
@@ -64,6 +78,10 @@ def main():
             logger.setLevel(logging.DEBUG)
             logger.debug('[INIT] set logging level: debug')
 
+        if args.daemon:
+            daemon.start(args.host, args.port, args.unix_socket)
+            return
+
         if args.target is '' and args.output is '':
             parser.print_help()
             exit()
@@ -81,7 +99,9 @@ def main():
         }
         Running(a_sid).status(data)
 
-        cli.start(args.target, args.format, args.output, args.special_rules, a_sid, args.language, args.secret_name, args.black_path)
+        cli.start(args.target, args.format, args.output, args.special_rules, a_sid, args.language, args.secret_name, args.black_path,
+                  step_budget=args.step_budget, time_budget=args.time_budget, engine=args.engine,
+                  jobs=args.jobs, deadline=args.deadline, resume=args.resume, progress=args.progress, report_mode=args.report_mode)
 
         t2 = time.time()
         logger.info('[INIT] Done! Consume Time:{ct}s'.format(ct=t2 - t1))
@@ -29,4 +29,5 @@ __epilog__ = """Usage:
   python {m} -t {td} -f json -o /tmp/report.json 
   python {m} -t {td} --debug
   python {m} -t {td} --lan php -b vendor --debug
+  python {m} --daemon -H 127.0.0.1 -P 5000
 """.format(m='cobra.py', td='tests/vulnerabilities')
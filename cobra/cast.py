@@ -16,9 +16,10 @@ import re
 import traceback
 
 from cobra.core_engine.php.parser import anlysis_params as php_anlysis_params
-from .file import File
-from .file import FileParseAll
+from cobra.core_engine.php.forward import anlysis_params_forward as php_anlysis_params_forward
+from .const import engine_forward
 from .log import logger
+from .pretreatment import ast_object
 from .rule import block
 
 
@@ -28,7 +29,8 @@ class CAST(object):
                  'sol': "sol",
                  'js': "javascript"}
 
-    def __init__(self, rule, target_directory, file_path, line, code, files=None, rule_class=None, repair_functions=[], controlled_params=[]):
+    def __init__(self, rule, target_directory, file_path, line, code, files=None, rule_class=None, repair_functions=[], controlled_params=[],
+                 engine=None, params=None):
         self.target_directory = target_directory
         self.data = []
         self.rule = rule
@@ -42,12 +44,17 @@ class CAST(object):
         self.sr = rule_class
         self.repair_functions = repair_functions
         self.controlled_list = controlled_params
+        self.engine = engine
+        self.params = params
 
         for language in self.languages:
             if self.file_path[-len(language):].lower() == language:
                 self.language = self.languages[language]
 
-        os.chdir(self.target_directory)
+        # 不切换工作目录，相对路径统一基于扫描目标
+        if not os.path.isabs(self.file_path) and not self.file_path.startswith(self.target_directory):
+            self.file_path = os.path.join(self.target_directory, self.file_path)
+
         # Parse rule
         self.regex = {
             'java': {
@@ -81,60 +88,25 @@ class CAST(object):
         get all functions in this file
         :return:
         """
-        # grep = Tool().grep
         if self.language not in self.regex:
             logger.info("[AST] Undefined language's functions regex {0}".format(self.language))
             return False
-        regex_functions = self.regex[self.language]['functions']
-        f = FileParseAll(self.files, self.target_directory)
-        result = f.grep(regex_functions)
-        try:
-            result = result.decode('utf-8')
-        except AttributeError as e:
-            pass
-        if len(result):
-            functions = {}
-            lines = result
-            prev_function_name = ''
-            for index, line in enumerate(lines):
-                if line == ():
-                    logger.info('[AST] Empty')
-                    continue
-
-                if len(line) < 2:
-                    logger.info("[AST] Not found(:)")
-
-                regex_annotation = self.regex[self.language]['annotation']
-                string = re.findall(regex_annotation, line[1])
-                if len(string) >= 1 and string[0] != '':
-                    logger.info("[AST] This function is annotation")
 
-                function_name = re.findall(regex_functions, line[2])
-                if len(function_name) >= 1:
-                    if len(function_name) == 2:
-                        if function_name[0] != '':
-                            function_name = function_name[0]
-                        elif function_name[1] != '':
-                            function_name = function_name[1]
-                    else:
-                        function_name = function_name[0]
-                    if index > 0 and prev_function_name in functions:
-                        functions[prev_function_name]['end'] = line[1]
-                    prev_function_name = function_name
-                    functions[function_name] = {
-                        'start': line[1],
-                        'end': None  # next function's start
-                    }
-                else:
-                    logger.warning("[AST] Can't get function name: {0}".format(line))
-            end = sum(1 for l in open(self.file_path))
-            for name, value in functions.items():
-                if value['end'] is None:
-                    functions[name]['end'] = end
-            return functions
-        else:
+        # 函数范围按文件缓存，有ast时根据ast生成，否则使用正则匹配当前文件
+        ranges = ast_object.get_ranges(self.file_path, self.regex[self.language]['functions'])
+        if not ranges:
             return False
 
+        functions = {}
+        for function_name, start, end in ranges:
+            if function_name in functions:
+                function_name = '{0}:{1}'.format(function_name, start)
+            functions[function_name] = {
+                'start': start,
+                'end': end
+            }
+        return functions
+
     def block_code(self, block_position):
         """
         Get code block
@@ -145,15 +117,17 @@ class CAST(object):
                 3:in-function
         :return:
         """
+        lines = ast_object.get_lines(self.file_path)
+        if lines is False:
+            return False
+
         if block_position == 2:
             if self.line is None or self.line == 0:
                 logger.critical("[AST] Line exception: {0}".format(self.line))
                 return False
-            line_rule = '{0}p'.format(self.line)
-            code = File(self.file_path).lines(line_rule)
-            if code is not False:
-                code = code.strip()
-            return code
+            if not 0 < int(self.line) <= len(lines):
+                return False
+            return lines[int(self.line) - 1].strip()
         else:
             block_start = 1
             block_end = 0
@@ -180,26 +154,29 @@ class CAST(object):
                     block_end = int(self.line) - 1
                 elif block_position == 1:
                     block_start = int(self.line) + 1
-                    block_end = sum(1 for l in open(self.file_path))
+                    block_end = len(lines)
                 elif block_position == 3:
                     block_start = 1
-                    block_end = sum(1 for l in open(self.file_path))
+                    block_end = len(lines)
                 logger.debug("[AST] Not function anything `function`, will split file")
             # get param block code
-            line_rule = "{0},{1}p".format(block_start, block_end)
-            code = File(self.file_path).lines(line_rule)
+            code = "\n".join(lines[int(block_start) - 1:int(block_end)])
             logger.debug('[AST] [BLOCK-CODE-LINES] {0} - {1}p'.format(block_start, block_end))
-            return code
+            return code if code != '' else False
 
     def is_controllable_param(self):
         """
         is controllable param
         :return:
         """
-        param_name = re.findall(self.rule, self.code)
+        if self.params is not None:
+            # 已经从ast中获取了参数
+            params = self.params
+        else:
+            param_name = re.findall(self.rule, self.code)
 
-        if self.sr is not None:
-            params = self.sr.main(param_name)
+            if self.sr is not None:
+                params = self.sr.main(param_name)
 
         if params is None:
             logger.debug("[AST] Not matching variables...")
@@ -232,7 +209,12 @@ class CAST(object):
                     logger.debug("[AST] Is variable: `Yes`")
                     logger.debug("[Deep AST] Start AST for param {param_name}".format(param_name=param_name))
 
-                    _is_co, _cp, expr_lineno, chain = php_anlysis_params(param_name, self.file_path, self.line, self.sr.vul_function, self.repair_functions, self.controlled_list, isexternal=True)
+                    if self.engine == engine_forward:
+                        anlysis_function = php_anlysis_params_forward
+                    else:
+                        anlysis_function = php_anlysis_params
+
+                    _is_co, _cp, expr_lineno, chain = anlysis_function(param_name, self.file_path, self.line, self.sr.vul_function, self.repair_functions, self.controlled_list, isexternal=True)
 
                     if _is_co == 1:
                         logger.debug("[AST] Is assign string: `Yes`")
@@ -243,6 +225,9 @@ class CAST(object):
                     elif _is_co == 4:
                         logger.info("[AST] New vul function {}()".format(_cp[0].name))
                         return False, _is_co, tuple([_is_co, _cp]), chain
+                    elif _is_co == 5:
+                        logger.info("[AST] taint budget exhausted, Unconfirmed vulnerable..")
+                        return False, _is_co, _cp, chain
                     else:
                         continue
 
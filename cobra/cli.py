@@ -18,6 +18,8 @@ from .exceptions import PickupException
 from .export import write_to_file
 from .log import logger
 from .file import Directory
+from .file import get_file_sizes
+from .progress import Progress
 from .utils import ParseArgs
 from .utils import md5, random_generator
 from .pretreatment import ast_object
@@ -36,9 +38,19 @@ def get_sid(target, is_a_sid=False):
     return sid.lower()
 
 
-def start(target, formatter, output, special_rules, a_sid=None, language=None, secret_name=None, black_path=None):
+def start(target, formatter, output, special_rules, a_sid=None, language=None, secret_name=None, black_path=None,
+          step_budget=None, time_budget=None, engine=None, jobs=None, deadline=None, resume=None, progress=False,
+          report_mode=None):
     """
     Start CLI
+    :param report_mode: console report mode, summary or full
+    :param progress: print scan progress in a single updating line
+    :param resume: sid of an interrupted scan to resume
+    :param deadline: max seconds for rules scan, return partial result when exceeded
+    :param jobs: number of processes to scan rules
+    :param engine: taint analysis engine, backward or forward
+    :param time_budget: max seconds for one vulnerability trace
+    :param step_budget: max steps for one vulnerability trace
     :param black_path: 
     :param secret_name: 
     :param language: 
@@ -47,11 +59,12 @@ def start(target, formatter, output, special_rules, a_sid=None, language=None, s
     :param output:
     :param special_rules:
     :param a_sid: all scan id
-    :return:
+    :return: (s_sid, target_directory) of this scan
     """
     global ast_object
     # generate single scan id
-    s_sid = get_sid(target)
+    s_sid = resume or get_sid(target)
+    logger.info('[CLI] Scan sid: {sid}'.format(sid=s_sid))
     r = Running(a_sid)
     data = (s_sid, target)
     r.init_list(data=target)
@@ -95,13 +108,20 @@ def start(target, formatter, output, special_rules, a_sid=None, language=None, s
             logger.info('[CLI] [SPECIAL-RULE] only scan used by {r}'.format(r=','.join(pa.special_rules)))
 
         # Pretreatment ast object
+        scan_progress = Progress(s_sid, console=progress)
+        file_num, file_size = get_file_sizes(files, target_directory)
+        scan_progress.start('pretreatment', files=file_num, size=file_size)
+
         ast_object.init_pre(target_directory, files)
         ast_object.pre_ast(main_language)
+        scan_progress.advance(files=file_num, size=file_size)
 
         # scan
         scan(target_directory=target_directory, a_sid=a_sid, s_sid=s_sid, special_rules=pa.special_rules,
              language=main_language, framework=main_framework, file_count=file_count, extension_count=len(files),
-             files=files, secret_name=secret_name)
+             files=files, secret_name=secret_name, step_budget=step_budget, time_budget=time_budget,
+             engine=engine, jobs=jobs, deadline=deadline, resume=resume is not None, progress=scan_progress,
+             report_mode=report_mode)
     except KeyboardInterrupt as e:
         logger.critical("[!] KeyboardInterrupt, exit...")
         exit()
@@ -122,3 +142,5 @@ def start(target, formatter, output, special_rules, a_sid=None, language=None, s
 
     # 输出写入文件
     write_to_file(target=target, sid=s_sid, output_format=formatter, filename=output)
+
+    return s_sid, target_directory
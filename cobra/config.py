@@ -27,6 +27,8 @@ if os.path.isdir(code_path) is not True:
 running_path = os.path.join(project_directory, code_path, 'running')
 if os.path.isdir(running_path) is not True:
     os.mkdir(running_path)
+rule_stats_path = os.path.join(running_path, 'rule_stats')
+running_db_path = os.path.join(running_path, 'running.db')
 package_path = os.path.join(project_directory, code_path, 'package')
 if os.path.isdir(package_path) is not True:
     os.mkdir(package_path)
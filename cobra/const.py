@@ -38,6 +38,10 @@ fpc = '\s*\((.*)(?:\))'
 fpc_single = '[f]{fpc}'.format(fpc=fpc)
 fpc_multi = '(?:[f]){fpc}'.format(fpc=fpc)
 
+# 语言结构在ast中不是函数调用，function-param-regex规则中的这些sink仍然通过正则匹配
+php_language_constructs = ['echo', 'print', 'exit', 'die', 'eval', 'include', 'include_once', 'require',
+                           'require_once', 'isset', 'empty', 'unset', 'list']
+
 #
 # Find All variables
 #
@@ -51,3 +55,76 @@ ext_dict = {
     "javascript": ['.js'],
     "chromeext": ['.crx'],
 }
+
+#
+# Taint analysis budget
+#
+# 单个漏洞回溯时允许的最大步数以及最长时间(秒)，为0时不限制
+#
+ast_max_steps = 100000
+ast_max_time = 30
+
+# 预算耗尽时无法确定参数是否可控，不作为漏洞输出，只记录数量
+budget_exhausted = 'Budget exhausted(Unconfirmed)'
+
+#
+# Taint analysis engine
+#
+# backward: 对每个sink点单独回溯(默认)
+# forward: 每个文件做一次正向污点传播，文件内所有sink点共用结果
+#
+engine_backward = 'backward'
+engine_forward = 'forward'
+
+engines = [
+    engine_backward,
+    engine_forward,
+]
+
+#
+# Verify tiers
+#
+# regex: 白名单、注释、only-regex等只靠正则就能得出结论
+# token: 只看sink函数的参数，常量参数不可控，直接输入参数可控
+# ast: 其余情况进行污点回溯
+#
+verify_tiers = ('regex', 'token', 'ast')
+
+# 多进程扫描时每个规则的匹配结果按文件切分的份数(每个进程)，份数越多，耗时长的规则越能均匀分配到各个进程
+scan_chunks_per_job = 4
+
+#
+# Report mode
+#
+# summary: 每个规则、每个文件的漏洞数量以及危害等级最高的前N个漏洞(默认)
+# full: 所有漏洞以及每个漏洞的回溯链
+#
+report_summary = 'summary'
+report_full = 'full'
+
+report_modes = [
+    report_summary,
+    report_full,
+]
+
+report_top_num = 20
+
+#
+# Vulnerability level
+#
+# 漏洞危害等级(1-10)，--deadline模式下等级高的规则优先扫描，规则可以通过level属性单独指定
+#
+vulnerability_levels = {
+    'RCE': 10,
+    'SQLI': 9,
+    'RFI': 9,
+    'unserialize vulerablity': 8,
+    'Xml injection': 7,
+    'SSRF': 7,
+    'LDAPI': 6,
+    'variable shadowing': 6,
+    'Reflected XSS': 5,
+    'URL Redirector Abuse': 4,
+    'Information Disclosure': 3,
+}
+vulnerability_level_default = 5
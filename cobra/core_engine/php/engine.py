@@ -9,6 +9,7 @@
 import traceback
 from phply import phpast as php
 from cobra.log import logger
+from cobra.pretreatment import ast_object
 
 
 def init_match_rule(data):
@@ -91,4 +92,63 @@ def init_match_rule(data):
         match2 = None
         index = 0
 
-    return match, match2, vul_function, index
\ No newline at end of file
+    return match, match2, vul_function, index
+
+
+def get_param_names(node):
+    """
+    获取参数表达式中出现的所有变量名
+    :param node: 
+    :return: 
+    """
+    names = []
+    stack = [node]
+
+    while stack:
+        n = stack.pop()
+
+        if isinstance(n, php.Variable) and isinstance(n.name, str):
+            if n.name not in names:
+                names.append(n.name)
+
+        elif isinstance(n, list):
+            stack.extend(n[::-1])
+
+        elif isinstance(n, php.Node):
+            stack.extend(getattr(n, field) for field in n.fields[::-1])
+
+    return names
+
+
+def init_call_sites(data, index):
+    """
+    从预处理阶段建立的调用点索引中获取新规则函数/类的调用位置，代替全项目的正则搜索
+    :param data: 
+    :param index: 可控参数的位置
+    :return: [(file_path, lineno, code, params)]
+    """
+    result = []
+    object = data[0]
+
+    if isinstance(object, php.Method) or isinstance(object, php.Function):
+        calls = ast_object.get_calls(object.name, kind='call')
+    elif isinstance(object, php.Class):
+        calls = ast_object.get_calls(object.name, kind='new')
+    else:
+        return result
+
+    for file_path, lineno, node in calls:
+        # 参数个数不够时使用的是默认值，不可控
+        if len(node.params) <= index:
+            continue
+
+        params = get_param_names(node.params[index].node)
+        if not params:
+            continue
+
+        lines = ast_object.get_lines(file_path)
+        code = lines[lineno - 1] if lines and 0 < lineno <= len(lines) else ""
+
+        result.append((file_path, str(lineno), code, params))
+
+    return result
@@ -0,0 +1,611 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2019/7/5 15:34
+# @Author  : LoRexxar
+# @File    : forward.py
+# @Contact : lorexxar@gmail.com
+
+"""
+正向污点传播引擎
+
+对单个文件只做一次正向遍历，从用户输入出发沿赋值、拼接、数组和修复函数传播污点，
+记录每个函数调用/echo/print/eval/include处各参数的污点状态，之后该文件中所有sink点的查询直接查表。
+结果码与回溯引擎一致：1 可控，2 已修复，3 无法确认，-1 不可控，4 来自函数参数(生成新规则)。
+无法在正向结果中确定的查询(结果为3或没有记录)交回回溯引擎处理。
+"""
+
+import os
+import traceback
+from phply import phpast as php
+
+from cobra.log import logger
+from cobra.pretreatment import ast_object
+from cobra.internal_defines.php.functions import function_dict as php_function_dict
+from cobra.core_engine.php.parser import input_params, get_expr_name, ChainCode
+from cobra.core_engine.php.parser import scan_parser, anlysis_params
+
+# 污点合并时的优先级，-1 < 2 < 3 < 4 < 1
+taint_rank = {-1: 0, 2: 1, 3: 2, 4: 3, 1: 4}
+
+include_fs = ['include', 'include_once', 'require', 'require_once']
+
+forward_cache = {}  # (文件, 修复函数, 输入) -> ForwardTaint
+
+
+class Taint(object):
+    """
+    变量的污点状态，chain通过parent链接，只在需要输出时展开
+    """
+    __slots__ = ('code', 'source', 'lineno', 'step', 'parent')
+
+    def __init__(self, code, source, lineno=0, step=None, parent=None):
+        self.code = code
+        self.source = source
+        self.lineno = lineno
+        self.step = step
+        self.parent = parent
+
+    def derive(self, step):
+        return Taint(self.code, self.source, self.lineno, step, self)
+
+    def chain(self):
+        steps = []
+        taint = self
+        while taint is not None:
+            if taint.step is not None:
+                steps.append(taint.step)
+            taint = taint.parent
+        return steps[::-1]
+
+
+def join(a, b):
+    """
+    合并两个分支的污点状态，取危险程度更高的一个
+    :param a:
+    :param b:
+    :return:
+    """
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if taint_rank[b.code] > taint_rank[a.code]:
+        return b
+    return a
+
+
+def join_state(states):
+    """
+    合并多个分支结束时的变量表
+    :param states:
+    :return:
+    """
+    result = dict(states[0])
+    for state in states[1:]:
+        for name, taint in state.items():
+            result[name] = join(result.get(name), taint)
+    return result
+
+
+class Scope(object):
+    """
+    当前分析的作用域，function为None时为全局代码
+    """
+    def __init__(self, function=None, params=None, default=3):
+        self.function = function
+        self.params = params or set()
+        self.default = default  # 未找到赋值的变量的结果码
+
+
+class ForwardTaint(object):
+    def __init__(self, file_path, repair_functions=None, controlled_params=None):
+        self.file_path = os.path.normpath(file_path)
+        self.repair_functions = frozenset(repair_functions or [])
+        self.controlled_functions = frozenset(controlled_params or [])
+        self.controlled_params = frozenset(input_params).union(self.controlled_functions)
+
+        # (lineno, sink) -> {id(node): [(param, taint), ...]}
+        self.sinks = {}
+        # (lineno, variable) -> taint，为vustomize-match的查询保存语句执行前的状态
+        self.lines = {}
+
+    def run(self):
+        nodes = ast_object.get_nodes(self.file_path)
+        if nodes is None:
+            nodes = []
+
+        self.walk(nodes, {}, Scope())
+        return self
+
+    def lookup(self, name, state, scope, lineno=0):
+        """
+        获取变量当前的污点状态
+        :param name:
+        :param state:
+        :param scope:
+        :param lineno:
+        :return:
+        """
+        if name in self.controlled_params:
+            return Taint(1, php.Variable(name), lineno)
+
+        if name in state:
+            return state[name]
+
+        if name in scope.params:
+            return Taint(4, (scope.function, php.Variable(name)), 0)
+
+        return Taint(scope.default, php.Variable(name), lineno)
+
+    def evaluate(self, expr, state, scope):
+        """
+        计算表达式的污点状态，BinaryOp用工作栈展开，避免长拼接时递归过深
+        :param expr:
+        :param state:
+        :param scope:
+        :return:
+        """
+        result = None
+        stack = [expr]
+
+        while stack:
+            node = stack.pop()
+
+            if isinstance(node, php.BinaryOp):
+                stack.append(node.right)
+                stack.append(node.left)
+                continue
+
+            taint = self.evaluate_node(node, state, scope)
+            result = join(result, taint)
+
+        if result is None:
+            result = Taint(-1, expr, getattr(expr, 'lineno', 0))
+        return result
+
+    def evaluate_node(self, node, state, scope):
+        lineno = getattr(node, 'lineno', 0)
+
+        if isinstance(node, php.Variable):
+            if isinstance(node.name, str):
+                return self.lookup(node.name, state, scope, lineno)
+            return Taint(3, node, lineno)
+
+        if isinstance(node, php.ArrayOffset):
+            return self.evaluate(node.node, state, scope)
+
+        if isinstance(node, (php.Cast, php.Silence, php.UnaryOp)):
+            return self.evaluate(node.expr, state, scope)
+
+        if isinstance(node, php.TernaryOp):
+            iftrue = node.iftrue if node.iftrue is not None else node.expr
+            return join(self.evaluate(iftrue, state, scope), self.evaluate(node.iffalse, state, scope))
+
+        if isinstance(node, php.Array):
+            result = None
+            for element in node.nodes:
+                value = element.value if isinstance(element, php.ArrayElement) else element
+                result = join(result, self.evaluate(value, state, scope))
+            return result
+
+        if isinstance(node, php.Assignment):
+            return self.assign(node, state, scope)
+
+        if isinstance(node, php.FunctionCall):
+            return self.call(node, state, scope)
+
+        if isinstance(node, (php.MethodCall, php.StaticMethodCall, php.New)):
+            for param in node.params:
+                self.evaluate(param.node, state, scope)
+            return Taint(3, node, lineno)
+
+        if isinstance(node, (php.ObjectProperty, php.StaticProperty)):
+            return Taint(3, node, lineno)
+
+        if isinstance(node, php.Eval):
+            taint = self.evaluate(node.expr, state, scope)
+            self.record(node, 'eval', [(node.expr, taint)])
+            return Taint(3, node, lineno)
+
+        # 字符串、数字、常量等
+        return Taint(-1, node, lineno)
+
+    def call(self, node, state, scope):
+        """
+        函数调用，先记录sink参数状态，再计算返回值状态
+        :param node:
+        :param state:
+        :param scope:
+        :return:
+        """
+        lineno = node.lineno
+        taints = [(param.node, self.evaluate(param.node, state, scope)) for param in node.params]
+        self.record(node, node.name, taints)
+
+        if node.name in self.repair_functions:
+            return Taint(2, node.name, lineno)
+
+        if node.name in self.controlled_functions:
+            return Taint(1, node, lineno)
+
+        if node.name in php_function_dict:
+            result = None
+            for param, taint in taints:
+                result = join(result, taint)
+            if result is None:
+                return Taint(-1, node, lineno)
+
+            code = ChainCode("{}={}", node.name, get_expr_name(node)[0])
+            return result.derive(('FunctionCall', code, self.file_path, lineno))
+
+        # 自定义函数的返回值交给回溯引擎
+        return Taint(3, node, lineno)
+
+    def assign(self, node, state, scope):
+        taint = self.evaluate(node.expr, state, scope)
+        target = node.node
+
+        if isinstance(target, php.Variable) and isinstance(target.name, str):
+            code = ChainCode("{}={}", target.name, get_expr_name(node.expr)[0])
+            taint = taint.derive(('Assignment', code, self.file_path, node.lineno))
+            state[target.name] = taint
+
+        elif isinstance(target, php.ArrayOffset):
+            # 数组元素赋值时不覆盖整个数组的状态
+            while isinstance(target, php.ArrayOffset):
+                target = target.node
+            if isinstance(target, php.Variable) and isinstance(target.name, str):
+                state[target.name] = join(state.get(target.name), taint)
+
+        return taint
+
+    def record(self, node, name, taints):
+        """
+        记录sink点各个参数的污点状态，同一位置多次经过(循环)时合并
+        :param node:
+        :param name:
+        :param taints: [(param, taint), ...]
+        :return:
+        """
+        calls = self.sinks.setdefault((int(node.lineno), name), {})
+        if id(node) in calls:
+            taints = [(param, join(old, taint)) for (param, old), (_, taint) in zip(calls[id(node)], taints)]
+        calls[id(node)] = taints
+
+    def snapshot(self, node, state, scope):
+        """
+        保存语句执行前，语句中出现的变量的状态
+        :param node:
+        :param state:
+        :param scope:
+        :return:
+        """
+        stack = [node]
+        while stack:
+            n = stack.pop()
+
+            if isinstance(n, php.Variable) and isinstance(n.name, str):
+                key = (int(n.lineno), n.name)
+                self.lines[key] = join(self.lines.get(key), self.lookup(n.name, state, scope, n.lineno))
+                continue
+
+            if isinstance(n, (php.Function, php.Method, php.Closure, php.Class, php.Block)):
+                continue
+
+            if isinstance(n, php.Node):
+                stack.extend(getattr(n, field) for field in n.fields)
+            elif isinstance(n, list):
+                stack.extend(n)
+
+    def walk(self, nodes, state, scope):
+        """
+        正向遍历语句列表，直接修改state
+        :param nodes:
+        :param state:
+        :param scope:
+        :return:
+        """
+        for node in nodes:
+            if node is None:
+                continue
+
+            if isinstance(node, (php.If, php.While, php.DoWhile, php.For, php.Foreach, php.Switch)):
+                self.snapshot(getattr(node, 'expr', None), state, scope)
+            elif not isinstance(node, (php.Block, php.Try, php.Function, php.Method, php.Class, php.Closure)):
+                self.snapshot(node, state, scope)
+
+            self.statement(node, state, scope)
+
+    def branch(self, node, state, scope):
+        """
+        在state的副本上分析一个分支，返回分支结束时的状态
+        """
+        branch_state = dict(state)
+        if isinstance(node, php.Block):
+            self.walk(node.nodes, branch_state, scope)
+        elif isinstance(node, list):
+            self.walk(node, branch_state, scope)
+        elif node is not None:
+            self.walk([node], branch_state, scope)
+        return branch_state
+
+    def loop(self, node, state, scope, head=None):
+        """
+        循环体分析两遍，让第二遍能看到上一轮循环中的赋值
+        """
+        loop_state = dict(state)
+        for _ in range(2):
+            if head is not None:
+                head(loop_state)
+            loop_state = join_state([loop_state, self.branch(node, loop_state, scope)])
+        state.update(join_state([state, loop_state]))
+
+    def function(self, node, scope_function=None):
+        if isinstance(node, php.Closure):
+            scope = Scope(None, default=3)
+        else:
+            params = set(param.name for param in node.params if isinstance(param, php.FormalParameter))
+            scope = Scope(scope_function or node, params, default=-1)
+
+        self.walk(node.nodes, {}, scope)
+
+    def statement(self, node, state, scope):
+        if isinstance(node, php.Assignment):
+            self.assign(node, state, scope)
+
+        elif isinstance(node, php.AssignOp):
+            taint = join(self.evaluate(node.left, state, scope), self.evaluate(node.right, state, scope))
+            target = node.left
+            while isinstance(target, php.ArrayOffset):
+                target = target.node
+            if isinstance(target, php.Variable) and isinstance(target.name, str):
+                code = ChainCode("{}={}", target.name, get_expr_name(node.right)[0])
+                state[target.name] = taint.derive(('Assignment', code, self.file_path, node.lineno))
+
+        elif isinstance(node, php.ListAssignment):
+            taint = self.evaluate(node.expr, state, scope)
+            for var in node.nodes:
+                if isinstance(var, php.Variable) and isinstance(var.name, str):
+                    state[var.name] = taint
+
+        elif isinstance(node, php.Global):
+            for var in node.nodes:
+                if isinstance(var, php.Variable) and isinstance(var.name, str):
+                    state[var.name] = Taint(3, var, node.lineno)
+
+        elif isinstance(node, php.Static):
+            for var in node.nodes:
+                if isinstance(var, php.StaticVariable):
+                    state[var.name] = self.evaluate(var.initial, state, scope)
+
+        elif isinstance(node, php.Echo):
+            taints = [(n, self.evaluate(n, state, scope)) for n in node.nodes]
+            self.record(node, 'echo', taints)
+
+        elif isinstance(node, php.Print):
+            self.record(node, 'print', [(node.node, self.evaluate(node.node, state, scope))])
+
+        elif isinstance(node, (php.Include, php.Require)):
+            taint = self.evaluate(node.expr, state, scope)
+            for name in include_fs:
+                self.record(node, name, [(node.expr, taint)])
+
+        elif isinstance(node, (php.Return, php.Exit)):
+            target = node.node if isinstance(node, php.Return) else node.expr
+            self.evaluate(target, state, scope)
+
+        elif isinstance(node, php.Block):
+            self.walk(node.nodes, state, scope)
+
+        elif isinstance(node, php.If):
+            self.evaluate(node.expr, state, scope)
+            states = [self.branch(node.node, state, scope)]
+            for elseif in node.elseifs:
+                self.evaluate(elseif.expr, state, scope)
+                states.append(self.branch(elseif.node, state, scope))
+            if node.else_ is not None:
+                states.append(self.branch(node.else_.node, state, scope))
+            else:
+                states.append(state)
+            state.update(join_state(states))
+
+        elif isinstance(node, (php.While, php.DoWhile)):
+            self.evaluate(node.expr, state, scope)
+            self.loop(node.node, state, scope)
+
+        elif isinstance(node, php.For):
+            for expr in (node.start or []) + (node.test or []):
+                self.evaluate(expr, state, scope)
+            self.loop([node.node] + list(node.count or []), state, scope)
+
+        elif isinstance(node, php.Foreach):
+            taint = self.evaluate(node.expr, state, scope)
+
+            def head(loop_state):
+                for var in (node.keyvar, node.valvar):
+                    if isinstance(var, php.ForeachVariable):
+                        var = var.name
+                    if isinstance(var, php.Variable) and isinstance(var.name, str):
+                        loop_state[var.name] = taint
+
+            self.loop(node.node, state, scope, head=head)
+
+        elif isinstance(node, php.Switch):
+            self.evaluate(node.expr, state, scope)
+            states = [state]
+            for case in node.nodes:
+                states.append(self.branch(case.nodes, state, scope))
+            state.update(join_state(states))
+
+        elif isinstance(node, php.Try):
+            states = [self.branch(node.nodes, state, scope)]
+            for catch in node.catches:
+                states.append(self.branch(catch.nodes, state, scope))
+            state.update(join_state(states))
+
+            finally_node = getattr(node, 'finally')
+            if finally_node is not None:
+                self.walk(finally_node.nodes, state, scope)
+
+        elif isinstance(node, (php.Function, php.Method)):
+            self.function(node)
+
+        elif isinstance(node, (php.Class, php.Trait)):
+            for n in node.nodes:
+                if isinstance(n, php.Method):
+                    self.function(n)
+
+        elif isinstance(node, php.Namespace):
+            self.walk(node.nodes or [], state, scope)
+
+        elif isinstance(node, php.Node):
+            # 其他表达式语句，例如单独的函数调用
+            self.evaluate(node, state, scope)
+
+    def query_sink(self, sink, lineno):
+        """
+        查询某一行sink点的参数状态
+        :param sink:
+        :param lineno:
+        :return: None表示没有记录，否则为[(param, taint), ...]
+        """
+        calls = self.sinks.get((int(lineno), sink))
+        if calls is None:
+            return None
+
+        result = []
+        for taints in calls.values():
+            result.extend(taints)
+        return result
+
+    def query_param(self, param, lineno):
+        """
+        查询某一行变量在语句执行前的状态
+        :param param:
+        :param lineno:
+        :return:
+        """
+        return self.lines.get((int(lineno), param))
+
+
+def init_forward():
+    """
+    清空正向分析结果缓存，每次扫描开始时调用
+    :return:
+    """
+    forward_cache.clear()
+
+
+def get_forward(file_path, repair_functions=None, controlled_params=None):
+    """
+    获取文件的正向分析结果，同一文件在相同修复函数和输入下只分析一次
+    :param file_path:
+    :param repair_functions:
+    :param controlled_params:
+    :return:
+    """
+    key = (os.path.normpath(file_path), frozenset(repair_functions or []), frozenset(controlled_params or []))
+
+    if key not in forward_cache:
+        logger.debug("[Forward AST] start forward taint analysis for %s", file_path)
+        try:
+            forward_cache[key] = ForwardTaint(file_path, repair_functions, controlled_params).run()
+        except Exception:
+            logger.warning('[Forward AST] [ERROR]:{e}'.format(e=traceback.format_exc()))
+            forward_cache[key] = None
+
+    return forward_cache[key]
+
+
+def get_code(taint, sink):
+    """
+    sink点在同名函数中时，无法生成新规则(递归)
+    """
+    if taint.code == 4 and taint.source[0].name == sink:
+        logger.info("[Forward AST] Recursive problems may exist in the code, exit the new rules generated...")
+        return -1
+    return taint.code
+
+
+def get_chain(param, taint, file_path, lineno):
+    chain = ['start', ('NewFind', ChainCode("find param {}", param), os.path.normpath(file_path), lineno)]
+    chain.extend(taint.chain())
+    return chain
+
+
+def scan_forward(sensitive_func, vul_lineno, file_path, repair_functions=[], controlled_params=[]):
+    """
+    function-param-regex的正向分析入口，返回值与scan_parser一致
+    :param sensitive_func: 要检测的敏感函数,传入的为函数列表
+    :param vul_lineno: 漏洞函数所在行号
+    :param file_path: 文件路径
+    :param repair_functions:
+    :param controlled_params:
+    :return:
+    """
+    forward = get_forward(file_path, repair_functions, controlled_params)
+
+    if forward is not None:
+        for func in sensitive_func:
+            taints = forward.query_sink(func, vul_lineno)
+            if taints is None:
+                continue
+
+            results = []
+            for param, taint in taints:
+                code = get_code(taint, func)
+                if code == 3:
+                    results = None
+                    break
+
+                if code > 0:
+                    results.append({
+                        'code': code,
+                        'source': taint.source,
+                        'source_lineno': taint.lineno,
+                        'sink': func,
+                        'sink_param:': param,
+                        'sink_lineno': vul_lineno,
+                        "chain": get_chain(param, taint, file_path, vul_lineno),
+                    })
+
+            if results is None:
+                break
+
+            logger.debug("[Forward AST] Scan forward end for %s", results)
+            return results
+
+    logger.debug("[Forward AST] can't confirm sink in line %s, back to AST", vul_lineno)
+    return scan_parser(sensitive_func, vul_lineno, file_path, repair_functions=repair_functions,
+                       controlled_params=controlled_params)
+
+
+def anlysis_params_forward(param, file_path, lineno, vul_function=None, repair_functions=None,
+                           controlled_params=None, isexternal=False):
+    """
+    vustomize-match的正向分析入口，返回值与anlysis_params一致
+    :param param:
+    :param file_path:
+    :param lineno:
+    :param vul_function:
+    :param repair_functions:
+    :param controlled_params:
+    :param isexternal:
+    :return:
+    """
+    name = param
+    while isinstance(name, php.Variable):
+        name = name.name
+
+    if type(name) is str and name.startswith("$") and "->" not in name:
+        forward = get_forward(file_path, repair_functions, controlled_params)
+        taint = forward.query_param(name, lineno) if forward is not None else None
+
+        if taint is not None:
+            code = get_code(taint, vul_function)
+
+            if code != 3:
+                return code, taint.source, taint.lineno, get_chain(php.Variable(name), taint, file_path, lineno)
+
+    return anlysis_params(param, file_path, lineno, vul_function, repair_functions, controlled_params,
+                          isexternal=isexternal)
@@ -16,19 +16,198 @@ from phply.phpparse import make_parser  # 语法分析
 from phply import phpast as php
 import re
 import os
+import time
 import codecs
 import traceback
+from functools import wraps
 
+from cobra.const import ast_max_steps, ast_max_time
+from cobra.exceptions import BudgetExhaustedException
 from cobra.log import logger
 from cobra.pretreatment import ast_object
 from cobra.internal_defines.php.functions import function_dict as php_function_dict
 
 with_line = True
 scan_results = []  # 结果存放列表初始化
-is_repair_functions = []  # 修复函数初始化
-is_controlled_params = []
+is_repair_functions = frozenset()  # 修复函数初始化
+is_controlled_params = frozenset()
 scan_chain = []  # 回溯链变量
 
+# 默认的用户输入
+input_params = [
+    '$_GET',
+    '$_POST',
+    '$_REQUEST',
+    '$_COOKIE',
+    '$_FILES',
+    # '$_SERVER', # 暂时去掉了，误报率太高了
+    '$HTTP_POST_FILES',
+    '$HTTP_COOKIE_VARS',
+    '$HTTP_REQUEST_VARS',
+    '$HTTP_POST_VARS',
+    '$HTTP_RAW_POST_DATA',
+    '$HTTP_GET_VARS'
+]
+is_source_params = frozenset(input_params)  # 默认输入以及规则指定的输入函数
+trace_states = set()  # 当前回溯路径上的状态，用于切断循环回溯
+binaryop_cache = {}  # (id(BinaryOp), real_back) -> (BinaryOp, 展开后的参数列表)
+verify_cache = {}  # (类型, 文件, 行号, sink函数/参数, 修复函数集合, 输入函数集合) -> 回溯结果，所有规则共用
+
+
+class ChainCode(object):
+    """
+    回溯链中的代码描述，只保存格式和节点，输出结果时才生成字符串
+    """
+    __slots__ = ('fmt', 'args')
+
+    def __init__(self, fmt, *args):
+        self.fmt = fmt
+        self.args = args
+
+    def __str__(self):
+        return self.fmt.format(*self.args)
+
+    def __repr__(self):
+        return repr(str(self))
+
+
+class TaintBudget(object):
+    """
+    单个漏洞回溯的预算，步数或者时间超出后停止回溯
+    """
+    def __init__(self, max_steps=ast_max_steps, max_time=ast_max_time):
+        self.max_steps = max_steps
+        self.max_time = max_time
+        self.steps = 0
+        self.deadline = None
+
+    def reset(self):
+        self.steps = 0
+        if self.max_time:
+            self.deadline = time.time() + self.max_time
+        else:
+            self.deadline = None
+
+    def step(self):
+        self.steps += 1
+
+        if self.max_steps and self.steps > self.max_steps:
+            raise BudgetExhaustedException('step budget {} exhausted'.format(self.max_steps))
+
+        if self.deadline is not None and time.time() > self.deadline:
+            raise BudgetExhaustedException('time budget {}s exhausted'.format(self.max_time))
+
+
+taint_budget = TaintBudget()
+
+
+def init_budget(max_steps=None, max_time=None):
+    """
+    配置每个漏洞回溯的预算，None时使用默认值
+    :param max_steps: 最大步数
+    :param max_time: 最长时间(秒)
+    :return: 
+    """
+    taint_budget.max_steps = ast_max_steps if max_steps is None else max_steps
+    taint_budget.max_time = ast_max_time if max_time is None else max_time
+
+
+def init_cache():
+    """
+    清空扫描过程中的缓存，每次扫描开始时调用
+    :return: 
+    """
+    binaryop_cache.clear()
+    verify_cache.clear()
+
+
+def get_verify_key(kind, file_path, lineno, name, vul_function=None):
+    """
+    生成跨规则共用的回溯结果缓存key，修复函数、输入函数集合以及回溯预算不同时不会共用结果
+    :param kind: sink/param
+    :param file_path: 
+    :param lineno: 
+    :param name: sink函数名或参数名
+    :param vul_function: 
+    :return: 
+    """
+    return (kind, os.path.normpath(file_path), int(lineno), name, vul_function,
+            is_repair_functions, is_controlled_params, taint_budget.max_steps, taint_budget.max_time)
+
+
+def copy_results(results):
+    """
+    缓存中的回溯链会被调用方修改(插入NewScan)，返回时复制一份
+    :param results: 
+    :return: 
+    """
+    return [dict(result, chain=list(result['chain'])) for result in results]
+
+
+def init_trace():
+    """
+    每个漏洞开始回溯前重置预算和状态
+    :return: 
+    """
+    global trace_states
+    trace_states = set()
+    taint_budget.reset()
+
+
+def get_param_key(param):
+    """
+    获取污点的状态标识，变量取变量名，其余节点取id
+    :param param: 
+    :return: 
+    """
+    while isinstance(param, php.Variable):
+        param = param.name
+
+    if isinstance(param, (str, int)):
+        return param
+
+    return id(param)
+
+
+def get_nodes_key(nodes):
+    """
+    获取回溯范围的状态标识，parameters_back每次传入的都是新的切片，取切片首尾节点和长度，同一范围的切片得到相同标识
+    :param nodes: 
+    :return: 
+    """
+    if isinstance(nodes, list):
+        if not nodes:
+            return ()
+        return id(nodes[0]), id(nodes[-1]), len(nodes)
+
+    return id(nodes)
+
+
+def trace_state(kind):
+    """
+    以(回溯范围, 变量)作为回溯状态，状态已经在当前回溯路径上时说明出现了循环，直接返回未知
+    :param kind: 回溯类型
+    :return: 
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(param, nodes, *args, **kwargs):
+            taint_budget.step()
+
+            state = (kind, get_nodes_key(nodes), get_param_key(param))
+            if state in trace_states:
+                logger.debug("[AST] %s state for param %s already in trace, skip loop...", kind, param)
+                return 3, param, 0
+
+            trace_states.add(state)
+            try:
+                return func(param, nodes, *args, **kwargs)
+            finally:
+                trace_states.discard(state)
+
+        return wrapper
+    return decorator
+
 
 def export(items):
     result = []
@@ -130,31 +309,57 @@ def get_cast_params(node):
 def get_binaryop_params(node, real_back=False):  # 当为BinaryOp类型时，分别对left和right进行处理，取出需要的变量
     """
     用来提取Binaryop中的参数
+    同一个BinaryOp只展开一次，返回缓存结果的副本
     :param real_back: 
     :param node:
     :return:           
     """
     # logger.debug('[AST] Binaryop --> {node}'.format(node=node))
+    key = (id(node), real_back)
+
+    if key not in binaryop_cache:
+        # 缓存中同时保存node，保证id在扫描过程中不会被复用
+        binaryop_cache[key] = (node, flatten_binaryop(node, real_back))
+
+    return list(binaryop_cache[key][1])
+
+
+def flatten_binaryop(node, real_back=False):
+    """
+    用工作栈按从左到右的顺序展开BinaryOp，长拼接时不会递归过深
+    和逐层递归的结果一致：某一层BinaryOp的右值为FunctionCall时，该层的结果只保留函数参数
+    :param node: 
+    :param real_back: 
+    :return: 
+    """
     params = []
-    buffer_ = []
+    stack = [('open', node, 0)]
 
-    if isinstance(node.left, php.Variable):
-        if real_back:
-            params.append(node.left)
-        else:
-            params.append(node.left.name)
-    else:
-        params = get_binaryop_deep_params(node.left, params, real_back)
+    while stack:
+        action, n, start = stack.pop()
+
+        if action == 'open':  # 进入一层BinaryOp，记录这一层结果的起始位置
+            start = len(params)
+            stack.append(('operand', n.right, start))
+            stack.append(('operand', n.left, start))
+            continue
+
+        if isinstance(n, php.Variable):
+            if real_back:
+                params.append(n)
+            else:
+                params.append(n.name)
+
+        elif isinstance(n, php.BinaryOp):
+            stack.append(('open', n, 0))
+
+        elif isinstance(n, php.FunctionCall):
+            del params[start:]
+            export_list(get_binaryop_deep_params(n, [], real_back), params)
 
-    if isinstance(node.right, php.Variable):
-        if real_back:
-            params.append(node.right)
         else:
-            params.append(node.right.name)
-    else:
-        params = get_binaryop_deep_params(node.right, params, real_back)
+            export_list(get_binaryop_deep_params(n, [], real_back), params)
 
-    params = export_list(params, buffer_)
     return params
 
 
@@ -265,6 +470,36 @@ def get_filename(node, file_path):  # 获取filename
     return filenames
 
 
+def init_policy(repair_functions=None, controlled_params=None):
+    """
+    设置当前规则的修复函数以及输入函数，相同的集合不会重复生成
+    :param repair_functions:
+    :param controlled_params:
+    :return:
+    """
+    global is_repair_functions, is_controlled_params, is_source_params
+
+    if repair_functions is not None:
+        is_repair_functions = frozenset(repair_functions)
+
+    if controlled_params is not None and controlled_params is not is_controlled_params:
+        is_controlled_params = frozenset(controlled_params)
+        is_source_params = frozenset(input_params).union(is_controlled_params)
+
+
+def in_policy(name, policy_set):
+    """
+    集合查找，节点等不可哈希的对象一定不在集合中
+    :param name:
+    :param policy_set:
+    :return:
+    """
+    try:
+        return name in policy_set
+    except TypeError:
+        return False
+
+
 def is_repair(expr):
     """
     判断赋值表达式是否出现过滤函数，如果已经过滤，停止污点回溯，判定漏洞已修复
@@ -272,9 +507,8 @@ def is_repair(expr):
     :return:
     """
     is_re = False  # 是否修复，默认值是未修复
-    global is_repair_functions
-    if expr in is_repair_functions:
-        logger.debug("[AST] function {} in is_repair_functions, The vulnerability does not exist ".format(expr))
+    if in_policy(expr, is_repair_functions):
+        logger.debug("[AST] function %s in is_repair_functions, The vulnerability does not exist ", expr)
         is_re = True
     return is_re
 
@@ -293,7 +527,7 @@ def is_sink_function(param_expr, function_params):
             if param_expr == function_param:
                 is_co = 2
                 cp = function_param
-                logger.debug('[AST] is_sink_function --> {function_param}'.format(function_param=cp))
+                logger.debug('[AST] is_sink_function --> %s', cp)
     return is_co, cp
 
 
@@ -303,31 +537,13 @@ def is_controllable(expr, flag=None):  # 获取表达式中的变量，看是否
     :param expr:
     :return:
     """
-    controlled_params = [
-        '$_GET',
-        '$_POST',
-        '$_REQUEST',
-        '$_COOKIE',
-        '$_FILES',
-        # '$_SERVER', # 暂时去掉了，误报率太高了
-        '$HTTP_POST_FILES',
-        '$HTTP_COOKIE_VARS',
-        '$HTTP_REQUEST_VARS',
-        '$HTTP_POST_VARS',
-        '$HTTP_RAW_POST_DATA',
-        '$HTTP_GET_VARS'
-    ]
-
-    # 传入合并
-    controlled_params += is_controlled_params
-
     if isinstance(expr, php.ObjectProperty):
         return 3, php.Variable(expr)
 
     if isinstance(expr, php.New) or isinstance(expr, php.MethodCall) or isinstance(expr, php.FunctionCall):
         # 一个新的问题，输入可能不来自全局变量，可能来自函数，加入一次check
 
-        if expr.name in is_controlled_params:
+        if in_policy(expr.name, is_controlled_params):
             return 1, expr
 
         return 3, php.Variable(expr)
@@ -335,8 +551,8 @@ def is_controllable(expr, flag=None):  # 获取表达式中的变量，看是否
     if isinstance(expr, php.Variable):
         expr = expr.name
 
-    if expr in controlled_params:  # 当为可控变量时 返回1
-        logger.debug('[AST] is_controllable --> {expr}'.format(expr=expr))
+    if in_policy(expr, is_source_params):  # 当为可控变量时 返回1
+        logger.debug('[AST] is_controllable --> %s', expr)
         if flag:
             return 1, expr
         return 1, php.Variable(expr)
@@ -384,6 +600,7 @@ def is_controllable(expr, flag=None):  # 获取表达式中的变量，看是否
 # return is_co, cp, expr_lineno
 
 
+@trace_state('function')
 def function_back(param, nodes, function_params, vul_function=None, file_path=None, isback=None,
                   parent_node=None):  # 回溯函数定义位置
     """
@@ -417,9 +634,87 @@ def function_back(param, nodes, function_params, vul_function=None, file_path=No
                                                                  vul_function=vul_function, file_path=file_path,
                                                                  isback=isback, parent_node=parent_node)
 
+    if isinstance(param, php.MethodCall) and is_co == 3:
+        class_name = get_object_class(param.node, nodes, parent_node)
+
+        if class_name is not None:
+            is_co, cp, expr_lineno = method_back(param, class_name, vul_function=vul_function, file_path=file_path,
+                                                 isback=isback)
+
     return is_co, cp, expr_lineno
 
 
+def get_this_property(param):
+    """
+    取出$this->prop形式的属性，is_controllable返回的Variable(ObjectProperty)同样处理
+    :param param: 
+    :return: ObjectProperty or None
+    """
+    while isinstance(param, php.Variable) and isinstance(param.name, php.ObjectProperty):
+        param = param.name
+
+    if isinstance(param, php.ObjectProperty) and isinstance(param.node, php.Variable) and \
+            param.node.name == '$this' and isinstance(param.name, str):
+        return param
+
+    return None
+
+
+def get_object_class(param, nodes, parent_node=None):
+    """
+    找到对象变量对应的类名，$this取当前类，其余变量取最近一次new的类
+    :param param: 
+    :param nodes: 
+    :param parent_node: 
+    :return: 类名 or None
+    """
+    if not isinstance(param, php.Variable):
+        return None
+
+    if param.name == '$this':
+        if isinstance(parent_node, php.Class):
+            return parent_node.name
+        return None
+
+    for node in nodes[::-1]:
+        if isinstance(node, php.Assignment) and isinstance(node.node, php.Variable) and node.node.name == param.name:
+            if isinstance(node.expr, php.New) and isinstance(node.expr.name, str):
+                return node.expr.name
+            return None
+
+    return None
+
+
+def method_back(param, class_name, vul_function=None, file_path=None, isback=None):
+    """
+    通过类索引沿继承链找到方法定义，回溯方法的返回值
+    :param param: MethodCall
+    :param class_name: 
+    :param vul_function: 
+    :param file_path: 方法调用所在的文件，用于按照命名空间解析类名
+    :param isback: 
+    :return: 
+    """
+    is_co = 3
+    cp = param
+    expr_lineno = 0
+
+    entry, method = ast_object.get_method(class_name, param.name, file_path, param.lineno)
+    if method is None:
+        return is_co, cp, expr_lineno
+
+    logger.debug("[AST] Find method %s->%s in class %s, start ast in method", class_name, param.name, entry['name'])
+
+    for method_node in method.nodes:
+        if isinstance(method_node, php.Return) and method_node.node is not None:
+            return parameters_back(method_node.node, method.nodes, method.params, lineno=method_node.lineno,
+                                   function_flag=1, vul_function=vul_function, file_path=entry['file'],
+                                   isback=isback, parent_node=entry['node'])
+
+    return is_co, cp, expr_lineno
+
+
+@trace_state('array')
 def array_back(param, nodes, vul_function=None, file_path=None, isback=None):  # 回溯数组定义赋值
     """
     递归回溯数组赋值定义
@@ -480,6 +775,7 @@ def array_back(param, nodes, vul_function=None, file_path=None, isback=None):  #
     return is_co, cp, expr_lineno
 
 
+@trace_state('class')
 def class_back(param, node, lineno, vul_function=None, file_path=None, isback=None, parent_node=None):
     """
     回溯类中变量
@@ -494,8 +790,9 @@ def class_back(param, node, lineno, vul_function=None, file_path=None, isback=No
     """
     class_name = node.name
     class_nodes = node.nodes
+    class_file = file_path
 
-    logger.debug("[AST] param {} in class {}, start into class...".format(param, class_name))
+    logger.debug("[AST] param %s in class %s, start into class...", param, class_name)
 
     vul_nodes = []
     for class_node in class_nodes:
@@ -510,32 +807,53 @@ def class_back(param, node, lineno, vul_function=None, file_path=None, isback=No
         return is_co, cp, expr_lineno
 
     elif is_co == 3:
-        for class_node in class_nodes:
-            if isinstance(class_node, php.Method) and class_node.name == '__construct':
-                class_node_params = class_node.params
-                constructs_nodes = class_node.nodes
-
-                # 递归析构函数
-                is_co, cp, expr_lineno = parameters_back(param, constructs_nodes, function_params=class_node_params,
-                                                         lineno=lineno, function_flag=1, vul_function=vul_function,
-                                                         file_path=file_path,
-                                                         isback=isback)
-
-                if is_co == 3:
-                    # 回溯输入参数
-                    for param in class_node_params:
-                        if param.name == cp.name:
-                            logger.info(
-                                "[Deep AST] Now vulnerability function in class from class {}() param {}".format(
-                                    class_name, cp.name))
-
-                            is_co = 4
-                            cp = tuple([node, param, class_node_params])
-                            return is_co, cp, 0
+        # 构造函数可能继承自父类，通过类索引沿继承链查找
+        construct_class, construct = ast_object.get_method(class_name, '__construct', class_file, node.lineno)
+        if construct is not None:
+            file_path = construct_class['file']
+        else:
+            construct = next((class_node for class_node in class_nodes
+                              if isinstance(class_node, php.Method) and class_node.name == '__construct'), None)
+
+        if construct is not None:
+            class_node_params = construct.params
+            constructs_nodes = construct.nodes
+
+            # 递归析构函数
+            is_co, cp, expr_lineno = parameters_back(param, constructs_nodes, function_params=class_node_params,
+                                                     lineno=lineno, function_flag=1, vul_function=vul_function,
+                                                     file_path=file_path,
+                                                     isback=isback)
+
+            if is_co == 3:
+                # 回溯输入参数
+                for param in class_node_params:
+                    if param.name == cp.name:
+                        logger.info(
+                            "[Deep AST] Now vulnerability function in class from class {}() param {}".format(
+                                class_name, cp.name))
+
+                        is_co = 4
+                        cp = tuple([node, param, class_node_params])
+                        return is_co, cp, 0
+
+    if is_co == 3 and get_this_property(cp) is not None:
+        # 构造函数中没有赋值时，沿继承链找到属性定义，使用属性的默认值
+        property_name = get_this_property(cp).name
+        property_class, variable = ast_object.get_property(class_name, property_name, class_file, node.lineno)
+        if variable is not None and variable.initial is not None:
+            logger.debug("[AST] property %s->%s defined in class %s, check its default value",
+                         class_name, property_name, property_class['name'])
+            is_co, cp = is_controllable(variable.initial)
+            expr_lineno = getattr(variable, 'lineno', 0)
+        else:
+            # 属性在类外或者其他方法中赋值，与之前一样不继续回溯
+            is_co = -1
 
     return is_co, cp, expr_lineno
 
 
+@trace_state('new_class')
 def new_class_back(param, nodes, vul_function=None, file_path=None, isback=None):
     """
     分析新建的class，自动进入tostring函数
@@ -554,6 +872,20 @@ def new_class_back(param, nodes, vul_function=None, file_path=None, isback=None)
     cp = param
     expr_lineno = 0
 
+    # 优先使用类索引，沿继承链查找__toString
+    if ast_object.get_class(param_name, file_path, param.lineno) is not None:
+        entry, tostring = ast_object.get_method(param_name, '__toString', file_path, param.lineno)
+        if tostring is None:
+            return is_co, cp, expr_lineno
+
+        logger.debug("[AST] try to analysize class %s() function tostring in class %s...", param_name, entry['name'])
+        for tostring_node in tostring.nodes:
+            if isinstance(tostring_node, php.Return):
+                return parameters_back(tostring_node.node, tostring.nodes, vul_function=vul_function,
+                                       file_path=entry['file'], isback=isback)
+
+        return is_co, cp, expr_lineno
+
     for node in nodes:
         if isinstance(node, php.Class) and param_name == node.name:
             class_nodes = node.nodes
@@ -561,7 +893,7 @@ def new_class_back(param, nodes, vul_function=None, file_path=None, isback=None)
             for class_node in class_nodes:
                 if isinstance(class_node, php.Method) and class_node.name == '__toString':
                     tostring_nodes = class_node.nodes
-                    logger.debug("[AST] try to analysize class {}() function tostring...".format(param_name))
+                    logger.debug("[AST] try to analysize class %s() function tostring...", param_name)
 
                     for tostring_node in tostring_nodes:
                         if isinstance(tostring_node, php.Return):
@@ -582,7 +914,8 @@ def parameters_back(param, nodes, function_params=None, lineno=0,
                     function_flag=0, vul_function=None, file_path=None,
                     isback=None, parent_node=None):  # 用来得到回溯过程中的被赋值的变量是否与敏感函数变量相等,param是当前需要跟踪的污点
     """
-    递归回溯敏感函数的赋值流程，param为跟踪的污点，当找到param来源时-->分析复制表达式-->获取新污点；否则递归下一个节点
+    回溯敏感函数的赋值流程，param为跟踪的污点，当找到param来源时-->分析复制表达式-->获取新污点；否则继续分析上一个节点
+    节点列表从后向前迭代遍历，不再为每个节点递归一层
     :param parent_node: 父节点 ，为了处理无法确定当前节点位置的问题, 如果是0则是最基础列表
     :param file_path: 
     :param vul_function: 
@@ -596,274 +929,241 @@ def parameters_back(param, nodes, function_params=None, lineno=0,
     """
     global scan_chain
 
-    expr_lineno = 0  # source所在行号
-    if hasattr(param, "name"):
-        # param_name = param.name
-        param_name = get_node_name(param)
-    else:
-        param_name = param
+    end = len(nodes)  # 当前待分析的节点为nodes[:end]
 
-    is_co, cp = is_controllable(param_name)
+    while True:
+        taint_budget.step()
 
-    if (isinstance(param, php.FunctionCall) or isinstance(param, php.MethodCall)) and is_co != 1:  # 当污点为寻找函数时，递归进入寻找函数
-        logger.debug("[AST] AST analysis for FunctionCall or MethodCall {} in line {}".format(param.name, param.lineno))
-        is_co, cp, expr_lineno = function_back(param, nodes, function_params, file_path=file_path, isback=isback)
-        return is_co, cp, expr_lineno
+        expr_lineno = 0  # source所在行号
+        if hasattr(param, "name"):
+            # param_name = param.name
+            param_name = get_node_name(param)
+        else:
+            param_name = param
 
-    if isinstance(param, php.ArrayOffset):  # 当污点为数组时，递归进入寻找数组声明或赋值
-        logger.debug("[AST] AST analysis for ArrayOffset  in line {}".format(param.lineno))
-        is_co, cp, expr_lineno = array_back(param, nodes, file_path=file_path, isback=isback)
-        return is_co, cp, expr_lineno
+        is_co, cp = is_controllable(param_name)
 
-    if isinstance(param, php.New) or (
-                hasattr(param, "name") and isinstance(param.name, php.New)):  # 当污点为新建类事，进入类中tostring函数分析
-        logger.debug("[AST] AST analysis for New Class {} in line {}".format(param.name, param.lineno))
-        is_co, cp, expr_lineno = new_class_back(param, nodes, file_path=file_path,
-                                                isback=isback)
-        return is_co, cp, expr_lineno
+        if (isinstance(param, php.FunctionCall) or isinstance(param, php.MethodCall)) and is_co != 1:  # 当污点为寻找函数时，递归进入寻找函数
+            logger.debug("[AST] AST analysis for FunctionCall or MethodCall %s in line %s", param.name, param.lineno)
+            is_co, cp, expr_lineno = function_back(param, nodes[:end], function_params, file_path=file_path, isback=isback,
+                                                   parent_node=parent_node)
+            return is_co, cp, expr_lineno
 
-    if len(nodes) != 0 and is_co not in [-1, 1, 2]:
-        node = nodes[len(nodes) - 1]
+        if isinstance(param, php.ArrayOffset):  # 当污点为数组时，递归进入寻找数组声明或赋值
+            logger.debug("[AST] AST analysis for ArrayOffset  in line %s", param.lineno)
+            is_co, cp, expr_lineno = array_back(param, nodes[:end], file_path=file_path, isback=isback)
+            return is_co, cp, expr_lineno
 
-        if isinstance(node, php.Assignment) and param_name == get_node_name(node.node):  # 回溯的过程中，对出现赋值情况的节点进行跟踪
-            param_node = get_node_name(node.node)  # param_node为被赋值的变量
-            param_expr, expr_lineno, is_re = get_expr_name(node.expr)  # param_expr为赋值表达式,param_expr为变量或者列表
+        if isinstance(param, php.New) or (
+                    hasattr(param, "name") and isinstance(param.name, php.New)):  # 当污点为新建类事，进入类中tostring函数分析
+            logger.debug("[AST] AST analysis for New Class %s in line %s", param.name, param.lineno)
+            is_co, cp, expr_lineno = new_class_back(param, nodes[:end], file_path=file_path,
+                                                    isback=isback)
+            return is_co, cp, expr_lineno
 
-            if param_name == param_node and is_re is True:
-                is_co = 2
-                cp = param
-                return is_co, cp, expr_lineno
+        if end != 0 and is_co not in [-1, 1, 2]:
+            node = nodes[end - 1]
 
-            if param_name == param_node and not isinstance(param_expr, list):  # 找到变量的来源，开始继续分析变量的赋值表达式是否可控
-                logger.debug(
-                    "[AST] Find {}={} in line {}, start ast for param {}".format(param_name, param_expr, expr_lineno,
-                                                                                 param_expr))
+            if isinstance(node, php.Assignment) and param_name == get_node_name(node.node):  # 回溯的过程中，对出现赋值情况的节点进行跟踪
+                param_node = get_node_name(node.node)  # param_node为被赋值的变量
+                param_expr, expr_lineno, is_re = get_expr_name(node.expr)  # param_expr为赋值表达式,param_expr为变量或者列表
 
-                file_path = os.path.normpath(file_path)
-                code = "{}={}".format(param_name, param_expr)
-                scan_chain.append(('Assignment', code, file_path, node.lineno))
+                if param_name == param_node and is_re is True:
+                    is_co = 2
+                    cp = param
+                    return is_co, cp, expr_lineno
 
-                is_co, cp = is_controllable(param_expr)  # 开始判断变量是否可控
+                if param_name == param_node and not isinstance(param_expr, list):  # 找到变量的来源，开始继续分析变量的赋值表达式是否可控
+                    logger.debug("[AST] Find %s=%s in line %s, start ast for param %s",
+                                 param_name, param_expr, expr_lineno, param_expr)
 
-                if is_co == 1:
-                    return is_co, cp, expr_lineno
+                    file_path = os.path.normpath(file_path)
+                    code = ChainCode("{}={}", param_name, param_expr)
+                    scan_chain.append(('Assignment', code, file_path, node.lineno))
 
-                if is_co != 1 and is_co != 3:
-                    is_co, cp = is_sink_function(param_expr, function_params)
+                    is_co, cp = is_controllable(param_expr)  # 开始判断变量是否可控
 
-                if is_co == -1 and isback is True:
-                    cp = param_expr
+                    if is_co == 1:
+                        return is_co, cp, expr_lineno
 
-                if isinstance(node.expr, php.ArrayOffset):
-                    param = node.expr
-                else:
-                    param = php.Variable(param_expr)  # 每次找到一个污点的来源时，开始跟踪新污点，覆盖旧污点
+                    if is_co != 1 and is_co != 3:
+                        is_co, cp = is_sink_function(param_expr, function_params)
 
-            if param_name == param_node and isinstance(node.expr, php.FunctionCall):  # 当变量来源是函数时，处理函数内容
-                function_name = node.expr.name
+                    if is_co == -1 and isback is True:
+                        cp = param_expr
 
-                logger.debug(
-                    "[AST] Find {} from FunctionCall for {} in line {}, start ast in function {}".format(param_name,
-                                                                                                         function_name,
-                                                                                                         node.lineno,
-                                                                                                         function_name))
-                file_path = os.path.normpath(file_path)
-                code = "{}={}".format(param_name, node.expr)
-                scan_chain.append(('FunctionCall', code, file_path, node.lineno))
+                    if isinstance(node.expr, php.ArrayOffset):
+                        param = node.expr
+                    else:
+                        param = php.Variable(param_expr)  # 每次找到一个污点的来源时，开始跟踪新污点，覆盖旧污点
 
-                # 因为没办法解决内置函数的问题，所以尝试引入内置函数列表，如果在其中，则先跳过
-                if function_name in php_function_dict:
-                    logger.debug("[AST] function {} in php defined function list, continue...".format(function_name))
+                if param_name == param_node and isinstance(node.expr, php.FunctionCall):  # 当变量来源是函数时，处理函数内容
+                    function_name = node.expr.name
 
-                else:
-                    param = node.expr  # 如果没找到函数定义，则将函数作为变量回溯
+                    logger.debug("[AST] Find %s from FunctionCall for %s in line %s, start ast in function %s",
+                                 param_name, function_name, node.lineno, function_name)
+                    file_path = os.path.normpath(file_path)
+                    code = ChainCode("{}={}", param_name, node.expr)
+                    scan_chain.append(('FunctionCall', code, file_path, node.lineno))
+
+                    # 因为没办法解决内置函数的问题，所以尝试引入内置函数列表，如果在其中，则先跳过
+                    if function_name in php_function_dict:
+                        logger.debug("[AST] function %s in php defined function list, continue...", function_name)
+
+                    else:
+                        param = node.expr  # 如果没找到函数定义，则将函数作为变量回溯
+                        is_co = 3
+
+                if param_name == param_node and isinstance(node.expr, php.MethodCall):
+                    # 当右值为方法调用时，暂时按照和function类似的分析方式
+
+                    class_node = node.expr.node.name
+                    class_method_name = node.expr.name
+                    class_method_params = node.expr.params
+
+                    logger.debug("[AST] Find %s from MethodCall from %s->%s in line %s.",
+                                 param_name, class_node, class_method_name, node.lineno)
+
+                    file_path = os.path.normpath(file_path)
+                    code = ChainCode("{}={}->{}", param_name, class_node, class_method_name)
+                    scan_chain.append(('MethodCall', code, file_path, node.lineno))
+
+                    # 将右值置为methodcall
+                    param = node.expr
                     is_co = 3
 
-                    # 尝试寻找函数定义， 看上去应该是冗余代码，因为function call本身就会有处理
-                    # for node in nodes[::-1]:
-                    #     if isinstance(node, php.Function):
-                    #         if node.name == function_name:
-                    #             function_nodes = node.nodes
-                    #
-                    #             # 进入递归函数内语句
-                    #             for function_node in function_nodes:
-                    #                 if isinstance(function_node, php.Return):
-                    #                     return_node = function_node.node
-                    #                     return_param = return_node.node
-                    #                     is_co, cp, expr_lineno = parameters_back(return_param, function_nodes,
-                    #                                                              function_params, lineno, function_flag=1,
-                    #                                                              vul_function=vul_function,
-                    #                                                              file_path=file_path,
-                    #                                                              isback=isback,
-                    #                                                              parent_node=node)
-
-            if param_name == param_node and isinstance(node.expr, php.MethodCall):
-                # 当右值为方法调用时，暂时按照和function类似的分析方式
-
-                class_node = node.expr.node.name
-                class_method_name = node.expr.name
-                class_method_params = node.expr.params
-
-                logger.debug("[AST] Find {} from MethodCall from {}->{} in line {}.".format(param_name, class_node, class_method_name, node.lineno))
+                if param_name == param_node and isinstance(param_expr, list):
+                    logger.debug("[AST] Find %s from list for %s in line %s, start ast for list %s",
+                                 param_name, param_expr, node.lineno, param_expr)
+                    file_path = os.path.normpath(file_path)
+                    code = ChainCode("{}={}", param_name, param_expr)
+                    scan_chain.append(('ListAssignment', code, file_path, node.lineno))
 
-                file_path = os.path.normpath(file_path)
-                code = "{}={}->{}".format(param_name, class_node, class_method_name)
-                scan_chain.append(('MethodCall', code, file_path, node.lineno))
-
-                # 将右值置为methodcall
-                param = node.expr
-                is_co = 3
-
-            if param_name == param_node and isinstance(param_expr, list):
-                logger.debug(
-                    "[AST] Find {} from list for {} in line {}, start ast for list {}".format(param_name,
-                                                                                              param_expr,
-                                                                                              node.lineno,
-                                                                                              param_expr))
-                file_path = os.path.normpath(file_path)
-                code = "{}={}".format(param_name, param_expr)
-                scan_chain.append(('ListAssignment', code, file_path, node.lineno))
+                    # 这里检测的是函数参数列表...如果为空不一定不可控？
+                    if len(param_expr) <= 0 and not (isinstance(node.expr, php.FunctionCall) or isinstance(node.expr, php.MethodCall)):
+                        _is_co = -1
+                        cp = param
+                        return is_co, cp, 0
 
-                # 这里检测的是函数参数列表...如果为空不一定不可控？
-                if len(param_expr) <= 0 and not (isinstance(node.expr, php.FunctionCall) or isinstance(node.expr, php.MethodCall)):
-                    _is_co = -1
-                    cp = param
-                    return is_co, cp, 0
+                    # 如果目标参数就在列表中，就会有新的问题，这里选择，如果存在，则跳过
+                    if param_name in param_expr:
+                        logger.debug("[AST] param %s in list %s, continue...", param_name, param_expr)
 
-                # 如果目标参数就在列表中，就会有新的问题，这里选择，如果存在，则跳过
-                if param_name in param_expr:
-                    logger.debug("[AST] param {} in list {}, continue...".format(param_name, param_expr))
+                    else:
+                        for expr in param_expr:
+                            param = expr
+                            is_co, cp = is_controllable(expr)
 
-                else:
-                    for expr in param_expr:
-                        param = expr
-                        is_co, cp = is_controllable(expr)
+                            if is_co == 1:
+                                return is_co, cp, expr_lineno
 
-                        if is_co == 1:
-                            return is_co, cp, expr_lineno
+                            param = php.Variable(param)
+                            _is_co, _cp, expr_lineno = parameters_back(param, nodes[:end - 1], function_params, lineno,
+                                                                       function_flag=1, vul_function=vul_function,
+                                                                       file_path=file_path,
+                                                                       isback=isback)
 
-                        param = php.Variable(param)
-                        _is_co, _cp, expr_lineno = parameters_back(param, nodes[:-1], function_params, lineno,
-                                                                   function_flag=1, vul_function=vul_function,
-                                                                   file_path=file_path,
-                                                                   isback=isback)
+                            if _is_co != -1:  # 当参数可控时，值赋给is_co 和 cp，有一个参数可控，则认定这个函数可能可控
+                                is_co = _is_co
+                                cp = _cp
 
-                        if _is_co != -1:  # 当参数可控时，值赋给is_co 和 cp，有一个参数可控，则认定这个函数可能可控
-                            is_co = _is_co
-                            cp = _cp
+            elif isinstance(node, php.Function) or isinstance(node, php.Method):
+                function_nodes = node.nodes
+                function_lineno = node.lineno
+                function_params = node.params
+                vul_nodes = []
+
+                # 如果仅仅是函数定义，如果上一次赋值语句不在函数内，那么不应进去函数里分析，应该直接跳过这部分
+                # 在这里想一个解决办法，如果当前父节点为0
+                # 然后最后一个为函数节点，那么如果其中的最后一行代码行数小于目标行数，则不进入
+                if function_nodes[-1].lineno < int(lineno):
+                    end -= 1
+                    function_flag = 0
+                    parent_node = 0
+                    continue
 
-        elif isinstance(node, php.Function) or isinstance(node, php.Method):
-            function_nodes = node.nodes
-            function_lineno = node.lineno
-            function_params = node.params
-            vul_nodes = []
-
-            # 如果仅仅是函数定义，如果上一次赋值语句不在函数内，那么不应进去函数里分析，应该直接跳过这部分
-            # test1 尝试使用行数叠加的方式
-            # 目前测试结果中，这里会出现严重的bug
-            # print(parent_node)
-            # if function_flag == 0 and not isinstance(parent_node, php.Function):
-            #     is_co, cp, expr_lineno = parameters_back(param, nodes[:-1], function_params, lineno,
-            #                                              function_flag=0, vul_function=vul_function,
-            #                                              file_path=file_path,
-            #                                              isback=isback, parent_node=parent_node)
-            #     return is_co, cp, expr_lineno
-
-            # 在这里想一个解决办法，如果当前父节点为0
-            # 然后最后一个为函数节点，那么如果其中的最后一行代码行数小于目标行数，则不进入
-            if function_nodes[-1].lineno < int(lineno):
-                is_co, cp, expr_lineno = parameters_back(param, nodes[:-1], function_params, lineno,
-                                                         function_flag=0, vul_function=vul_function,
-                                                         file_path=file_path,
-                                                         isback=isback, parent_node=0)
-                return is_co, cp, expr_lineno
+                logger.debug("[AST] param %s line %s in function %s line %s, start ast in function",
+                             param_name, lineno, node.name, function_lineno)
 
-            logger.debug(
-                "[AST] param {} line {} in function {} line {}, start ast in function".format(param_name,
-                                                                                              lineno,
-                                                                                              node.name,
-                                                                                              function_lineno))
-
-            file_path = os.path.normpath(file_path)
-            code = "param {} in function {}".format(param_name, node.name)
-            scan_chain.append(('Function', code, file_path, node.lineno))
-
-            for function_node in function_nodes:
-                if function_node is not None and int(function_lineno) < function_node.lineno < int(lineno):
-                    vul_nodes.append(function_node)
-
-            if len(vul_nodes) > 0:
-                is_co, cp, expr_lineno = parameters_back(param, vul_nodes, function_params, function_lineno,
-                                                         function_flag=1, vul_function=vul_function,
-                                                         file_path=file_path,
-                                                         isback=isback, parent_node=None)
-                function_flag = 0
+                file_path = os.path.normpath(file_path)
+                code = ChainCode("param {} in function {}", param_name, node.name)
+                scan_chain.append(('Function', code, file_path, node.lineno))
 
-            if is_co == 3:  # 出现新的敏感函数，重新生成新的漏洞结构，进入新的遍历结构
-                for node_param in node.params:
-                    if node_param.name == cp.name:
-                        logger.debug(
-                            "[AST] param {} line {} in function_params, start new rule for function {}".format(
-                                param_name, node.lineno, node.name))
-
-                        file_path = os.path.normpath(file_path)
-                        code = "param {} in NewFunction {}".format(param_name, node.name)
-                        scan_chain.append(('NewFunction', code, file_path, node.lineno))
-
-                        if vul_function is None or node.name != vul_function:
-                            logger.info(
-                                "[Deep AST] Now vulnerability function from function {}() param {}".format(node.name,
-                                                                                                           cp.name))
-
-                            is_co = 4
-                            cp = tuple([node, param])
-                            return is_co, cp, 0
-                        else:
-                            logger.info(
-                                "[Deep AST] Recursive problems may exist in the code, exit the new rules generated..."
-                            )
-                            # 无法解决递归，直接退出
-                            is_co = -1
-                            return is_co, cp, 0
-
-                # 从函数中出来的变量，如果参数列表中没有，也不能继续递归
-                is_co = -1
-                return is_co, cp, expr_lineno
+                for function_node in function_nodes:
+                    if function_node is not None and int(function_lineno) < function_node.lineno < int(lineno):
+                        vul_nodes.append(function_node)
 
-        elif isinstance(node, php.Class):
-            is_co, cp, expr_lineno = class_back(param, node, lineno, vul_function=vul_function, file_path=file_path,
-                                                isback=isback, parent_node=node)
-            return is_co, cp, expr_lineno
+                if len(vul_nodes) > 0:
+                    is_co, cp, expr_lineno = parameters_back(param, vul_nodes, function_params, function_lineno,
+                                                             function_flag=1, vul_function=vul_function,
+                                                             file_path=file_path,
+                                                             isback=isback, parent_node=None)
+                    function_flag = 0
 
-        elif isinstance(node, php.If):
-            logger.debug(
-                "[AST] param {} line {} in if/else, start ast in if/else".format(param_name, node.lineno))
+                if is_co == 3:  # 出现新的敏感函数，重新生成新的漏洞结构，进入新的遍历结构
+                    for node_param in node.params:
+                        if node_param.name == cp.name:
+                            logger.debug("[AST] param %s line %s in function_params, start new rule for function %s",
+                                         param_name, node.lineno, node.name)
 
-            if isinstance(node.node, php.Block):  # if里可能是代码块，也可能就一句语句
-                if_nodes = node.node.nodes
-                if_node_lineno = node.node.lineno
-            elif node.node is not None:
-                if_nodes = [node.node]
-                if_node_lineno = node.node.lineno
-            else:
-                if_nodes = []
-                if_node_lineno = 0
+                            file_path = os.path.normpath(file_path)
+                            code = ChainCode("param {} in NewFunction {}", param_name, node.name)
+                            scan_chain.append(('NewFunction', code, file_path, node.lineno))
 
-            # 进入分析if内的代码块，如果返回参数不同于进入参数，那么在不同的代码块中，变量值不同，不能统一处理，需要递归进入不同的部分
-            is_co, cp, expr_lineno = parameters_back(param, if_nodes, function_params, if_node_lineno,
-                                                     function_flag=function_flag, vul_function=vul_function,
-                                                     file_path=file_path, isback=isback, parent_node=node)
+                            if vul_function is None or node.name != vul_function:
+                                logger.info(
+                                    "[Deep AST] Now vulnerability function from function {}() param {}".format(node.name,
+                                                                                                               cp.name))
 
-            if is_co == 3 and cp != param:  # 理由如上
-                is_co, cp, expr_lineno = parameters_back(param, nodes[:-1], function_params, lineno,
-                                                         function_flag=function_flag, vul_function=vul_function,
-                                                         file_path=file_path, isback=isback,
-                                                         parent_node=parent_node)  # 找到可控的输入时，停止递归
+                                is_co = 4
+                                cp = tuple([node, param])
+                                return is_co, cp, 0
+                            else:
+                                logger.info(
+                                    "[Deep AST] Recursive problems may exist in the code, exit the new rules generated..."
+                                )
+                                # 无法解决递归，直接退出
+                                is_co = -1
+                                return is_co, cp, 0
+
+                    # $this的属性可能在构造函数中赋值或者有默认值，交给class_back继续回溯
+                    if isinstance(node, php.Method) and get_this_property(cp) is not None:
+                        return is_co, cp, expr_lineno
+
+                    # 从函数中出来的变量，如果参数列表中没有，也不能继续递归
+                    is_co = -1
+                    return is_co, cp, expr_lineno
+
+            elif isinstance(node, php.Class):
+                is_co, cp, expr_lineno = class_back(param, node, lineno, vul_function=vul_function, file_path=file_path,
+                                                    isback=isback, parent_node=node)
                 return is_co, cp, expr_lineno
 
-            if is_co is not 1 and node.elseifs != []:  # elseif可能有多个，所以需要列表
+            elif isinstance(node, php.If):
+                logger.debug("[AST] param %s line %s in if/else, start ast in if/else", param_name, node.lineno)
+
+                if isinstance(node.node, php.Block):  # if里可能是代码块，也可能就一句语句
+                    if_nodes = node.node.nodes
+                    if_node_lineno = node.node.lineno
+                elif node.node is not None:
+                    if_nodes = [node.node]
+                    if_node_lineno = node.node.lineno
+                else:
+                    if_nodes = []
+                    if_node_lineno = 0
+
+                # 进入分析if内的代码块，如果返回参数不同于进入参数，那么在不同的代码块中，变量值不同，不能统一处理，需要进入不同的部分
+                is_co, cp, expr_lineno = parameters_back(param, if_nodes, function_params, if_node_lineno,
+                                                         function_flag=function_flag, vul_function=vul_function,
+                                                         file_path=file_path, isback=isback, parent_node=node)
+
+                if is_co == 3 and cp != param:  # 理由如上
+                    end -= 1  # 找到可控的输入时，停止回溯
+                    continue
+
+                if is_co != 1 and node.elseifs != []:  # elseif可能有多个，目前只分析第一个
+                    node_elseifs_node = node.elseifs[0]
 
-                for node_elseifs_node in node.elseifs:
                     if isinstance(node_elseifs_node.node, php.Block):
                         elif_nodes = node_elseifs_node.node.nodes
                         elif_node_lineno = node_elseifs_node.node.lineno
@@ -880,90 +1180,125 @@ def parameters_back(param, nodes, function_params=None, lineno=0,
                                                              isback=isback, parent_node=node)
 
                     if is_co == 3 and cp != param:  # 理由如上
-                        is_co, cp, expr_lineno = parameters_back(param, nodes[:-1], function_params, lineno,
-                                                                 function_flag=function_flag, vul_function=vul_function,
-                                                                 file_path=file_path,
-                                                                 isback=isback, parent_node=parent_node)  # 找到可控的输入时，停止递归
-                        return is_co, cp, expr_lineno
+                        end -= 1  # 找到可控的输入时，停止回溯
+                        continue
+
+                if is_co != 1 and node.else_ != [] and node.else_ is not None:
+                    if isinstance(node.else_.node, php.Block):
+                        else_nodes = node.else_.node.nodes
+                        else_node_lineno = node.else_.node.lineno
+                    elif node.else_.node is not None:
+                        else_nodes = [node.else_.node]
+                        else_node_lineno = node.else_.node.lineno
                     else:
-                        break
-
-            if is_co is not 1 and node.else_ != [] and node.else_ is not None:
-                if isinstance(node.else_.node, php.Block):
-                    else_nodes = node.else_.node.nodes
-                    else_node_lineno = node.else_.node.lineno
-                elif node.else_.node is not None:
-                    else_nodes = [node.else_.node]
-                    else_node_lineno = node.else_.node.lineno
-                else:
-                    else_nodes = []
-                    else_node_lineno = 0
+                        else_nodes = []
+                        else_node_lineno = 0
 
-                is_co, cp, expr_lineno = parameters_back(param, else_nodes, function_params, else_node_lineno,
-                                                         function_flag=function_flag, vul_function=vul_function,
-                                                         file_path=file_path, isback=isback, parent_node=node)
-
-                if is_co == 3 and cp != param:  # 理由如上
-                    is_co, cp, expr_lineno = parameters_back(param, nodes[:-1], function_params, lineno,
+                    is_co, cp, expr_lineno = parameters_back(param, else_nodes, function_params, else_node_lineno,
                                                              function_flag=function_flag, vul_function=vul_function,
-                                                             file_path=file_path,
-                                                             isback=isback, parent_node=parent_node)  # 找到可控的输入时，停止递归
-                    return is_co, cp, expr_lineno
+                                                             file_path=file_path, isback=isback, parent_node=node)
 
-        elif isinstance(node, php.For):
-            for_nodes = node.node.nodes
-            for_node_lineno = node.node.lineno
+                    if is_co == 3 and cp != param:  # 理由如上
+                        end -= 1  # 找到可控的输入时，停止回溯
+                        continue
 
-            logger.debug(
-                "[AST] param {} line {} in for, start ast in for".format(param_name, for_node_lineno))
+            elif isinstance(node, php.For):
+                for_nodes = node.node.nodes
+                for_node_lineno = node.node.lineno
 
-            is_co, cp, expr_lineno = parameters_back(param, for_nodes, function_params, for_node_lineno,
-                                                     function_flag=1, vul_function=vul_function, file_path=file_path,
-                                                     isback=isback, parent_node=node)
-            function_flag = 0
+                logger.debug("[AST] param %s line %s in for, start ast in for", param_name, for_node_lineno)
 
-        if is_co == 3 or int(lineno) == node.lineno:  # 当is_co为True时找到可控，停止递归
-            is_co, cp, expr_lineno = parameters_back(param, nodes[:-1], function_params, lineno,
-                                                     function_flag=function_flag, vul_function=vul_function,
-                                                     file_path=file_path,
-                                                     isback=isback, parent_node=0)  # 找到可控的输入时，停止递归
+                is_co, cp, expr_lineno = parameters_back(param, for_nodes, function_params, for_node_lineno,
+                                                         function_flag=1, vul_function=vul_function, file_path=file_path,
+                                                         isback=isback, parent_node=node)
+                function_flag = 0
 
-    elif len(nodes) == 0 and function_params is not None:  # 当敏感函数在函数中时，function_params不为空，这时应进入自定义敏感函数逻辑
-        for function_param in function_params:
-            if function_param == param:
-                logger.debug(
-                    "[AST] param {} in function_params, start new rule".format(param_name))
-                is_co = 2
-                cp = function_param
+            if is_co == 3 or int(lineno) == node.lineno:  # 当is_co为True时找到可控，停止回溯
+                end -= 1
+                parent_node = 0
+                continue
 
-    return is_co, cp, expr_lineno
+        elif end == 0 and function_params is not None:  # 当敏感函数在函数中时，function_params不为空，这时应进入自定义敏感函数逻辑
+            for function_param in function_params:
+                if function_param == param:
+                    logger.debug("[AST] param %s in function_params, start new rule", param_name)
+                    is_co = 2
+                    cp = function_param
+
+        return is_co, cp, expr_lineno
 
 
 def deep_parameters_back(param, back_node, function_params, count, file_path, lineno=0, vul_function=None,
                          isback=False):
     """
-    深度递归遍历
+    深度遍历，当前文件无法确定污点来源时进入include的文件继续回溯
+    include文件通过工作栈迭代处理，(文件, 变量)状态已在栈上时不再重复进入，超出预算时返回5
     :param isback: 是否返回
     :param vul_function: 
     :param lineno: 
     :param param: 
     :param back_node:
     :param function_params: 
+    :param count: 兼容旧接口，深度由回溯预算控制
     :param file_path: 
     :return: 
     """
-    count += 1
+    stack = [include_back(param, back_node, function_params, file_path, lineno, vul_function, isback)]
+    stack_states = [('include', os.path.normpath(file_path or ''), get_param_key(param))]
+    result = None
+
+    try:
+        while stack:
+            try:
+                request = stack[-1].send(result)
+            except StopIteration as e:
+                stack.pop()
+                stack_states.pop()
+                result = e.value
+                continue
+
+            # 需要进入新的文件或者回溯include路径中的变量
+            n_param, n_nodes, n_file_path, n_isback = request
+            state = ('include', os.path.normpath(n_file_path or ''), get_param_key(n_param))
+
+            if state in stack_states:
+                logger.debug("[Deep AST] param %s in %s already in trace, skip loop...", n_param, n_file_path)
+                result = (3, n_param, 0)
+                continue
+
+            stack.append(include_back(n_param, n_nodes, function_params, n_file_path, lineno, vul_function, n_isback))
+            stack_states.append(state)
+            result = None
+
+    except BudgetExhaustedException as e:
+        logger.warning("[Deep AST] {}, stop trace for param {}...".format(e, param))
+
+        code = ChainCode("{} for param {}", e, param)
+        scan_chain.append(('BudgetExhausted', code, file_path, lineno))
+        return 5, param, 0
+
+    return result
+
+
+def include_back(param, back_node, function_params, file_path, lineno=0, vul_function=None, isback=False):
+    """
+    deep_parameters_back中的单个回溯单元，需要进入新的文件时yield (param, nodes, file_path, isback)，由工作栈返回回溯结果
+    :param param: 
+    :param back_node: 
+    :param function_params: 
+    :param file_path: 
+    :param lineno: 
+    :param vul_function: 
+    :param isback: 
+    :return: 
+    """
     padding = {}
 
     is_co, cp, expr_lineno = parameters_back(param, back_node, function_params, lineno, vul_function=vul_function,
                                              file_path=file_path, isback=isback, parent_node=0)
 
-    if count > 20:
-        logger.warning("[Deep AST] depth too big, auto exit...")
-        return is_co, cp, expr_lineno
-
     if is_co == 3:
-        logger.debug("[Deep AST] try to find include, start deep AST for {}".format(cp))
+        logger.debug("[Deep AST] try to find include, start deep AST for %s", cp)
 
         for node in back_node[::-1]:
             if isinstance(node, php.Include):
@@ -977,17 +1312,13 @@ def deep_parameters_back(param, back_node, function_params, count, file_path, li
                     for param in params:
                         # 主要解决两个问题，一个是全局define，一个是变量
                         if isinstance(param, php.Variable):
-                            logger.debug(
-                                "[AST][INCLUDE] The include file name has an unknown parameter {}.".format(param))
+                            logger.debug("[AST][INCLUDE] The include file name has an unknown parameter %s.", param)
 
                             file_path = os.path.normpath(file_path)
-                            code = "find {} in Include path".format(param, file_path)
+                            code = ChainCode("find {} in Include path", param, file_path)
                             scan_chain.append(('IncludePath', code, file_path, node.lineno))
 
-                            is_co, ccp, expr_lineno = deep_parameters_back(param, back_node[:back_node.index(node)],
-                                                                           function_params, count,
-                                                                           file_path, lineno, vul_function=vul_function,
-                                                                           isback=True)
+                            is_co, ccp, expr_lineno = yield (param, back_node[:back_node.index(node)], file_path, True)
 
                             if is_co == -1:
                                 padding[param.name] = ccp
@@ -1011,7 +1342,7 @@ def deep_parameters_back(param, back_node, function_params, count, file_path, li
                 file_path_name = "/".join(file_path_list)
 
                 try:
-                    logger.debug("[Deep AST] open new file {file_path}".format(file_path=file_path_name))
+                    logger.debug("[Deep AST] open new file %s", file_path_name)
 
                     all_nodes = ast_object.get_nodes(file_path_name)
 
@@ -1022,11 +1353,10 @@ def deep_parameters_back(param, back_node, function_params, count, file_path, li
                 node = cp
 
                 file_path = os.path.normpath(file_path)
-                code = "find {} in Include {}".format(node, file_path_name)
+                code = ChainCode("find {} in Include {}", node, file_path_name)
                 scan_chain.append(('Include', code, file_path, node.lineno))
 
-                is_co, cp, expr_lineno = deep_parameters_back(node, all_nodes, function_params, count, file_path_name,
-                                                              lineno, vul_function=vul_function, isback=isback)
+                is_co, cp, expr_lineno = yield (node, all_nodes, file_path_name, isback)
                 if is_co == -1 or is_co == 1:
                     break
 
@@ -1079,23 +1409,32 @@ def anlysis_params(param, file_path, lineno, vul_function=None, repair_functions
     :param file_path: 
     :return: 
     """
-    global is_repair_functions, is_controlled_params, scan_chain
+    global scan_chain
     count = 0
     function_params = None
-    if repair_functions is not None:
-        is_repair_functions = repair_functions
+    init_policy(repair_functions, controlled_params)
 
-    if controlled_params is not None:
-        is_controlled_params = controlled_params
+    # 外部调用的参数为字符串时，相同位置的回溯结果可以直接复用
+    if isexternal and type(param) is str:
+        key = get_verify_key('param', file_path, lineno, param, vul_function)
+
+        if key not in verify_cache:
+            scan_chain = ['start']
+            init_trace()
+            verify_cache[key] = anlysis_params(param, file_path, lineno, vul_function=vul_function)
+
+        is_co, cp, expr_lineno, chain = verify_cache[key]
+        return is_co, cp, expr_lineno, list(chain)
+
+    if isexternal:
+        scan_chain = ['start']
+        init_trace()
 
     if type(param) is str and "->" in param:
         param_left = php.Variable(param.split("->")[0])
         param_right = param.split("->")[1]
         param = php.ObjectProperty(param_left, param_right)
 
-    if isexternal:
-        scan_chain = ['start']
-
     all_nodes = ast_object.get_nodes(file_path)
 
     # 做一次处理，解决Variable(Variable('$id'))的问题
@@ -1112,8 +1451,8 @@ def anlysis_params(param, file_path, lineno, vul_function=None, repair_functions
     
         param = php.Variable(param)
 
-    logger.debug("[AST] AST to find param {}".format(param))
-    code = "find param {}".format(param)
+    logger.debug("[AST] AST to find param %s", param)
+    code = ChainCode("find param {}", param)
     scan_chain.append(('NewFind', code, file_path, lineno))
 
     vul_nodes = []
@@ -1157,6 +1496,10 @@ def anlysis_function(node, back_node, vul_function, function_params, vul_lineno,
                 if isinstance(param.node, php.ArrayOffset):
                     analysis_arrayoffset_node(param.node, vul_function, vul_lineno)
 
+                if isinstance(param.node, php.ObjectProperty):
+                    analysis_objectproperry_node(param.node, back_node, vul_function, vul_lineno, function_params,
+                                                 file_path=file_path)
+
     except Exception as e:
         logger.debug(traceback.format_exc())
 
@@ -1201,7 +1544,7 @@ def analysis_binaryop_node(node, back_node, vul_function, vul_lineno, function_p
     :param function_params:
     :return:
     """
-    logger.debug('[AST] vul_function:{v}'.format(v=vul_function))
+    logger.debug('[AST] vul_function:%s', vul_function)
     params = get_binaryop_params(node)
     params = export_list(params, export_params=[])
 
@@ -1231,7 +1574,7 @@ def analysis_objectproperry_node(node, back_node, vul_function, vul_lineno, func
     :param function_params:
     :return:
     """
-    logger.debug('[AST] vul_function:{v}'.format(v=vul_function))
+    logger.debug('[AST] vul_function:%s', vul_function)
 
     param = node
     param_lineno = node.lineno
@@ -1259,7 +1602,7 @@ def analysis_arrayoffset_node(node, vul_function, vul_lineno):
     :param vul_lineno:
     :return:
     """
-    logger.debug('[AST] vul_function:{v}'.format(v=vul_function))
+    logger.debug('[AST] vul_function:%s', vul_function)
     param = get_node_name(node.node)
     expr_lineno = node.lineno
     is_co, cp = is_controllable(param)
@@ -1278,7 +1621,7 @@ def analysis_functioncall_node(node, back_node, vul_function, vul_lineno, functi
     :param function_params:
     :return:
     """
-    logger.debug('[AST] vul_function:{v}'.format(v=vul_function))
+    logger.debug('[AST] vul_function:%s', vul_function)
     params = get_all_params(node.params)
     for param in params:
         param = php.Variable(param)
@@ -1305,7 +1648,7 @@ def analysis_variable_node(node, back_node, vul_function, vul_lineno, function_p
     :param function_params:
     :return:
     """
-    logger.debug('[AST] vul_function:{v}'.format(v=vul_function))
+    logger.debug('[AST] vul_function:%s', vul_function)
     param = get_node_name(node)
     param_lineno = node.lineno
 
@@ -1332,7 +1675,7 @@ def analysis_ternaryop_node(node, back_node, vul_function, vul_lineno, function_
     :param file_path: 
     :return: 
     """
-    logger.debug('[AST] vul_function:{v}'.format(v=vul_function))
+    logger.debug('[AST] vul_function:%s', vul_function)
     param = node.expr
     node1 = node.iftrue
     node2 = node.iffalse
@@ -1343,7 +1686,7 @@ def analysis_ternaryop_node(node, back_node, vul_function, vul_lineno, function_
     if type(node2) is int:
         node2 = php.Variable(node2)
 
-    logger.debug('[AST] vul_param1: {}, vul_param2: {}'.format(node1, node2))
+    logger.debug('[AST] vul_param1: %s, vul_param2: %s', node1, node2)
 
     count = 0
     is_co, cp, expr_lineno = deep_parameters_back(node1, back_node, function_params, count, file_path)
@@ -1522,7 +1865,7 @@ def analysis_file_inclusion(node, vul_function, back_node, vul_lineno, function_
     include_fs = ['include', 'include_once', 'require', 'require_once']
 
     if vul_function in include_fs and int(node.lineno) == int(vul_lineno):
-        logger.debug('[AST-INCLUDE] {l}-->{r}'.format(l=vul_function, r=vul_lineno))
+        logger.debug('[AST-INCLUDE] %s-->%s', vul_function, vul_lineno)
 
         if isinstance(node.expr, php.Variable):
             analysis_variable_node(node.expr, back_node, vul_function, vul_lineno, function_params, file_path=file_path)
@@ -1644,24 +1987,119 @@ def scan_parser(sensitive_func, vul_lineno, file_path, repair_functions=[], cont
     :return:
     """
     try:
-        global scan_results, is_repair_functions, is_controlled_params, scan_chain
+        global scan_results, scan_chain
 
-        scan_chain = ['start']
         scan_results = []
-        is_repair_functions = repair_functions
-        is_controlled_params = controlled_params
+        init_policy(repair_functions, controlled_params)
         all_nodes = ast_object.get_nodes(file_path)
 
         for func in sensitive_func:  # 循环判断代码中是否存在敏感函数，若存在，递归判断参数是否可控;对文件内容循环判断多次
-            back_node = []
-            analysis(all_nodes, func, back_node, int(vul_lineno), file_path, function_params=None)
+            # 每个sink函数单独缓存，sink函数列表有重叠的规则可以共用结果
+            key = get_verify_key('sink', file_path, vul_lineno, func)
+
+            if key not in verify_cache:
+                scan_chain = ['start']
+                scan_results = []
+                init_trace()
+                back_node = []
+                analysis(all_nodes, func, back_node, int(vul_lineno), file_path, function_params=None)
+                verify_cache[key] = scan_results
+
+            scan_results = copy_results(verify_cache[key])
 
             # 如果检测到一次，那么就可以退出了
             if len(scan_results) > 0:
-                logger.debug("[AST] Scan parser end for {}".format(scan_results))
+                logger.debug("[AST] Scan parser end for %s", scan_results)
                 break
 
     except SyntaxError as e:
         logger.warning('[AST] [ERROR]:{e}'.format(e=traceback.format_exc()))
 
     return scan_results
+
+
+def is_literal_param(node):
+    """
+    参数是否只由常量组成，常量字符串拼接同样视为常量
+    :param node:
+    :return:
+    """
+    if isinstance(node, php.BinaryOp):
+        return is_literal_param(node.left) and is_literal_param(node.right)
+
+    return isinstance(node, (str, int, float))
+
+
+def get_source_param(node):
+    """
+    参数直接为输入变量时返回输入变量名，e.g. $_GET、$_GET['a']
+    :param node:
+    :return:
+    """
+    if isinstance(node, php.ArrayOffset):
+        node = node.node
+
+    if isinstance(node, php.Variable) and in_policy(node.name, is_source_params):
+        return node.name
+
+    return None
+
+
+def token_check(sensitive_func, vul_lineno, file_path, controlled_params=None):
+    """
+    不回溯，只看漏洞行sink函数调用的参数：
+    参数全部为常量时不可控，参数直接为输入变量时可控，其余情况返回None，交给ast回溯
+    :param sensitive_func: 要检测的敏感函数列表
+    :param vul_lineno: 漏洞函数所在行号
+    :param file_path: 文件路径
+    :param controlled_params:
+    :return: 与scan_parser相同格式的结果，无法判断时返回None
+    """
+    init_policy(controlled_params=controlled_params)
+
+    found = False
+    results = []
+    for func in sensitive_func:
+        for _, lineno, node in ast_object.get_calls(func, filepath=file_path):
+            if int(lineno) != int(vul_lineno) or not isinstance(node, php.FunctionCall) or \
+                    node.name.lstrip('\\').lower() != func.lower():
+                continue
+
+            found = True
+            for param in node.params:
+                if is_literal_param(param.node):
+                    continue
+
+                source = get_source_param(param.node)
+                if source is None:
+                    logger.debug('[AST] [TOKEN] %s param can\'t be decided, escalate', func)
+                    return None
+
+                if not results:
+                    results.append({
+                        'code': 1,
+                        'source': php.Variable(source),
+                        'source_lineno': param.node.lineno,
+                        'sink': func,
+                        'sink_param:': source,
+                        'sink_lineno': vul_lineno,
+                        'chain': ['start', ('NewFind', ChainCode("find param {}", param.node),
+                                            os.path.normpath(file_path), vul_lineno)],
+                    })
+
+    if not found:
+        return None
+
+    if not results:
+        logger.debug('[AST] [TOKEN] %s params are all literal', sensitive_func)
+        results.append({
+            'code': -1,
+            'source': None,
+            'source_lineno': vul_lineno,
+            'sink': sensitive_func[0],
+            'sink_param:': None,
+            'sink_lineno': vul_lineno,
+            'chain': ['start'],
+        })
+
+    return results
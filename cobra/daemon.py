@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+
+"""
+    daemon
+    ~~~~~~
+
+    Implements scan daemon with a local HTTP/Unix socket API
+
+    :author:    LoRexxar <LoRexxar@gmail.com>
+    :homepage:  https://github.com/LoRexxar/cobra
+    :license:   MIT, see LICENSE for more details.
+    :copyright: Copyright (c) 2017 LoRexxar. All rights reserved
+"""
+import asyncio
+import json
+import os
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, parse_qs
+
+from . import cli
+from . import const
+from .engine import Running
+from .log import logger
+from .pretreatment import ast_object, get_parser
+from .rule import Rule
+from .store import store
+
+http_reasons = {
+    200: 'OK',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    500: 'Internal Server Error',
+}
+
+# 添加扫描时可以指定的参数 -> cli.start的参数
+job_options = {
+    'format': 'formatter',
+    'output': 'output',
+    'rule': 'special_rules',
+    'language': 'language',
+    'secret': 'secret_name',
+    'black_path': 'black_path',
+    'step_budget': 'step_budget',
+    'time_budget': 'time_budget',
+    'engine': 'engine',
+    'jobs': 'jobs',
+    'deadline': 'deadline',
+    'report': 'report_mode',
+}
+
+# 整数参数 -> 最小值，与命令行参数的类型相同
+int_options = {
+    'jobs': 1,
+    'deadline': 0,
+    'step_budget': 0,
+    'time_budget': 0,
+}
+
+
+class Daemon(object):
+    """
+    常驻扫描进程，规则、修复函数配置、语法分析表以及没有修改过的文件的ast在多次扫描之间保留
+    通过本地的HTTP(或Unix socket)接口添加扫描，扫描按添加顺序逐个执行，状态以及结果保存在Running中
+    """
+    def __init__(self, host='127.0.0.1', port=5000, unix_socket=None):
+        self.host = host
+        self.port = port
+        self.unix_socket = unix_socket
+
+        self.queue = None
+        self.current = None  # 正在扫描的a_sid
+        # 扫描依赖全局的预处理结果和缓存，同一时间只执行一个扫描，事件循环只处理请求
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def warm_up(self):
+        """
+        启动时加载规则以及生成语法分析表，第一个扫描不需要等待
+        :return:
+        """
+        Rule(['php'])
+        get_parser()
+        logger.info('[DAEMON] Rules and parser tables loaded')
+
+    def add(self, params):
+        """
+        添加扫描
+        :param params: {'target': ..., 'sid': ..., 'format': ..., 'rule': ..., ...}
+        :return: a_sid
+        """
+        target = params.get('target')
+        if not target or not isinstance(target, str):
+            raise ValueError('target is required')
+        if params.get('engine') is not None and params['engine'] not in const.engines:
+            raise ValueError('unknown engine {}'.format(params['engine']))
+        if params.get('report') is not None and params['report'] not in const.report_modes:
+            raise ValueError('unknown report mode {}'.format(params['report']))
+        if params.get('format') is not None and params['format'] not in ['html', 'json', 'csv', 'xml']:
+            raise ValueError('unknown format {}'.format(params['format']))
+
+        params = dict(params)
+        for key, minimum in int_options.items():
+            value = params.get(key)
+            if value is None:
+                continue
+            if isinstance(value, str) and value.strip().lstrip('-').isdigit():
+                value = int(value)
+            if isinstance(value, bool) or not isinstance(value, int):
+                raise ValueError('{} must be an integer'.format(key))
+            if value < minimum:
+                raise ValueError('{} must be at least {}'.format(key, minimum))
+            params[key] = value
+
+        a_sid = params.get('sid') or cli.get_sid(target, True)
+        job = {'target': target, 'a_sid': a_sid, 'formatter': 'csv', 'output': ''}
+        for key, option in job_options.items():
+            if params.get(key) is not None:
+                job[option] = str(params[key]) if key == 'rule' else params[key]
+
+        Running(a_sid).status({'status': 'queued', 'report': ''})
+        self.queue.put_nowait(job)
+        logger.info('[DAEMON] Add scan {sid}: {target}'.format(sid=a_sid, target=target))
+        return a_sid
+
+    def run_job(self, job):
+        """
+        在扫描线程中执行扫描，与命令行扫描相同
+        :param job:
+        :return:
+        """
+        job = dict(job)
+        a_sid = job.pop('a_sid')
+        target = job.pop('target')
+
+        Running(a_sid).status({'status': 'running', 'report': ''})
+        target_directory = None
+        try:
+            s_sid, target_directory = cli.start(target, job.pop('formatter'), job.pop('output'),
+                                                job.pop('special_rules', None), a_sid, job.pop('language', None),
+                                                job.pop('secret_name', None), job.pop('black_path', None), **job)
+            logger.info('[DAEMON] Scan {sid} done: {s_sid}'.format(sid=a_sid, s_sid=s_sid))
+            status = 'done'
+        except BaseException:
+            logger.warning('[DAEMON] Scan {sid} error: {e}'.format(sid=a_sid, e=traceback.format_exc()))
+            status = 'error'
+        finally:
+            # 只保留本次扫描目标的预处理结果，重复扫描同一目标时没有修改的文件不需要重新解析
+            # 扫描出错时cli.start没有返回，使用预处理时解析出的扫描目标
+            target_directory = target_directory or ast_object.target_directory
+            if target_directory:
+                ast_object.trim(target_directory)
+
+        Running(a_sid).status({'status': status, 'report': '?sid={a_sid}'.format(a_sid=a_sid)})
+
+    async def worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self.queue.get()
+            self.current = job['a_sid']
+            try:
+                await loop.run_in_executor(self.executor, self.run_job, job)
+            finally:
+                self.current = None
+                self.queue.task_done()
+
+    @staticmethod
+    def get_sids(a_sid):
+        try:
+            return list(Running(a_sid).list()['sids'])
+        except (IOError, ValueError, KeyError):
+            return []
+
+    def status(self, a_sid):
+        """
+        扫描状态，包括每个扫描目标的进度
+        :param a_sid:
+        :return:
+        """
+        if not store.has_status(a_sid):
+            return None
+
+        result = dict(Running(a_sid).status())
+        result['sids'] = {}
+        for s_sid in self.get_sids(a_sid):
+            try:
+                progress = Running(s_sid).progress()
+            except (IOError, ValueError):
+                progress = None
+            result['sids'][s_sid] = {'progress': progress, 'finished': store.has_data(s_sid)}
+
+        return result
+
+    def route(self, method, path, query, body):
+        """
+        处理请求
+        :param method:
+        :param path:
+        :param query: 查询参数
+        :param body: 请求内容
+        :return: (http状态码, 返回的json)
+        """
+        if path == '/api/ping':
+            return 200, {'code': 1001, 'msg': 'pong', 'result': {'queue': self.queue.qsize(), 'running': self.current}}
+
+        if path == '/api/add':
+            if method != 'POST':
+                return 405, {'code': 1002, 'msg': 'Use POST with a json body'}
+            try:
+                params = json.loads(body.decode('utf-8') or '{}')
+                if not isinstance(params, dict):
+                    raise ValueError('json object is required')
+                a_sid = self.add(params)
+            except ValueError as e:
+                return 400, {'code': 1002, 'msg': str(e)}
+            return 200, {'code': 1001, 'msg': 'Add scan job successfully', 'result': {'sid': a_sid}}
+
+        if path not in ('/api/status', '/api/result', '/api/findings'):
+            return 404, {'code': 1002, 'msg': 'Not found'}
+
+        if method != 'GET':
+            return 405, {'code': 1002, 'msg': 'Use GET'}
+
+        sid = query.get('sid')
+        if not sid:
+            return 400, {'code': 1002, 'msg': 'sid is required'}
+
+        if path == '/api/status':
+            result = self.status(sid)
+            if result is None:
+                return 404, {'code': 1002, 'msg': 'Scan {} not found'.format(sid)}
+            return 200, {'code': 1001, 'msg': 'success', 'result': result}
+
+        if not store.has_data(sid):
+            return 404, {'code': 1002, 'msg': 'Result of {} not found'.format(sid)}
+
+        if path == '/api/result':
+            return 200, Running(sid).data()
+
+        findings = list(store.findings(sid, rule=query.get('rule'), file_path=query.get('file')))
+        return 200, {'code': 1001, 'msg': 'success', 'result': findings}
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                key, _, value = line.decode('latin-1').partition(':')
+                headers[key.strip().lower()] = value.strip()
+
+            if len(request_line) < 2:
+                raise ValueError('bad request line')
+
+            body = await reader.readexactly(int(headers.get('content-length') or 0))
+            url = urlparse(request_line[1])
+            query = dict((k, v[-1]) for k, v in parse_qs(url.query).items())
+            status, result = self.route(request_line[0].upper(), url.path, query, body)
+        except (ValueError, asyncio.IncompleteReadError) as e:
+            status, result = 400, {'code': 1002, 'msg': 'Bad request: {}'.format(e)}
+        except Exception:
+            logger.warning('[DAEMON] Request error: {}'.format(traceback.format_exc()))
+            status, result = 500, {'code': 1002, 'msg': 'Internal error'}
+
+        payload = json.dumps(result, sort_keys=True, default=str).encode('utf-8')
+        writer.write('HTTP/1.1 {s} {r}\r\nContent-Type: application/json\r\nContent-Length: {l}\r\n'
+                     'Connection: close\r\n\r\n'.format(s=status, r=http_reasons[status], l=len(payload)).encode('latin-1'))
+        writer.write(payload)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self):
+        self.queue = asyncio.Queue()
+        await asyncio.get_running_loop().run_in_executor(self.executor, self.warm_up)
+
+        if self.unix_socket:
+            if os.path.exists(self.unix_socket):
+                os.remove(self.unix_socket)
+            server = await asyncio.start_unix_server(self.handle, path=self.unix_socket)
+            logger.info('[DAEMON] Listening on unix:{path}'.format(path=self.unix_socket))
+        else:
+            server = await asyncio.start_server(self.handle, host=self.host, port=self.port)
+            logger.info('[DAEMON] Listening on http://{host}:{port}'.format(host=self.host, port=self.port))
+
+        worker = asyncio.ensure_future(self.worker())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            worker.cancel()
+
+
+def start(host='127.0.0.1', port=5000, unix_socket=None):
+    """
+    启动常驻扫描进程
+    :param host:
+    :param port:
+    :param unix_socket: 指定时监听Unix socket，不监听端口
+    :return:
+    """
+    try:
+        asyncio.run(Daemon(host, port, unix_socket).serve())
+    except KeyboardInterrupt:
+        logger.critical('[DAEMON] KeyboardInterrupt, exit...')
@@ -11,111 +11,245 @@
     :license:   MIT, see LICENSE for more details.
     :copyright: Copyright (c) 2017 Feei. All rights reserved
 """
+import copy
+import heapq
 import json
+import multiprocessing
 import os
 import re
+import shutil
+import time
 import traceback
+from collections import deque
 
 import portalocker
 from phply import phpast as php
 from prettytable import PrettyTable
 
 from cobra.core_engine.php.parser import scan_parser as php_scan_parser
+from cobra.core_engine.php.parser import init_budget as php_init_budget
+from cobra.core_engine.php.parser import init_cache as php_init_cache
+from cobra.core_engine.php.parser import token_check as php_token_check
+from cobra.core_engine.php.parser import ChainCode
+from cobra.core_engine.php.forward import scan_forward as php_scan_forward
+from cobra.core_engine.php.forward import init_forward as php_init_forward
 from cobra.core_engine.php.engine import init_match_rule as php_init_match_rule
+from cobra.core_engine.php.engine import init_call_sites as php_init_call_sites
 from rules.autorule import autorule
 from . import const
 from .cast import CAST
 from .config import running_path
 from .const import ext_dict
 from .file import FileParseAll
+from .file import get_file_hashes
+from .file import get_file_sizes
 from .log import logger
+from .policy import Policy
+from .progress import Progress
+from .pretreatment import ast_object
 from .result import VulnerabilityResult
 from .rule import Rule
+from .stats import RuleStats
+from .store import store
 from .utils import Tool
 
+new_core_results = {}  # 新规则 -> (漏洞列表, 需要继续展开的新规则列表)
+scan_context = {}  # 多进程扫描时子进程fork继承的扫描参数
+
 
 class Running:
+    """
+    扫描运行状态，保存在SQLite(running.db)中，读取时兼容原来的json文件
+    """
     def __init__(self, sid):
         self.sid = sid
 
     def init_list(self, data=None):
         """
-        Initialize asid_list file.
+        Initialize asid_list.
         :param data: list or a string
         :return:
         """
-        file_path = os.path.join(running_path, '{sid}_list'.format(sid=self.sid))
-        if not os.path.exists(file_path):
-            if isinstance(data, list):
-                with open(file_path, 'w') as f:
-                    portalocker.lock(f, portalocker.LOCK_EX)
-                    f.write(json.dumps({
-                        'sids': {},
-                        'total_target_num': len(data),
-                    }))
-            else:
-                with open(file_path, 'w') as f:
-                    portalocker.lock(f, portalocker.LOCK_EX)
-                    f.write(json.dumps({
-                        'sids': {},
-                        'total_target_num': 1,
-                    }))
+        if isinstance(data, list):
+            store.init_list(self.sid, len(data))
+        else:
+            store.init_list(self.sid, 1)
 
     def list(self, data=None):
-        file_path = os.path.join(running_path, '{sid}_list'.format(sid=self.sid))
         if data is None:
-            with open(file_path, 'r') as f:
-                portalocker.lock(f, portalocker.LOCK_EX)
-                result = f.readline()
-                return json.loads(result)
+            return store.list(self.sid)
         else:
-            with open(file_path, 'r+') as f:
-                portalocker.lock(f, portalocker.LOCK_EX)
-                result = f.read()
-                if result == '':
-                    result = {'sids': {}}
-                else:
-                    result = json.loads(result)
-                result['sids'][data[0]] = data[1]
-                f.seek(0)
-                f.truncate()
-                f.write(json.dumps(result))
+            store.add_target(self.sid, data[0], data[1])
 
     def status(self, data=None):
-        file_path = os.path.join(running_path, '{sid}_status'.format(sid=self.sid))
         if data is None:
-            with open(file_path) as f:
-                portalocker.lock(f, portalocker.LOCK_EX)
-                result = f.readline()
-            return json.loads(result)
+            return store.status(self.sid)
         else:
-            data = json.dumps(data)
-            with open(file_path, 'w') as f:
-                portalocker.lock(f, portalocker.LOCK_EX)
-                f.writelines(data)
+            store.add_status(self.sid, data)
 
     def data(self, data=None):
+        if data is None:
+            return store.data(self.sid)
+        else:
+            store.set_data(self.sid, data)
 
-        file_path = os.path.abspath(running_path + '/{sid}_data'.format(sid=self.sid))
+    def init_findings(self):
+        """
+        清空漏洞流，每次扫描开始时调用
+        :return:
+        """
+        store.clear_findings(self.sid)
 
+    def findings(self, data=None):
+        """
+        漏洞流，扫描过程中逐个追加，读取时按写入顺序逐个返回
+        :param data: 需要追加的漏洞列表，为None时读取
+        :return:
+        """
         if data is None:
-            with open(file_path) as f:
-                portalocker.lock(f, portalocker.LOCK_EX)
-                result = f.readline()
-            return json.loads(result)
+            return store.findings(self.sid)
         else:
-            data = json.dumps(data, sort_keys=True)
-            with open(file_path, 'w+') as f:
-                portalocker.lock(f, portalocker.LOCK_EX)
-                f.writelines(data)
+            store.add_findings(self.sid, data)
+
+    def progress(self):
+        """
+        扫描进度，扫描过程中由Progress定时写入
+        :return:
+        """
+        file_path = os.path.join(running_path, '{sid}_progress'.format(sid=self.sid))
+        with open(file_path) as f:
+            portalocker.lock(f, portalocker.LOCK_EX)
+            return json.loads(f.read())
 
     def is_file(self, is_data=False):
         if is_data:
-            ext = 'data'
-        else:
-            ext = 'status'
-        file_path = os.path.join(running_path, '{sid}_{ext}'.format(sid=self.sid, ext=ext))
-        return os.path.isfile(file_path)
+            return store.has_data(self.sid)
+        return store.has_status(self.sid)
+
+
+def restore_vulnerability(finding):
+    """
+    保存的漏洞(断点、漏洞流)还原为VulnerabilityResult
+    :param finding: 漏洞字典
+    :return: 
+    """
+    vulnerability = VulnerabilityResult()
+    vulnerability.__dict__.update(finding)
+    if isinstance(vulnerability.chain, list):
+        vulnerability.chain = [tuple(c) if isinstance(c, list) else c for c in vulnerability.chain]
+    return vulnerability
+
+
+class Checkpoint(object):
+    """
+    断点续扫，按规则、文件记录已经完成的部分以及其中的漏洞(NDJSON)
+    第一行为扫描目标以及所有文件的sha1，续扫时跳过文件没有修改过的部分
+    回溯会进入其他文件(include、类索引以及自定义函数的调用点)，有文件修改时只有结果仅取决于文件本身的规则可以按文件续扫
+    """
+    def __init__(self, sid):
+        self.sid = sid
+        self.file_path = os.path.join(running_path, '{sid}_checkpoint'.format(sid=sid))
+        self.rules = set()  # 已经完成的规则
+        self.files = {}  # 规则名 -> {文件: 漏洞列表}，规则中已经完成的文件
+
+    def load(self, target_directory, hashes, local_rules=()):
+        """
+        读取上次扫描的断点，扫描目标不同时不能续扫
+        有文件修改、新增或删除时规则需要重新匹配，没有修改过的文件的结果也可能因为其他文件改变，
+        只有local_rules中的规则跳过没有修改过的文件，其余规则全部重新扫描
+        :param target_directory: 
+        :param hashes: 当前所有文件的sha1
+        :param local_rules: 结果只取决于文件本身的规则(only-regex)
+        :return: 是否可以续扫
+        """
+        if not os.path.isfile(self.file_path):
+            return False
+
+        records = []
+        with open(self.file_path, 'r', encoding='utf-8', errors='ignore') as f:
+            portalocker.lock(f, portalocker.LOCK_EX)
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # 扫描中断时最后一行可能不完整
+                    logger.debug('[SCAN] [RESUME] Skip broken checkpoint line')
+
+        if not records or records[0].get('target_directory') != target_directory:
+            return False
+
+        old_hashes = records[0].get('hashes', {})
+        changed = set(f for f in set(old_hashes) | set(hashes) if old_hashes.get(f) != hashes.get(f))
+
+        for record in records[1:]:
+            if 'file' in record:
+                if not changed or (record['rule'] in local_rules and record['file'] not in changed):
+                    self.files.setdefault(record['rule'], {}).setdefault(record['file'], []).extend(record['findings'])
+            elif not changed:
+                self.rules.add(record['rule'])
+
+        logger.info('[SCAN] [RESUME] {c} files changed, {r} rules and {f} files completed'.format(
+            c=len(changed), r=len(self.rules), f=sum(len(files) for files in self.files.values())))
+        return True
+
+    def init(self, target_directory, hashes):
+        """
+        重新生成断点文件，保留续扫时仍然有效的部分
+        :param target_directory: 
+        :param hashes: 
+        :return: 
+        """
+        with open(self.file_path, 'w') as f:
+            portalocker.lock(f, portalocker.LOCK_EX)
+            f.write(json.dumps({'target_directory': target_directory, 'hashes': hashes}, sort_keys=True) + '\n')
+            for rule, files in self.files.items():
+                for file_path, findings in files.items():
+                    f.write(json.dumps({'rule': rule, 'file': file_path, 'findings': findings},
+                                       sort_keys=True, default=str) + '\n')
+            for rule in self.rules:
+                f.write(json.dumps({'rule': rule}) + '\n')
+
+    def save(self, rule, file_path=None, vulnerabilities=None):
+        """
+        记录完成的文件，file_path为None时记录完成的规则
+        :param rule: 
+        :param file_path: 相对路径
+        :param vulnerabilities: 该文件中的漏洞
+        :return: 
+        """
+        record = {'rule': rule}
+        if file_path is not None:
+            record['file'] = file_path
+            record['findings'] = []
+            for vulnerability in vulnerabilities or []:
+                finding = dict(vulnerability.__dict__)
+                finding['chain'] = render_chain(finding['chain'])
+                record['findings'].append(finding)
+
+        with open(self.file_path, 'a') as f:
+            portalocker.lock(f, portalocker.LOCK_EX)
+            f.write(json.dumps(record, sort_keys=True, default=str) + '\n')
+            f.flush()
+
+    def restore(self, findings):
+        """
+        断点中的漏洞还原为VulnerabilityResult
+        :param findings: 
+        :return: 
+        """
+        return [restore_vulnerability(finding) for finding in findings]
+
+    def restore_rule(self, rule):
+        """
+        已经完成的规则中的所有漏洞，按扫描时的顺序
+        :param rule: 
+        :return: 
+        """
+        result = []
+        for findings in self.files.get(rule, {}).values():
+            result.extend(self.restore(findings))
+
+        return result
 
 
 def score2level(score):
@@ -142,33 +276,439 @@ def score2level(score):
         return '{l}-{s}: {ast}'.format(l=level[:1], s=score_full, ast=a)
 
 
-def scan_single(target_directory, single_rule, files=None, language=None, secret_name=None):
+def get_rule_level(rule):
+    """
+    规则的危害等级，规则没有指定时按漏洞类型取
+    :param rule: 
+    :return: 1-10
+    """
+    return getattr(rule, 'level', None) or const.vulnerability_levels.get(rule.vulnerability,
+                                                                          const.vulnerability_level_default)
+
+
+def get_report_row(idx, vulnerability):
+    """
+    漏洞表格中的一行
+    :param idx: 漏洞序号，从0开始
+    :param vulnerability: 
+    :return: 
+    """
+    trigger = '{fp}:{ln}'.format(fp=vulnerability.file_path, ln=vulnerability.line_number)
+    commit = u'@{author}'.format(author=vulnerability.commit_author)
     try:
-        return SingleRule(target_directory, single_rule, files, language, secret_name).process()
-    except Exception:
-        raise
+        code_content = vulnerability.code_content[:50].strip()
+    except AttributeError as e:
+        code_content = vulnerability.code_content.decode('utf-8')[:100].strip()
+
+    return [idx + 1, vulnerability.id, vulnerability.rule_name, vulnerability.language, trigger, commit, code_content,
+            vulnerability.analysis]
+
+
+def get_report_table(vulnerabilities):
+    """
+    漏洞表格
+    :param vulnerabilities: [(漏洞序号, 漏洞)]
+    :return: PrettyTable
+    """
+    table = PrettyTable(
+        ['#', 'CVI', 'Rule(ID/Name)', 'Lang/CVE-id', 'Target-File:Line-Number',
+         'Commit(Author)', 'Source Code Content', 'Analysis'])
+    table.align = 'l'
+
+    for idx, x in vulnerabilities:
+        table.add_row(get_report_row(idx, x))
+
+    return table
+
+
+def report_full(get_vulnerabilities, summary):
+    """
+    输出所有漏洞以及每个漏洞的回溯链，漏洞很多时输出量很大，需要通过--report full指定
+    :param get_vulnerabilities: 返回所有漏洞的函数，表格以及回溯链各遍历一次
+    :param summary: Summary
+    :return: 
+    """
+    table = get_report_table(enumerate(get_vulnerabilities()))
+    logger.info("[SCAN] Trigger Rules: {tr} Vulnerabilities ({vn})\r\n{table}".format(tr=len(summary.trigger_rules),
+                                                                                      vn=summary.count,
+                                                                                      table=table))
+
+    # 终端宽度只获取一次，没有终端时使用默认宽度
+    columns = shutil.get_terminal_size().columns
+
+    # 输出chain for all
+    logger.info("[SCAN] Vulnerabilities Chain list: ")
+    for idx, x in enumerate(get_vulnerabilities()):
+        logger.info("[SCAN] Vul {}".format(idx + 1))
+        for c in x.chain:
+            logger.info("[Chain] {}".format(c))
+
+        logger.info("[SCAN] ending\r\n" + '-' * (columns - 16))
+
+
+class Summary(object):
+    """
+    漏洞汇总，逐个添加漏洞，只保存每个规则、每个文件的漏洞数量以及危害等级最高的前N个漏洞
+    """
+    def __init__(self, levels=None, top=const.report_top_num):
+        self.levels = levels or {}  # CVI -> 危害等级
+        self.top = top
+        self.count = 0
+        self.trigger_rules = []  # 按发现顺序
+        self.rules = {}  # (CVI, 规则名) -> 漏洞数量
+        self.files = {}  # 文件 -> 漏洞数量
+        self.heap = []  # (危害等级, -序号, 序号, 漏洞)，堆顶为等级最低、最晚发现的漏洞
+
+    def add(self, vulnerability):
+        index = self.count
+        self.count += 1
+
+        if vulnerability.id not in self.trigger_rules:
+            logger.debug(' > trigger rule (CVI-{cvi})'.format(cvi=vulnerability.id))
+            self.trigger_rules.append(vulnerability.id)
+        key = (vulnerability.id, vulnerability.rule_name)
+        self.rules[key] = self.rules.get(key, 0) + 1
+        self.files[vulnerability.file_path] = self.files.get(vulnerability.file_path, 0) + 1
+
+        item = (self.levels.get(vulnerability.id, 0), -index, index, vulnerability)
+        if len(self.heap) < self.top:
+            heapq.heappush(self.heap, item)
+        else:
+            heapq.heappushpop(self.heap, item)
+
+    def top_vulnerabilities(self):
+        """
+        危害等级高的漏洞在前，相同等级保持扫描顺序
+        :return: [(漏洞序号, 漏洞)]
+        """
+        return [(index, vulnerability) for level, _, index, vulnerability in
+                sorted(self.heap, key=lambda item: (-item[0], item[2]))]
+
+
+def report_summary(summary, sid=None):
+    """
+    汇总输出：每个规则、每个文件的漏洞数量，以及危害等级最高的前N个漏洞，完整结果查看导出文件
+    :param summary: Summary
+    :param sid: 扫描sid，用于给出完整结果的位置
+    :return: 
+    """
+    rule_table = PrettyTable(['CVI', 'Rule(ID/Name)', 'Level', 'Count'])
+    rule_table.align = 'l'
+    for (cvi, rule_name), count in sorted(summary.rules.items(), key=lambda r: -r[1]):
+        rule_table.add_row([cvi, rule_name, summary.levels.get(cvi, ''), count])
+    logger.info("[SCAN] Trigger Rules: {tr} Vulnerabilities ({vn})\r\n{table}".format(tr=len(summary.trigger_rules),
+                                                                                      vn=summary.count,
+                                                                                      table=rule_table))
+
+    top = summary.top
+    file_table = PrettyTable(['Target-File', 'Count'])
+    file_table.align = 'l'
+    for file_path, count in sorted(summary.files.items(), key=lambda f: -f[1])[:top]:
+        file_table.add_row([file_path, count])
+    logger.info("[SCAN] Top {n} of {fn} files\r\n{table}".format(n=min(top, len(summary.files)),
+                                                                  fn=len(summary.files), table=file_table))
+
+    top_vulnerabilities = summary.top_vulnerabilities()
+    logger.info("[SCAN] Top {n} of {vn} vulnerabilities\r\n{table}".format(
+        n=len(top_vulnerabilities), vn=summary.count, table=get_report_table(top_vulnerabilities)))
+
+    if sid is not None:
+        logger.info('[SCAN] Full results of {sid} in {path} and the export file, use --report full to print all '
+                    'vulnerabilities with chains'.format(sid=sid, path=store.db_path))
+
+
+def scan_single(target_directory, single_rule, files=None, language=None, secret_name=None, engine=None, policy=None,
+                stats=None, deadline=None, checkpoint=None, chunk=None):
+    """
+    扫描单个规则，每个文件验证完成后逐个产出其中的漏洞
+    :param chunk: (序号, 匹配结果)，只验证规则的这一部分匹配结果，不再匹配
+    :return: VulnerabilityResult生成器
+    """
+    t1 = time.time()
+    sr = SingleRule(target_directory, single_rule, files, language, secret_name, engine, policy, deadline=deadline,
+                    checkpoint=checkpoint)
+    for vulnerability in (sr.process() if chunk is None else sr.verify(chunk[1], offset=chunk[0])):
+        yield vulnerability
+
+    # 规则的匹配数量、验证数量以及耗时
+    if stats is not None:
+        stats.update(sr.stats)
+        stats['time'] = time.time() - t1
+
+
+def render_chain(chain):
+    """
+    漏洞的回溯链转为字符串，结果需要在进程间传递
+    :param chain: 
+    :return: 
+    """
+    if not isinstance(chain, list):
+        return chain
+
+    return [tuple(str(item) if isinstance(item, ChainCode) else item for item in c) if isinstance(c, tuple) else c
+            for c in chain]
+
+
+def set_fingerprint(vulnerability, target_directory):
+    """
+    漏洞路径转为相对于扫描目录的路径，并生成漏洞指纹
+    :param vulnerability: 
+    :param target_directory: 
+    :return: 指纹
+    """
+    vulnerability.file_path = vulnerability.file_path.replace(target_directory, '')
+    vulnerability.fingerprint = vulnerability.get_fingerprint()
+    return vulnerability.fingerprint
+
+
+def split_matches(matches, count):
+    """
+    规则的匹配结果按文件切分为最多count份，同一文件的匹配结果不会分开，每个文件的断点只由一个进程记录
+    :param matches: 匹配结果，同一文件的匹配结果相邻
+    :param count: 
+    :return: [(第一个匹配结果的序号, 匹配结果)]
+    """
+    size = -(-len(matches) // count) if count > 0 else len(matches)
+    chunks = []
+    start, current_file = 0, None
+    for index, match in enumerate(matches):
+        if match == ():
+            continue
+        if match[0] != current_file:
+            # 上一个文件结束，当前份已经足够大时从这里切分
+            if index - start >= size:
+                chunks.append((start, matches[start:index]))
+                start = index
+            current_file = match[0]
+
+    if start < len(matches):
+        chunks.append((start, matches[start:]))
+    return chunks
+
+
+def match_rule(single_rule):
+    """
+    子进程中匹配单个规则，匹配结果再切分后交给各个进程验证
+    :param single_rule: 规则名
+    :return: (规则名, 匹配结果, 统计数据)
+    """
+    deadline = scan_context['deadline']
+    if deadline is not None and time.time() > deadline:
+        return single_rule, None, {'skipped': True}
+
+    t1 = time.time()
+    sr = SingleRule(scan_context['target_directory'], scan_context['rules'][single_rule](), scan_context['files'],
+                    scan_context['language'], scan_context['secret_name'], scan_context['engine'],
+                    scan_context['policy'], deadline=deadline, checkpoint=scan_context['checkpoint'])
+    matches = sr.matches()
+    stats = dict(sr.stats, time=time.time() - t1)
+    return single_rule, matches if matches is None else list(matches), stats
+
+
+def scan_chunk(single_rule, chunk):
+    """
+    子进程中验证单个规则的一部分匹配结果，预处理结果以及扫描参数通过fork继承
+    :param single_rule: 规则名
+    :param chunk: (序号, 匹配结果)
+    :return: (漏洞列表, 统计数据)
+    """
+    stats = {}
+    rule = scan_context['rules'][single_rule]()
+    result = list(scan_single(scan_context['target_directory'], rule, scan_context['files'], scan_context['language'],
+                              scan_context['secret_name'], scan_context['engine'], scan_context['policy'],
+                              stats=stats, deadline=scan_context['deadline'], checkpoint=scan_context['checkpoint'],
+                              chunk=chunk))
+
+    # 先按指纹去掉重复的漏洞，只转换保留下来的漏洞的回溯链
+    fingerprints = set()
+    vulnerabilities = []
+    for vulnerability in result:
+        if set_fingerprint(vulnerability, scan_context['target_directory']) in fingerprints:
+            logger.debug('[SCAN] [CVI-{cvi}] [DUPLICATE] {fp}:{ln}'.format(
+                cvi=vulnerability.id, fp=vulnerability.file_path, ln=vulnerability.line_number))
+            continue
+
+        fingerprints.add(vulnerability.fingerprint)
+        vulnerability.chain = render_chain(vulnerability.chain)
+        vulnerabilities.append(vulnerability)
+
+    return vulnerabilities, stats
+
+
+def merge_stats(stats, chunk_stats):
+    """
+    合并同一规则各部分的统计数据
+    :param stats: 规则的统计数据
+    :param chunk_stats: 一部分匹配结果的统计数据
+    :return: 
+    """
+    for key, value in chunk_stats.items():
+        if key == 'tiers':
+            tiers = stats.setdefault('tiers', {})
+            for tier, count in value.items():
+                tiers[tier] = tiers.get(tier, 0) + count
+        elif key == 'incomplete':
+            stats['incomplete'] = sorted(set(stats.get('incomplete', [])) | set(value))
+        else:
+            stats[key] = stats.get(key, 0) + value
+
+
+def scan_findings(target_directory, scan_rules, files=None, language=None, secret_name=None, engine=None, policy=None,
+                  jobs=None, rule_stats=None, stats=None, deadline=None, checkpoint=None, progress=None):
+    """
+    按规则顺序逐个产出漏洞，多进程扫描时按规则顺序合并，与单进程扫描的顺序一致
+    :param target_directory: 
+    :param scan_rules: [(规则名, 规则)]
+    :param files: 
+    :param language: 
+    :param secret_name: 
+    :param engine: 
+    :param policy: 
+    :param jobs: 进程数
+    :param rule_stats: RuleStats，多进程扫描时按预计耗时从大到小分配规则
+    :param stats: 规则名 -> 本次扫描的统计数据
+    :param deadline: 截止时间(时间戳)，超出后未开始的规则直接跳过
+    :param checkpoint: Checkpoint，已经完成的规则直接还原漏洞
+    :param progress: Progress，每个规则完成时更新进度
+    :return: VulnerabilityResult生成器
+    """
+    if stats is None:
+        stats = {}
+    if progress is None:
+        progress = Progress()
+
+    resumed_rules = checkpoint.rules if checkpoint is not None else set()
+    for single_rule in resumed_rules:
+        stats[single_rule] = {'resumed': True}
+
+    if jobs is not None and jobs > 1 and 'fork' in multiprocessing.get_all_start_methods():
+        # 预处理完成后fork，子进程共用预处理结果
+        scan_context.update({
+            'rules': dict((single_rule, rule.__class__) for single_rule, rule in scan_rules),
+            'target_directory': target_directory,
+            'files': files,
+            'language': language,
+            'secret_name': secret_name,
+            'engine': engine,
+            'policy': policy,
+            'deadline': deadline,
+            'checkpoint': checkpoint,
+        })
+        logger.info('[SCAN] Scan {rc} rules with {jobs} processes'.format(rc=len(scan_rules), jobs=jobs))
+
+        rule_names = [single_rule for single_rule, rule in scan_rules if single_rule not in resumed_rules]
+        if rule_stats is not None:
+            rule_names = rule_stats.schedule(rule_names)
+
+        pool = multiprocessing.get_context('fork').Pool(jobs)
+        try:
+            # 耗时长的规则先匹配，每个规则的匹配结果按文件切分后提交给所有进程验证，耗时长的规则不只使用一个进程
+            chunk_results = {}
+            for single_rule, matches, stats[single_rule] in pool.imap_unordered(match_rule, rule_names):
+                chunk_results[single_rule] = [pool.apply_async(scan_chunk, (single_rule, chunk)) for chunk in
+                                              split_matches(matches or [], jobs * const.scan_chunks_per_job)]
+
+            # 结果按规则顺序、规则中按文件顺序取出
+            for single_rule, rule in scan_rules:
+                if single_rule in resumed_rules:
+                    result = checkpoint.restore_rule(single_rule)
+                else:
+                    result = []
+                    for chunk_result in chunk_results[single_rule]:
+                        vulnerabilities, chunk_stats = chunk_result.get()
+                        merge_stats(stats[single_rule], chunk_stats)
+                        result.extend(vulnerabilities)
+
+                    # 规则中所有文件都验证完成
+                    if checkpoint is not None and not stats[single_rule].get('skipped') and \
+                            'incomplete' not in stats[single_rule]:
+                        checkpoint.save(single_rule)
+                progress.rule_done(single_rule)
+                for vulnerability in result:
+                    yield vulnerability
+        finally:
+            pool.close()
+            pool.join()
+            scan_context.clear()
+
+    else:
+        if jobs is not None and jobs > 1 and 'fork' not in multiprocessing.get_all_start_methods():
+            logger.warning('[SCAN] Multiprocess scan requires fork, scan rules in single process')
+
+        for single_rule, rule in scan_rules:
+            if single_rule in resumed_rules:
+                logger.debug('[SCAN] [RESUME] {r} completed'.format(r=single_rule))
+                progress.rule_done(single_rule)
+                for vulnerability in checkpoint.restore_rule(single_rule):
+                    yield vulnerability
+                continue
+
+            if deadline is not None and time.time() > deadline:
+                stats[single_rule] = {'skipped': True}
+                progress.rule_done(single_rule)
+                continue
+
+            # 每个文件验证完成后即产出其中的漏洞，不需要等待整个规则完成
+            stats[single_rule] = {}
+            found = False
+            for vulnerability in scan_single(target_directory, rule, files, language, secret_name, engine, policy,
+                                             stats=stats[single_rule], deadline=deadline, checkpoint=checkpoint):
+                found = True
+                yield vulnerability
+            progress.rule_done(single_rule)
+
+            if not found:
+                logger.debug('[SCAN] [STORE] Not found vulnerabilities on this rule!')
 
 
 def scan(target_directory, a_sid=None, s_sid=None, special_rules=None, language=None, framework=None, file_count=0,
-         extension_count=0, files=None, secret_name=None):
+         extension_count=0, files=None, secret_name=None, step_budget=None, time_budget=None, engine=None, jobs=None,
+         deadline=None, resume=False, progress=None, report_mode=None):
+    # 扫描截止时间，超出后返回已经完成的结果
+    deadline_time = time.time() + deadline if deadline else None
+
+    # 每个漏洞回溯的预算
+    php_init_budget(max_steps=step_budget, max_time=time_budget)
+    php_init_cache()
+    php_init_forward()
+    init_new_core()
+
+    # 修复函数以及输入函数只在扫描开始时加载一次
+    policy = Policy(secret_name)
+
     r = Rule(language)
     vulnerabilities = r.vulnerabilities
     rules = r.rules(special_rules)
-    find_vulnerabilities = []
-
-    def store(result):
-        if result is not None and isinstance(result, list) is True:
-            for res in result:
-                res.file_path = res.file_path.replace(target_directory, '')
-                find_vulnerabilities.append(res)
-        else:
-            logger.debug('[SCAN] [STORE] Not found vulnerabilities on this rule!')
+    # 只保存汇总需要的数量以及前N个漏洞，漏洞逐个写入漏洞流，没有sid时输出完整结果才保存所有漏洞
+    summary = Summary()
+    kept_vulnerabilities = [] if s_sid is None and report_mode == const.report_full else None
+    fingerprints = set()  # 已经发现的漏洞指纹，重复的漏洞只保留第一个
+
+    def store_vulnerability(res):
+        if set_fingerprint(res, target_directory) in fingerprints:
+            logger.debug('[SCAN] [CVI-{cvi}] [DUPLICATE] {fp}:{ln}'.format(cvi=res.id, fp=res.file_path,
+                                                                           ln=res.line_number))
+            return
+
+        fingerprints.add(res.fingerprint)
+        summary.add(res)
+        if kept_vulnerabilities is not None:
+            kept_vulnerabilities.append(res)
+        progress.advance(findings=1)
+
+        logger.info('[SCAN] [CVI-{cvi}] [FOUND] {fp}:{ln} {analysis}'.format(cvi=res.id, fp=res.file_path,
+                                                                            ln=res.line_number, analysis=res.analysis))
+        if s_sid is not None:
+            finding = dict(res.__dict__)
+            finding['chain'] = render_chain(finding['chain'])
+            Running(s_sid).findings([finding])
 
     if len(rules) == 0:
         logger.critical('no rules!')
         return False
     logger.info('[PUSH] {rc} Rules'.format(rc=len(rules)))
     push_rules = []
+    scan_rules = []
 
     for idx, single_rule in enumerate(sorted(rules.keys())):
 
@@ -186,87 +726,126 @@ def scan(target_directory, a_sid=None, s_sid=None, special_rules=None, language=
             vulnerability=rule.vulnerability,
             language=rule.language
         ))
-        result = scan_single(target_directory, rule, files, language, secret_name)
-        store(result)
-
-    # print
-    data = []
-    data2 = []
-    table = PrettyTable(
-        ['#', 'CVI', 'Rule(ID/Name)', 'Lang/CVE-id', 'Target-File:Line-Number',
-         'Commit(Author)', 'Source Code Content', 'Analysis'])
+        scan_rules.append((single_rule, rule))
 
-    table.align = 'l'
-    trigger_rules = []
-    for idx, x in enumerate(find_vulnerabilities):
-        trigger = '{fp}:{ln}'.format(fp=x.file_path, ln=x.line_number)
-        commit = u'@{author}'.format(author=x.commit_author)
-        try:
-            code_content = x.code_content[:50].strip()
-        except AttributeError as e:
-            code_content = x.code_content.decode('utf-8')[:100].strip()
-        row = [idx + 1, x.id, x.rule_name, x.language, trigger, commit, code_content, x.analysis]
-        row2 = [idx+1, x.chain]
+    summary.levels = dict((rule.svid, get_rule_level(rule)) for single_rule, rule in scan_rules)
 
-        data.append(row)
-        data2.append(row2)
+    # 漏洞逐个写入漏洞流，扫描过程中即可查看
+    checkpoint = None
+    if s_sid is not None:
+        Running(s_sid).init_findings()
+
+        # 按规则、文件记录扫描进度，中断后可以通过--resume继续
+        checkpoint = Checkpoint(s_sid)
+        hashes = get_file_hashes(files, target_directory)
+        local_rules = set(single_rule for single_rule, rule in scan_rules
+                          if rule.match_mode == const.mm_regex_only_match)
+        if resume and not checkpoint.load(target_directory, hashes, local_rules):
+            logger.warning('[SCAN] [RESUME] No checkpoint of {sid} for this target, scan from the beginning'.format(
+                sid=s_sid))
+        checkpoint.init(target_directory, hashes)
+
+    rule_stats = RuleStats(target=target_directory)
+    stats = {}
+
+    # 扫描进度按规则需要处理的文件字节数统计
+    if progress is None:
+        progress = Progress(s_sid)
+    sizes = {}
+    for single_rule, rule in scan_rules:
+        if rule.language.lower() not in sizes:
+            sizes[rule.language.lower()] = get_file_sizes(files, target_directory, rule.language.lower())
+    progress.start('scan', work=dict((single_rule, sizes[rule.language.lower()]) for single_rule, rule in scan_rules))
+
+    if deadline_time is not None:
+        # 有限时间内优先扫描危害等级高、耗时少的规则，按此顺序执行
+        scan_rules.sort(key=lambda sr: (-get_rule_level(sr[1]), rule_stats.predict(sr[0]) or 0))
+        logger.info('[SCAN] [DEADLINE] Scan in {d}s, rules order: {r}'.format(
+            d=deadline, r=','.join(single_rule for single_rule, rule in scan_rules)))
+
+    for vulnerability in scan_findings(target_directory, scan_rules, files, language, secret_name, engine, policy,
+                                       jobs=jobs, rule_stats=None if deadline_time else rule_stats, stats=stats,
+                                       deadline=deadline_time, checkpoint=checkpoint, progress=progress):
+        store_vulnerability(vulnerability)
+
+    progress.set_phase('report')
+
+    # 未完成的规则以及文件
+    incomplete_rules = [single_rule for single_rule, rule in scan_rules
+                        if stats.get(single_rule, {}).get('skipped') or stats.get(single_rule, {}).get('incomplete')]
+    incomplete_files = sorted(set(f for single_rule in incomplete_rules
+                                  for f in stats[single_rule].get('incomplete', [])))
+    if incomplete_rules:
+        logger.warning('[SCAN] [DEADLINE] Deadline exceeded, partial result. Not completed rules ({l}): {r}'.format(
+            l=len(incomplete_rules), r=','.join(incomplete_rules)))
+
+    # 记录每个规则的耗时，下次扫描时用于调度
+    for single_rule, rule in scan_rules:
+        stat = stats.get(single_rule)
+        if not stat or single_rule in incomplete_rules or stat.get('resumed'):
+            continue
 
-        table.add_row(row)
+        predict = rule_stats.predict(single_rule)
+        tiers = stat.get('tiers', {})
+        logger.info('[SCAN] [STATS] {rule} hits: {hits} verified: {verified} ({tiers}) unconfirmed: {unconfirmed} predicted: {predict} actual: {time:.3f}s'.format(
+            rule=single_rule, hits=stat.get('hits', 0), verified=stat.get('verified', 0),
+            unconfirmed=stat.get('unconfirmed', 0),
+            tiers=' '.join('{t}: {c}'.format(t=tier, c=tiers.get(tier, 0)) for tier in const.verify_tiers),
+            predict='unknown' if predict is None else '{:.3f}s'.format(predict), time=stat['time']))
+        rule_stats.record(single_rule, stat.get('hits', 0), stat.get('verified', 0), stat['time'])
 
-        if x.id not in trigger_rules:
-            logger.debug(' > trigger rule (CVI-{cvi})'.format(cvi=x.id))
-            trigger_rules.append(x.id)
+    rule_stats.save()
 
-        # clear
-        x.chain = ""
+    # print
+    def get_vulnerabilities():
+        if kept_vulnerabilities is not None:
+            return kept_vulnerabilities
+        return (restore_vulnerability(finding) for finding in Running(s_sid).findings())
 
+    trigger_rules = summary.trigger_rules
     diff_rules = list(set(push_rules) - set(trigger_rules))
-    vn = len(find_vulnerabilities)
-    if vn == 0:
+    if summary.count == 0:
         logger.info('[SCAN] Not found vulnerability!')
     else:
-        logger.info("[SCAN] Trigger Rules: {tr} Vulnerabilities ({vn})\r\n{table}".format(tr=len(trigger_rules),
-                                                                                          vn=len(find_vulnerabilities),
-                                                                                          table=table))
-
-        # 输出chain for all
-        logger.info("[SCAN] Vulnerabilities Chain list: ")
-        for d in data2:
-            logger.info("[SCAN] Vul {}".format(d[0]))
-            for c in d[1]:
-                logger.info("[Chain] {}".format(c))
-
-            if hasattr(os, 'get_terminal_size'):
-                logger.info("[SCAN] ending\r\n" + '-'*(os.get_terminal_size().columns-16))
-            else:
-                logger.info("[SCAN] ending\r\n -------------------------------------------------------------------------")
+        if report_mode == const.report_full:
+            report_full(get_vulnerabilities, summary)
+        else:
+            report_summary(summary, sid=s_sid)
 
         if len(diff_rules) > 0:
             logger.info(
                 '[SCAN] Not Trigger Rules ({l}): {r}'.format(l=len(diff_rules), r=','.join(diff_rules)))
 
-    # completed running data
+    # completed running data，漏洞已经逐个写入漏洞流，读取结果时从漏洞流中读取
     if s_sid is not None:
         Running(s_sid).data({
             'code': 1001,
             'msg': 'scan finished',
             'result': {
-                'vulnerabilities': [x.__dict__ for x in find_vulnerabilities],
                 'language': ",".join(language),
                 'framework': framework,
                 'extension': extension_count,
                 'file': file_count,
                 'push_rules': len(rules),
                 'trigger_rules': len(trigger_rules),
-                'target_directory': target_directory
+                'target_directory': target_directory,
+                'partial': len(incomplete_rules) > 0,
+                'incomplete_rules': incomplete_rules,
+                'incomplete_files': incomplete_files,
             }
         })
+
+    progress.finish()
     return True
 
 
 class SingleRule(object):
-    def __init__(self, target_directory, single_rule, files, language=None, secret_name=None):
+    def __init__(self, target_directory, single_rule, files, language=None, secret_name=None, engine=None, policy=None,
+                 deadline=None, checkpoint=None):
         self.target_directory = target_directory
+        self.deadline = deadline  # 扫描截止时间(时间戳)
+        self.checkpoint = checkpoint  # 断点续扫，记录完成的文件，跳过已经完成的文件
+        self.rule_name = single_rule.__class__.__name__
         self.find = Tool().find
         self.grep = Tool().grep
         self.sr = single_rule
@@ -274,15 +853,12 @@ class SingleRule(object):
         self.languages = language
         self.lan = self.sr.language.lower()
         self.secret_name = secret_name
-        # Single Rule Vulnerabilities
-        """
-        [
-            vr
-        ]
-        """
-        self.rule_vulnerabilities = []
-
-        logger.info("[!] Start scan [CVI-{sr_id}]".format(sr_id=self.sr.svid))
+        self.engine = engine
+        self.policy = policy or Policy(secret_name)
+        self.new_rules = set()  # 当前规则已经展开过的新规则
+        # 正则匹配数量、验证数量以及每个验证层级得出结论的数量
+        self.stats = {'hits': 0, 'verified': 0, 'unconfirmed': 0,
+                      'tiers': dict((tier, 0) for tier in const.verify_tiers)}
 
     def origin_results(self):
         logger.debug('[ENGINE] [ORIGIN] match-mode {m}'.format(m=self.sr.match_mode))
@@ -292,38 +868,13 @@ class SingleRule(object):
             # 当所有match都满足时成立，当单一unmatch满足时，不成立
             matchs = self.sr.match
             unmatchs = self.sr.unmatch
-            result = []
-            new_result = []
-            old_result = 0
 
             try:
                 if matchs:
                     f = FileParseAll(self.files, self.target_directory, language=self.lan)
 
-                    for match in matchs:
-
-                        new_result = f.multi_grep(match)
-
-                        if old_result == 0:
-                            old_result = new_result
-                            result = new_result
-                            continue
-
-                        old_result = result
-                        result = []
-
-                        for old_vul in old_result:
-                            for new_vul in new_result:
-                                if new_vul[0] == old_vul[0]:
-                                    result.append(old_vul)
-
-                    for unmatch in unmatchs:
-                        uresults = f.multi_grep(unmatch)
-
-                        for uresult in uresults:
-                            for vul in result:
-                                if vul[0] == uresult[0]:
-                                    result.remove(vul)
+                    # 每个文件只读取一次，依次匹配所有的match和unmatch
+                    result = f.multi_grep_all(matchs, unmatchs)
 
                 else:
                     result = None
@@ -358,7 +909,12 @@ class SingleRule(object):
             try:
                 if match:
                     f = FileParseAll(self.files, self.target_directory, language=self.lan)
-                    result = f.grep(match)
+
+                    # php直接查找预处理时建立的调用点索引
+                    if self.lan == 'php':
+                        result = f.grep_calls(self.policy.sink_functions(self.sr.match), match)
+                    else:
+                        result = f.grep(match)
                 else:
                     result = None
             except Exception as e:
@@ -418,33 +974,126 @@ class SingleRule(object):
 
         return result
 
-    def process(self):
+    def filter_tokens(self, origin_results):
         """
-        Process Single Rule
-        :return: SRV(Single Rule Vulnerabilities)
+        根据预处理时记录的注释、字符串范围，批量去掉不在代码中的匹配结果
+        注释中的匹配除only-regex规则以外都去掉，字符串中的匹配只对function-param-regex规则去掉
+        :param origin_results:
+        :return:
+        """
+        if self.lan != 'php':
+            return origin_results
+
+        result = []
+        for origin_vulnerability in origin_results:
+            if origin_vulnerability != ():
+                file_path, line_number = origin_vulnerability[0], origin_vulnerability[1]
+
+                if self.sr.match_mode != const.mm_regex_only_match and ast_object.is_comment(file_path, line_number):
+                    logger.debug('[CVI-{cvi}] [COMMENT] {f}:{l}'.format(cvi=self.sr.svid, f=file_path, l=line_number))
+                    continue
+
+                if self.sr.match_mode == const.mm_function_param_controllable and ast_object.is_string(file_path, line_number):
+                    logger.debug('[CVI-{cvi}] [STRING] {f}:{l}'.format(cvi=self.sr.svid, f=file_path, l=line_number))
+                    continue
+
+            result.append(origin_vulnerability)
+
+        return result
+
+    def matches(self):
         """
+        正则匹配规则，去掉注释、字符串中的匹配结果
+        :return: 匹配结果列表，没有匹配结果时为None
+        """
+        logger.info("[!] Start scan [CVI-{sr_id}]".format(sr_id=self.sr.svid))
         origin_results = self.origin_results()
         # exists result
         if origin_results == '' or origin_results is None:
             logger.debug('[CVI-{cvi}] [ORIGIN] NOT FOUND!'.format(cvi=self.sr.svid))
             return None
 
-        origin_vulnerabilities = origin_results
+        origin_vulnerabilities = self.filter_tokens(origin_results)
+        self.stats['hits'] = len(origin_results)
+        self.stats['tiers']['regex'] += len(origin_results) - len(origin_vulnerabilities)
+        return origin_vulnerabilities
+
+    def process(self):
+        """
+        Process Single Rule
+        每个文件验证完成后记录断点并产出该文件中的漏洞，不保存整个规则的漏洞
+        :return: SRV(Single Rule Vulnerabilities)生成器
+        """
+        origin_vulnerabilities = self.matches()
+        if origin_vulnerabilities is not None:
+            for vulnerability in self.verify(origin_vulnerabilities):
+                yield vulnerability
+
+        # 规则中所有文件都验证完成
+        if self.checkpoint is not None and 'incomplete' not in self.stats:
+            self.checkpoint.save(self.rule_name)
+
+    def verify(self, origin_vulnerabilities, offset=0):
+        """
+        逐个文件验证匹配结果，每个文件验证完成后记录断点并产出该文件中的漏洞
+        多进程扫描时每个进程验证规则的一部分文件
+        :param origin_vulnerabilities: 匹配结果，同一文件的匹配结果相邻
+        :param offset: 第一个匹配结果在规则所有匹配结果中的序号
+        :return: SRV(Single Rule Vulnerabilities)生成器
+        """
+        # 断点中已经完成的文件直接还原漏洞，不再验证
+        done_files = self.checkpoint.files.get(self.rule_name, {}) if self.checkpoint is not None else {}
+        current_file, file_vulnerabilities, resumed = None, [], False
+        count = 0
         for index, origin_vulnerability in enumerate(origin_vulnerabilities):
             logger.debug(
                 '[CVI-{cvi}] [ORIGIN] {line}'.format(cvi=self.sr.svid, line=": ".join(list(origin_vulnerability))))
             if origin_vulnerability == ():
                 logger.debug(' > continue...')
                 continue
+
+            file_path = origin_vulnerability[0].replace(self.target_directory, '')
+            if file_path != current_file:
+                # 上一个文件验证完成
+                if not resumed:
+                    self.save_checkpoint(current_file, file_vulnerabilities)
+                count += len(file_vulnerabilities)
+                for vulnerability in file_vulnerabilities:
+                    yield vulnerability
+                current_file, file_vulnerabilities = file_path, []
+
+                resumed = file_path in done_files
+                if resumed:
+                    logger.debug('[CVI-{cvi}] [RESUME] {f} completed'.format(cvi=self.sr.svid, f=file_path))
+                    file_vulnerabilities = self.checkpoint.restore(done_files[file_path])
+                    self.stats['resumed'] = self.stats.get('resumed', 0) + 1
+
+            if resumed:
+                continue
+
             vulnerability = self.parse_match(origin_vulnerability)
             if vulnerability is None:
                 logger.debug('Not vulnerability, continue...')
                 continue
+            # 超出截止时间时停止验证，记录未完成的文件
+            if self.deadline is not None and time.time() > self.deadline:
+                self.stats['incomplete'] = sorted(set(v[0].replace(self.target_directory, '')
+                                                      for v in origin_vulnerabilities[index:] if v != ()) -
+                                                  set(done_files))
+                logger.warning('[CVI-{cvi}] [DEADLINE] Deadline exceeded, {count} files not completed'.format(
+                    cvi=self.sr.svid, count=len(self.stats['incomplete'])))
+                current_file = None
+                break
+
             is_test = False
+            self.stats['verified'] += 1
             try:
-                datas = Core(self.target_directory, vulnerability, self.sr, 'project name',
-                             ['whitelist1', 'whitelist2'], test=is_test, index=index,
-                             files=self.files, languages=self.languages, secret_name=self.secret_name).scan()
+                core = Core(self.target_directory, vulnerability, self.sr, 'project name',
+                            ['whitelist1', 'whitelist2'], test=is_test, index=offset + index,
+                            files=self.files, languages=self.languages, secret_name=self.secret_name,
+                            engine=self.engine, policy=self.policy)
+                datas = core.scan()
+                self.stats['tiers'][core.tier] += 1
                 data = ""
 
                 if len(datas) == 3:
@@ -464,22 +1113,47 @@ class SingleRule(object):
                     logger.debug('[CVI-{cvi}] [RET] Found {code}'.format(cvi=self.sr.svid, code=reason))
                     vulnerability.analysis = reason
                     vulnerability.chain = data
-                    self.rule_vulnerabilities.append(vulnerability)
+                    file_vulnerabilities.append(vulnerability)
                 else:
                     if reason == 'New Core':  # 新的规则
                         logger.debug('[CVI-{cvi}] [NEW-VUL] New Rules init')
-                        new_rule_vulnerabilities = NewCore(self.sr, self.target_directory, data, self.files, 0, languages=self.languages, secret_name=self.secret_name)
+                        new_rule_vulnerabilities = NewCore(self.sr, self.target_directory, data, self.files, 0, languages=self.languages, secret_name=self.secret_name, engine=self.engine, policy=self.policy, visited=self.new_rules)
 
                         if len(new_rule_vulnerabilities) > 0:
-                            self.rule_vulnerabilities.extend(new_rule_vulnerabilities)
+                            file_vulnerabilities.extend(new_rule_vulnerabilities)
+
+                    elif reason == const.budget_exhausted:
+                        self.stats['unconfirmed'] += 1
+                        logger.warning('[CVI-{cvi}] [BUDGET] {f}:{l} unconfirmed, taint budget exhausted'.format(
+                            cvi=self.sr.svid, f=vulnerability.file_path, l=vulnerability.line_number))
 
                     else:
                         logger.debug('Not vulnerability: {code}'.format(code=reason))
             except Exception:
                 raise
+        else:
+            if not resumed:
+                self.save_checkpoint(current_file, file_vulnerabilities)
+
+        # 最后一个文件，超出截止时间时为只验证了一部分的文件
+        count += len(file_vulnerabilities)
+        for vulnerability in file_vulnerabilities:
+            yield vulnerability
+
         logger.debug('[CVI-{cvi}] {vn} Vulnerabilities: {count}'.format(cvi=self.sr.svid, vn=self.sr.vulnerability,
-                                                                        count=len(self.rule_vulnerabilities)))
-        return self.rule_vulnerabilities
+                                                                        count=count))
+
+    def save_checkpoint(self, file_path, vulnerabilities):
+        """
+        记录规则中已经验证完成的文件以及其中的漏洞
+        :param file_path: 相对路径，为None时不记录
+        :param vulnerabilities: 该文件中的漏洞
+        :return: 
+        """
+        if self.checkpoint is None or file_path is None:
+            return
+
+        self.checkpoint.save(self.rule_name, file_path, vulnerabilities)
 
     def parse_match(self, single_match):
         mr = VulnerabilityResult()
@@ -509,7 +1183,7 @@ class SingleRule(object):
 
 class Core(object):
     def __init__(self, target_directory, vulnerability_result, single_rule, project_name, white_list, test=False,
-                 index=0, files=None, languages=None, secret_name=None):
+                 index=0, files=None, languages=None, secret_name=None, engine=None, policy=None, params=None):
         """
         Initialize
         :param: target_directory:
@@ -521,11 +1195,13 @@ class Core(object):
         :param index: vulnerability index
         :param files: core file list
         :param secret_name: secret name
+        :param engine: taint analysis engine, backward or forward
+        :param policy: source/sanitizer policy of this scan
+        :param params: params to trace, instead of regex match from code content
         """
         self.data = []
-        self.repair_dict = {}
-        self.repair_functions = []
-        self.controlled_list = {}
+        self.repair_functions = frozenset()
+        self.controlled_list = frozenset()
 
         self.target_directory = target_directory
 
@@ -536,6 +1212,9 @@ class Core(object):
         self.files = files
         self.languages = languages
         self.secret_name = secret_name
+        self.engine = engine or const.engine_backward
+        self.policy = policy or Policy(secret_name)
+        self.params = params
 
         self.rule_match = single_rule.match
         self.rule_match_mode = single_rule.match_mode
@@ -567,6 +1246,7 @@ class Core(object):
         self.repair_code_third_party = 4008
 
         self.method = None
+        self.tier = 'regex'  # 得出结论的验证层级：regex -> token -> ast
         logger.debug("""[CVI-{cvi}] [VERIFY-VULNERABILITY] ({index})
         > File: `{file}:{line}`
         > Code: `{code}`""".format(
@@ -621,7 +1301,7 @@ class Core(object):
         :method: It is determined by judging whether the left and right sides of the regex_location are brackets
         :return: boolean
         """
-        if self.rule_match_mode == 'regex-only-match':
+        if self.rule_match_mode in [const.mm_regex_only_match, 'regex-only-match']:
             return True
         else:
             return False
@@ -638,12 +1318,18 @@ class Core(object):
                - Java:
         :return: boolean
         """
-        match_result = re.findall(r"(#|\\\*|\/\/)+", self.code_content)
         # Skip detection only on match
         if self.is_match_only_rule():
             return False
-        else:
-            return len(match_result) > 0
+
+        # 预处理时记录了注释范围的文件，根据词法分析的结果判断
+        if self.lan == 'php':
+            is_comment = ast_object.is_comment(self.file_path, self.line_number)
+            if is_comment is not None:
+                return is_comment
+
+        match_result = re.findall(r"(#|\\\*|\/\/)+", self.code_content)
+        return len(match_result) > 0
 
     def is_can_parse(self):
         """
@@ -671,36 +1357,11 @@ class Core(object):
 
     def init_php_repair(self):
         """
-        初始化修复函数规则
+        从扫描的policy中获取当前规则的修复函数和输入函数
         :return: 
         """
-        # self.single_rule.svid
-        a = __import__('rules.secret.demo', fromlist=['IS_REPAIR_DEFAULT'])
-        self.repair_dict = getattr(a, 'IS_REPAIR_DEFAULT')
-
-        b = __import__('rules.secret.demo', fromlist=['IS_CONTROLLED_DEFAULT'])
-        self.controlled_list = getattr(b, 'IS_CONTROLLED_DEFAULT')
-
-        if self.secret_name is not None:
-            try:
-                # 首先加载修复函数指定
-                a = __import__('rules.secret.' + self.secret_name, fromlist=[self.secret_name])
-                a = getattr(a, self.secret_name)
-                self.repair_dict = self.repair_dict.copy()
-                self.repair_dict.update(a.items())
-
-                # 然后加载输入函数
-                b = __import__('rules.secret.' + self.secret_name, fromlist=[self.secret_name])
-                b = getattr(b, self.secret_name + "_controlled")
-                self.controlled_list += b
-
-            except ImportError:
-                logger.warning('[AST][INIT] Secret_name init error... No module named {}'.format(self.secret_name))
-
-        # init
-        for key in self.repair_dict:
-            if self.single_rule.svid in self.repair_dict[key]:
-                self.repair_functions.append(key)
+        self.repair_functions = self.policy.repair_functions(self.cvi)
+        self.controlled_list = self.policy.controlled_functions
 
     def scan(self):
         """
@@ -752,8 +1413,6 @@ class Core(object):
         if self.lan == "php":
             try:
                 self.init_php_repair()
-                ast = CAST(self.rule_match, self.target_directory, self.file_path, self.line_number,
-                           self.code_content, files=self.files, rule_class=self.single_rule, repair_functions=self.repair_functions, controlled_params=self.controlled_list)
 
                 # only match
                 if self.rule_match_mode == const.mm_regex_only_match:
@@ -766,13 +1425,24 @@ class Core(object):
 
                 # Match for function-param-regex
                 if self.rule_match_mode == const.mm_function_param_controllable:
-                    rule_match = self.rule_match.strip('()').split('|')
+                    rule_match = self.policy.sink_functions(self.rule_match)
                     logger.debug('[RULE_MATCH] {r}'.format(r=rule_match))
                     try:
                         # with open(self.file_path, 'r') as fi:
                         # fi = codecs.open(self.file_path, "r", encoding='utf-8', errors='ignore')
                         # code_contents = fi.read()
-                        result = php_scan_parser(rule_match, self.line_number, self.file_path, repair_functions=self.repair_functions, controlled_params=self.controlled_list)
+                        # 先只看sink函数的参数，常量参数和直接输入参数不需要回溯
+                        result = php_token_check(rule_match, self.line_number, self.file_path, controlled_params=self.controlled_list)
+                        if result is not None:
+                            self.tier = 'token'
+                        else:
+                            self.tier = 'ast'
+                            if self.engine == const.engine_forward:
+                                scan_function = php_scan_forward
+                            else:
+                                scan_function = php_scan_parser
+
+                            result = scan_function(rule_match, self.line_number, self.file_path, repair_functions=self.repair_functions, controlled_params=self.controlled_list)
                         logger.debug('[AST] [RET] {c}'.format(c=result))
                         if len(result) > 0:
                             if result[0]['code'] == 1:  # 函数参数可控
@@ -790,6 +1460,9 @@ class Core(object):
                             elif result[0]['code'] == 4:  # 新规则生成
                                 return False, 'New Core', result[0]['source']
 
+                            elif result[0]['code'] == 5:  # 回溯预算耗尽
+                                return False, const.budget_exhausted, result[0]['chain']
+
                             logger.debug('[AST] [CODE] {code}'.format(code=result[0]['code']))
                         else:
                             logger.debug(
@@ -802,6 +1475,10 @@ class Core(object):
                         raise
 
                 # vustomize-match
+                self.tier = 'ast'
+                ast = CAST(self.rule_match, self.target_directory, self.file_path, self.line_number,
+                           self.code_content, files=self.files, rule_class=self.single_rule, repair_functions=self.repair_functions, controlled_params=self.controlled_list,
+                           engine=self.engine, params=self.params)
                 param_is_controllable, code, data, chain = ast.is_controllable_param()
                 if param_is_controllable:
                     logger.debug('[CVI-{cvi}] [PARAM-CONTROLLABLE] Param is controllable'.format(cvi=self.cvi))
@@ -812,6 +1489,9 @@ class Core(object):
                         return False, 'Unconfirmed Vustomize-Match', chain
 
                 else:
+                    if code == 5:
+                        return False, const.budget_exhausted, chain
+
                     if type(data) is tuple:
                         if int(data[0]) == 4:
                             return False, 'New Core', data[1]
@@ -914,6 +1594,19 @@ def init_match_rule(data, lan='php'):
         return php_init_match_rule(data)
 
 
+def init_call_sites(data, index, lan='php'):
+    """
+    获取新生成规则的调用位置
+    :param lan: 
+    :param data: 
+    :param index: 
+    :return: 
+    """
+    if lan.lower() == "php":
+        return php_init_call_sites(data, index)
+    return []
+
+
 def auto_parse_match(single_match, svid, language):
     mr = VulnerabilityResult()
     # grep result
@@ -940,29 +1633,92 @@ def auto_parse_match(single_match, svid, language):
     return mr
 
 
-def NewCore(old_single_rule, target_directory, new_rules, files, count=0, languages=None, secret_name=None):
+def init_new_core():
+    """
+    清空新规则的结果缓存，每次扫描开始时调用
+    :return: 
+    """
+    new_core_results.clear()
+
+
+def get_new_rule_key(new_rules, index, repair_functions):
+    """
+    新规则的唯一标识，(函数/类, 参数位置)，修复函数不同的规则结果不能共用
+    :param new_rules: 
+    :param index: 
+    :param repair_functions: 
+    :return: 
+    """
+    node = new_rules[0]
+    kind = 'new' if isinstance(node, php.Class) else 'call'
+    return kind, node.name.lower(), index, repair_functions
+
+
+def NewCore(old_single_rule, target_directory, new_rules, files, count=0, languages=None, secret_name=None, engine=None,
+            policy=None, visited=None):
     """
     处理新的规则生成
+    新规则按广度优先展开，每个新规则在一次扫描中只分析一次，结果缓存在new_core_results中
+    :param visited: 当前规则已经展开过的新规则，同一新规则的结果只添加一次
+    :param policy: 
+    :param engine: 
     :param languages: 
     :param old_single_rule: 
     :param secret_name: 
     :param target_directory: 
     :param new_rules: 
     :param files: 
-    :param count:
+    :param count: 兼容旧接口，循环由visited切断
     :return: 
     """
-    count += 1
+    if visited is None:
+        visited = set()
+    if policy is None:
+        policy = Policy(secret_name)
 
-    if count > 20:
-        logger.warning("[New Rule] depth too big to auto exit...")
-        return False
+    svid = old_single_rule.svid
+    language = old_single_rule.language
+    repair_functions = policy.repair_functions(svid)
+
+    rule_vulnerabilities = []
+    queue = deque([new_rules])
+
+    while queue:
+        data = queue.popleft()
+
+        match, match2, vul_function, index = init_match_rule(data, lan=language)
+        key = get_new_rule_key(data, index, repair_functions)
+
+        if key in visited:
+            logger.debug('[ENGINE] [New Rule] {}() param {} already scanned, continue...'.format(key[1], index))
+            continue
+        visited.add(key)
+
+        if key not in new_core_results:
+            new_core_results[key] = new_core_scan(old_single_rule, target_directory, data, files, match,
+                                                  vul_function, index, secret_name=secret_name, engine=engine,
+                                                  policy=policy)
+
+        vulnerabilities, children = new_core_results[key]
+        for vulnerability in vulnerabilities:
+            # 结果可能被多个规则共用，复制一份标记为当前规则
+            vulnerability = copy.copy(vulnerability)
+            vulnerability.id = svid
+            rule_vulnerabilities.append(vulnerability)
+
+        queue.extend(children)
 
-    # init
+    return rule_vulnerabilities
+
+
+def new_core_scan(old_single_rule, target_directory, new_rules, files, match, vul_function, index, secret_name=None,
+                  engine=None, policy=None):
+    """
+    分析单个新规则的所有调用位置
+    :return: (漏洞列表, 需要继续展开的新规则列表)
+    """
     match_mode = "New rule to Vustomize-Match"
     logger.debug('[ENGINE] [ORIGIN] match-mode {m}'.format(m=match_mode))
-
-    match, match2, vul_function, index = init_match_rule(new_rules, lan=old_single_rule.language)
     logger.debug('[ENGINE] [New Rule] new match_rule: {}'.format(match))
 
     sr = autorule()
@@ -975,39 +1731,29 @@ def NewCore(old_single_rule, target_directory, new_rules, files, count=0, langua
     sr.svid = svid
     sr.language = language
 
-    # grep
+    rule_vulnerabilities = []
+    children = []
 
+    # 从调用点索引中获取调用位置以及对应参数中的变量
     try:
         if match:
-            f = FileParseAll(files, target_directory)
-            result = f.grep(match)
+            result = init_call_sites(new_rules, index, lan=language)
         else:
-            result = None
+            result = []
     except Exception as e:
         traceback.print_exc()
         logger.debug('match exception ({e})'.format(e=e))
-        return None
-    try:
-        result = result.decode('utf-8')
-    except AttributeError as e:
-        pass
+        return rule_vulnerabilities, children
 
     # 进入分析
     origin_vulnerabilities = result
-    rule_vulnerabilities = []
 
     for index, origin_vulnerability in enumerate(origin_vulnerabilities):
-
-        code = origin_vulnerability[2]
-        if match2 is not None:
-            if re.search(match2, code, re.I):
-                continue
+        file_path, line_number, code, params = origin_vulnerability
+        origin_vulnerability = (file_path, line_number, code)
 
         logger.debug(
             '[CVI-{cvi}] [ORIGIN] {line}'.format(cvi=svid, line=": ".join(list(origin_vulnerability))))
-        if origin_vulnerability == ():
-            logger.debug(' > continue...')
-            continue
         vulnerability = auto_parse_match(origin_vulnerability, svid, language)
         if vulnerability is None:
             logger.debug('Not vulnerability, continue...')
@@ -1015,7 +1761,8 @@ def NewCore(old_single_rule, target_directory, new_rules, files, count=0, langua
 
         try:
             datas = Core(target_directory, vulnerability, sr, 'project name',
-                         ['whitelist1', 'whitelist2'], files=files, secret_name=secret_name).scan()
+                         ['whitelist1', 'whitelist2'], files=files, secret_name=secret_name, engine=engine,
+                         policy=policy, params=params).scan()
             data = ""
 
             if len(datas) == 3:
@@ -1038,13 +1785,7 @@ def NewCore(old_single_rule, target_directory, new_rules, files, count=0, langua
             else:
                 if reason == 'New Core':  # 新的规则
                     logger.debug('[CVI-{cvi}] [NEW-VUL] New Rules init')
-                    new_rule_vulnerabilities = NewCore(sr, target_directory, data, files, count, secret_name=secret_name)
-
-                    if not new_rule_vulnerabilities:
-                        return rule_vulnerabilities
-
-                    if len(new_rule_vulnerabilities) > 0:
-                        rule_vulnerabilities.extend(new_rule_vulnerabilities)
+                    children.append(data)
 
                 else:
                     logger.debug('Not vulnerability: {code}'.format(code=reason))
@@ -1052,4 +1793,4 @@ def NewCore(old_single_rule, target_directory, new_rules, files, count=0, langua
         except Exception:
             raise
 
-    return rule_vulnerabilities
+    return rule_vulnerabilities, children
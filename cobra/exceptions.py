@@ -31,3 +31,7 @@ class NotExistException(PickupGitException):
 
 class AuthFailedException(PickupGitException):
     """Base class for Auth Failed exceptions"""
+
+
+class BudgetExhaustedException(CobraException):
+    """Base class for taint analysis budget exhausted exceptions"""
@@ -12,6 +12,7 @@
     :copyright: Copyright (c) 2017 Feei. All rights reserved
 """
 import csv
+import itertools
 import json
 import os
 import re
@@ -19,8 +20,9 @@ from codecs import open, BOM_UTF8
 
 from prettytable import PrettyTable
 
-from .config import running_path, export_path, default_result_path
+from .config import export_path, default_result_path
 from .log import logger
+from .store import store
 
 import html
 
@@ -72,17 +74,47 @@ def dict_to_json(dict_obj):
     return json.dumps(dict_obj, ensure_ascii=False)
 
 
+def dict_to_json_file(f, json_data, sid, scan_data, vul_list):
+    """
+    Write scan result to JSON file, vulnerabilities are written one by one.
+    :param f: file object
+    :param json_data: results of other scans which are already in the file
+    :param sid: scan sid
+    :param scan_data: scan result without vulnerabilities
+    :param vul_list: a list or an iterator which contains dicts
+    :return:
+    """
+    f.write('{')
+    for key, value in json_data.items():
+        if key != sid:
+            f.write('{k}: {v}, '.format(k=dict_to_json(key), v=dict_to_json(value)))
+
+    f.write('{k}: {v}'.format(k=dict_to_json(sid), v=dict_to_json(scan_data)[:-1]))
+    f.write(', "vulnerabilities": [' if scan_data else '"vulnerabilities": [')
+    for _id, vul in enumerate(vul_list):
+        if _id:
+            f.write(', ')
+        f.write(dict_to_json(vul))
+    f.write(']}}')
+
+
 def dict_to_csv(vul_list, filename):
     """
     Write scan result to file.
-    :param vul_list:a list which contains dicts
+    :param vul_list:a list or an iterator which contains dicts
     :param filename:
     :return:
     """
+    vul_list = iter(vul_list)
+    first = next(vul_list, None)
+    if first is None:
+        return
+
     # 排序并将 target 调整到第一列
-    header = sorted(vul_list[0].keys())
+    header = sorted(first.keys())
     header.remove('target')
     header.insert(0, 'target')
+    vul_list = itertools.chain([first], vul_list)
 
     # 去除列表中的换行符
 
@@ -116,6 +148,24 @@ def dict_to_pretty_table(vul_list):
     return row_list
 
 
+def get_vulnerabilities(sid, vul_list):
+    """
+    Read vulnerabilities one by one, from the findings stream if it exists, otherwise from the scan result.
+    :param sid: scan sid
+    :param vul_list: vulnerabilities in the scan result
+    :return: vulnerability dicts
+    """
+    has_findings = False
+    for finding in store.findings(sid):
+        # 回溯链不导出
+        has_findings = True
+        yield dict(finding, chain='')
+
+    if not has_findings:
+        for vul in vul_list:
+            yield vul
+
+
 def write_to_file(target, sid, output_format='', filename=None):
     """
     Export scan result to file.
@@ -136,42 +186,41 @@ def write_to_file(target, sid, output_format='', filename=None):
         filename = default_result_path + filename + "." + output_format
     #     return False
 
-    scan_data_file = os.path.join(running_path, '{sid}_data'.format(sid=sid))
-
-    if not os.path.exists(scan_data_file):
-        logger.warn("[EXPORT] {} not found".format(scan_data_file))
+    if not store.has_data(sid):
+        logger.warn("[EXPORT] Scan data of {} not found".format(sid))
         return False
 
-    with open(scan_data_file, 'r') as f:
-        scan_data = json.load(f).get('result')
+    # 结果中不包含漏洞，漏洞从漏洞流中逐个读取后直接写入文件
+    scan_data = store.data(sid, with_findings=False).get('result')
+    vulnerabilities = get_vulnerabilities(sid, scan_data.pop('vulnerabilities', None) or [])
 
-    if len(scan_data.get('vulnerabilities')) == 0:
+    first = next(vulnerabilities, None)
+    if first is None:
         logger.info("[EXPORT] Not found vulnerability, break export...")
         return False
+    vulnerabilities = itertools.chain([first], vulnerabilities)
 
-    os.chdir(export_path)
+    # 相对路径保存在export目录下
+    filename = os.path.join(export_path, filename)
     scan_data['target'] = target
 
     if output_format == '' or output_format == 'stream':
-        logger.info('Vulnerabilities\n' + str(dict_to_pretty_table(scan_data.get('vulnerabilities'))))
+        logger.info('Vulnerabilities\n' + str(dict_to_pretty_table(vulnerabilities)))
 
     elif output_format == 'json' or output_format == 'JSON':
         if not os.path.exists(filename):
             with open(filename, 'w+', encoding='utf-8', errors='ignore') as f:
-                json_data = {
-                    sid: scan_data,
-                }
-                f.write(dict_to_json(json_data))
+                dict_to_json_file(f, {}, sid, scan_data, vulnerabilities)
         else:
             with open(filename, 'r+', encoding='utf-8', errors='ignore') as f:
                 json_data = json.load(f)
-                json_data.update({sid: scan_data})
                 # 使用 r+ 模式不会覆盖，调整文件指针到开头
                 f.seek(0)
                 f.truncate()
-                f.write(dict_to_json(json_data))
+                dict_to_json_file(f, json_data, sid, scan_data, vulnerabilities)
 
     elif output_format == 'xml' or output_format == 'XML':
+        scan_data['vulnerabilities'] = list(vulnerabilities)
         xml_data = {
             sid: scan_data,
         }
@@ -191,9 +240,7 @@ def write_to_file(target, sid, output_format='', filename=None):
                 f.writelines(results)
 
     elif output_format == 'csv' or output_format == 'CSV':
-        for vul in scan_data.get('vulnerabilities'):
-            vul['target'] = scan_data.get('target')
-        dict_to_csv(scan_data.get('vulnerabilities'), filename)
+        dict_to_csv((dict(vul, target=target) for vul in vulnerabilities), filename)
 
     else:
         logger.warning('[EXPORT] Unknown output format.')
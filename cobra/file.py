@@ -16,10 +16,12 @@ import re
 import os
 import time
 import codecs
+import hashlib
 import zipfile
+from phply import phpast as php
 from .log import logger
 from .pretreatment import ast_object
-from .const import ext_dict
+from .const import ext_dict, fpc_multi, php_language_constructs
 
 try:
     from urllib import quote
@@ -57,6 +59,45 @@ def file_list_parse(filelist, language=None):
     return result
 
 
+def get_file_hashes(filelist, target):
+    """
+    扫描目标中所有文件的sha1，用于判断断点续扫时文件是否修改过
+    :param filelist: 
+    :param target: 
+    :return: {filepath: sha1}
+    """
+    result = {}
+
+    for ffile in file_list_parse(filelist):
+        file_path = os.path.join(target, ffile)
+        if not os.path.isfile(file_path):
+            continue
+
+        with open(file_path, 'rb') as f:
+            result[ffile] = hashlib.sha1(f.read()).hexdigest()
+
+    return result
+
+
+def get_file_sizes(filelist, target, language=None):
+    """
+    扫描目标中指定语言的文件数以及总字节数，用于统计扫描进度
+    :param filelist: 
+    :param target: 
+    :param language: 
+    :return: (文件数, 字节数)
+    """
+    count, size = 0, 0
+
+    for ffile in file_list_parse(filelist, language):
+        file_path = os.path.join(target, ffile)
+        if os.path.isfile(file_path):
+            count += 1
+            size += os.path.getsize(file_path)
+
+    return count, size
+
+
 def get_line(file_path, line_rule):
     """
     搜索指定文件的指定行到指定行的内容
@@ -128,6 +169,49 @@ class FileParseAll:
 
         return result
 
+    def grep_calls(self, functions, reg):
+        """
+        function-param-regex规则的sink匹配，预处理过的文件直接从调用点索引中查找，可以匹配到跨行的函数调用
+        语言结构(echo、include等)仍然使用正则匹配，没有成功解析的文件使用规则原本的正则
+        :param functions: sink函数列表
+        :param reg: 规则原本的匹配正则
+        :return: 
+        """
+        # sink中有无法作为函数名的内容时，只能使用原正则
+        if not all(re.match(r'^\w+$', function) for function in functions):
+            return self.grep(reg)
+
+        calls = [function for function in functions if function not in php_language_constructs]
+        constructs = [function for function in functions if function in php_language_constructs]
+        construct_reg = re.compile(fpc_multi.replace('[f]', '|'.join(constructs)), re.I) if constructs else None
+
+        result = []
+        for ffile in self.t_filelist:
+            file_path = self.target + ffile
+
+            if not ast_object.is_parsed(file_path):
+                result.extend(file_grep(file_path, reg))
+                continue
+
+            lines = ast_object.get_lines(file_path)
+            line_numbers = set()
+
+            for function in calls:
+                for _, lineno, node in ast_object.get_calls(function, filepath=file_path):
+                    if isinstance(node, php.FunctionCall) and node.name.lstrip('\\').lower() == function.lower():
+                        line_numbers.add(int(lineno))
+
+            if construct_reg is not None:
+                for index, line in enumerate(lines):
+                    if construct_reg.search(line):
+                        line_numbers.add(index + 1)
+
+            for line_number in sorted(line_numbers):
+                line = lines[line_number - 1] + ('\n' if line_number < len(lines) else '')
+                result.append((file_path, str(line_number), line))
+
+        return result
+
     def multi_grep(self, reg):
         """
         多行匹配，对全文做匹配
@@ -151,6 +235,39 @@ class FileParseAll:
 
         return result
     
+    def multi_grep_all(self, matchs, unmatchs=None):
+        """
+        多个正则的多行匹配，每个文件只读取一次
+        所有match都满足时成立，结果取第一个match的位置，单一unmatch满足时不成立
+        :param matchs: 
+        :param unmatchs: 
+        :return: 
+        """
+        result = []
+        matchs = [re.compile(match, re.I) for match in matchs]
+        unmatchs = [re.compile(unmatch, re.I) for unmatch in unmatchs or []]
+
+        for ffile in self.t_filelist:
+            file = codecs.open(os.path.join(self.target, ffile), "r", encoding='utf-8', errors='ignore')
+            content = file.read()
+            file.close()
+
+            r_con_obj = None
+            for match in matchs:
+                match_obj = match.search(content)
+                if match_obj is None:
+                    break
+                r_con_obj = r_con_obj or match_obj
+            else:
+                if r_con_obj is None or any(unmatch.search(content) for unmatch in unmatchs):
+                    continue
+
+                start_pos = r_con_obj.regs[0][0]
+                line_number = len(content[:start_pos].split('\n'))
+                result.append((self.target + ffile, str(line_number), r_con_obj.group(0)))
+
+        return result
+
     def multi_grep_content(self, reg, content):
         content_tmp = content
         result = []
@@ -339,10 +456,11 @@ class Directory(object):
         self.absolute_path = absolute_path
         self.black_path_list = black_path_list
 
-    file_sum = 0
-    type_nums = {}
-    result = {}
-    file = []
+        # 每次收集文件使用各自的结果，常驻进程中多次扫描时不会累加
+        self.file_sum = 0
+        self.type_nums = {}
+        self.result = {}
+        self.file = []
 
     """
     :return {'.php': {'count': 2, 'list': ['/path/a.php', '/path/b.php']}}, file_sum, time_consume
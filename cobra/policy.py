@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+"""
+    policy
+    ~~~~~~
+
+    Implements taint policy(source/sanitizer/sink)
+
+    :author:    LoRexxar <LoRexxar@gmail.com>
+    :homepage:  https://github.com/LoRexxar/cobra
+    :license:   MIT, see LICENSE for more details.
+    :copyright: Copyright (c) 2017 LoRexxar. All rights reserved
+"""
+from .log import logger
+
+
+class Policy(object):
+    """
+    每次扫描只加载一次secret配置，按CVI编号预先生成修复函数集合，供所有漏洞点共用
+    """
+    def __init__(self, secret_name=None):
+        self.secret_name = secret_name
+
+        demo = __import__('rules.secret.demo', fromlist=['IS_REPAIR_DEFAULT', 'IS_CONTROLLED_DEFAULT'])
+        repair_dict = dict(getattr(demo, 'IS_REPAIR_DEFAULT'))
+        controlled_list = list(getattr(demo, 'IS_CONTROLLED_DEFAULT'))
+
+        if secret_name is not None:
+            try:
+                # 首先加载修复函数指定，然后加载输入函数
+                secret = __import__('rules.secret.' + secret_name, fromlist=[secret_name])
+                repair_dict.update(getattr(secret, secret_name).items())
+                controlled_list += getattr(secret, secret_name + "_controlled", [])
+
+            except ImportError:
+                logger.warning('[AST][INIT] Secret_name init error... No module named {}'.format(secret_name))
+
+        # svid -> 修复函数集合
+        repairs = {}
+        for function_name, svids in repair_dict.items():
+            for svid in svids:
+                repairs.setdefault(int(svid), set()).add(function_name)
+
+        self.repair_dict = repair_dict
+        self.repairs = dict((svid, frozenset(functions)) for svid, functions in repairs.items())
+        self.controlled_functions = frozenset(controlled_list)
+
+        self.sinks = {}  # rule match -> sink函数列表
+
+    def repair_functions(self, svid):
+        """
+        获取对应规则的修复函数
+        :param svid:
+        :return: frozenset
+        """
+        return self.repairs.get(int(svid), frozenset())
+
+    def sink_functions(self, rule_match):
+        """
+        function-param-regex规则的sink函数列表，保持规则中的顺序
+        :param rule_match: e.g. (system|exec)
+        :return: list
+        """
+        if rule_match not in self.sinks:
+            self.sinks[rule_match] = rule_match.strip('()').split('|')
+        return self.sinks[rule_match]
@@ -7,13 +7,16 @@
 
 
 from phply.phplex import lexer  # 词法分析
+from phply.phplex import FilteredLexer
 from phply.phpparse import make_parser  # 语法分析
 from phply import phpast as php
 from .log import logger
 from .const import ext_dict
 
 import os
+import re
 import json
+import bisect
 import codecs
 import traceback
 import zipfile
@@ -21,6 +24,45 @@ import zipfile
 
 could_ast_pase_lans = ["php", "chromeext"]
 
+comment_tokens = ('COMMENT', 'DOC_COMMENT')
+string_tokens = ('CONSTANT_ENCAPSED_STRING', 'ENCAPSED_AND_WHITESPACE', 'QUOTE', 'START_HEREDOC', 'END_HEREDOC')
+blank_tokens = ('WHITESPACE', 'OPEN_TAG', 'CLOSE_TAG', 'INLINE_HTML')
+
+parser_cache = []  # 生成语法分析表的耗时较长，每个进程只生成一次
+
+
+def get_parser():
+    """
+    获取语法分析器，同一个分析器可以重复用于多个文件
+    :return: 
+    """
+    if not parser_cache:
+        parser_cache.append(make_parser())
+    return parser_cache[0]
+
+
+def get_fullname(name, namespace=None, uses=None):
+    """
+    按照php的规则将类名转为小写的完整类名，\\开头的为完整类名，其余先查找use导入的类，再加上当前命名空间
+    :param name: 
+    :param namespace: 当前命名空间
+    :param uses: use导入的类 别名 -> 完整类名
+    :return: 
+    """
+    if name.startswith('\\'):
+        return name.lstrip('\\').lower()
+
+    name = name.lower()
+    first, _, rest = name.partition('\\')
+
+    if uses and first in uses:
+        return uses[first] + ('\\' + rest if rest else '')
+
+    if namespace:
+        return namespace + '\\' + name
+
+    return name
+
 
 def un_zip(target_path):
     """
@@ -50,6 +92,105 @@ def un_zip(target_path):
     return target_file_path
 
 
+def get_end_lineno(node):
+    """
+    ast中没有结束行，取定义内最后一行的下一行(右括号)，内部嵌套的定义按其结束行计算
+    :param node: Function/Method/Class/Trait
+    :return: 
+    """
+    end_lineno = node.lineno
+    stack = [getattr(node, field) for field in node.fields]
+
+    while stack:
+        child = stack.pop()
+
+        if isinstance(child, list):
+            stack.extend(child)
+            continue
+
+        if not isinstance(child, php.Node):
+            continue
+
+        if isinstance(child, (php.Function, php.Method, php.Class, php.Trait)):
+            end_lineno = max(end_lineno, get_end_lineno(child))
+            continue
+
+        end_lineno = max(end_lineno, getattr(child, 'lineno', 0) or 0)
+        stack.extend(getattr(child, field) for field in child.fields)
+
+    return end_lineno + 1
+
+
+class RecordLexer(object):
+    """
+    包装phply的完整词法分析器，语法分析的同时记录注释、字符串token的行号范围以及代码所在的行
+    """
+    def __init__(self, lexer):
+        self.lexer = lexer
+        self.ranges = {'comment': [], 'string': [], 'code': set()}
+
+    @property
+    def lineno(self):
+        return self.lexer.lineno
+
+    @lineno.setter
+    def lineno(self, value):
+        self.lexer.lineno = value
+
+    @property
+    def lexpos(self):
+        return self.lexer.lexpos
+
+    @lexpos.setter
+    def lexpos(self, value):
+        self.lexer.lexpos = value
+
+    def clone(self):
+        return RecordLexer(self.lexer.clone())
+
+    def current_state(self):
+        return self.lexer.current_state()
+
+    def input(self, input):
+        self.lexer.input(input)
+
+    def token(self):
+        t = self.lexer.token()
+        if t is None or t.type in blank_tokens:
+            return t
+
+        value = t.value if isinstance(t.value, str) else ''
+        end = t.lineno + value.rstrip('\n').count('\n')
+
+        if t.type in comment_tokens:
+            kind = 'comment'
+        elif t.type in string_tokens:
+            kind = 'string'
+        else:
+            self.ranges['code'].update(range(t.lineno, end + 1))
+            return t
+
+        ranges = self.ranges[kind]
+        if ranges and ranges[-1][1] >= t.lineno - 1:
+            # 相邻的注释以及同一个字符串的多个token合并为一个范围
+            ranges[-1] = (ranges[-1][0], max(ranges[-1][1], end))
+        else:
+            ranges.append((t.lineno, end))
+
+        return t
+
+    def drain(self):
+        """
+        语法分析出错时，继续词法分析剩下的内容
+        :return: 
+        """
+        try:
+            while self.token() is not None:
+                pass
+        except Exception:
+            logger.debug('[AST] [TOKEN] lexer error: {}'.format(traceback.format_exc()))
+
+
 class Pretreatment:
 
     def __init__(self):
@@ -58,6 +199,15 @@ class Pretreatment:
 
         self.pre_result = {}
         self.define_dict = {}
+        self.call_dict = {}  # 调用点索引 (kind, name) -> {filepath: [(lineno, node)]}
+        self.call_files = {}  # filepath -> 该文件索引过的key
+        self.class_dict = {}  # 类索引 小写完整类名 -> {'name', 'fullname', 'file', 'node', 'parent', 'methods', 'properties'}
+        self.class_names = {}  # 小写短类名 -> [小写完整类名]
+        self.class_files = {}  # filepath -> 该文件中定义的类
+        self.namespace_dict = {}  # filepath -> [(lineno, namespace, uses)] 命名空间的开始行以及use导入的类
+        self.file_lines = {}  # 未经过预处理的文件 filepath -> 按行切分后的内容
+        self.range_cache = {}  # filepath -> [(name, start, end)] 函数、类的行号范围
+        self.token_dict = {}  # filepath -> {'comment': [(start, end)], 'string': [(start, end)], 'code': set(lineno)}
 
         self.pre_ast()
 
@@ -67,6 +217,18 @@ class Pretreatment:
 
         self.target_directory = os.path.normpath(self.target_directory)
 
+        # 常量、调用点索引和类索引只针对当前的扫描目标，常驻进程中不同目标之间互不影响
+        self.define_dict = {}
+        self.call_dict = {}
+        self.call_files = {}
+        self.class_dict = {}
+        self.class_names = {}
+        self.class_files = {}
+        self.namespace_dict = {}
+        self.file_lines = {}
+        self.range_cache = {}
+        self.token_dict = {}
+
     def pre_ast(self, lan=None):
 
         if lan is not None:
@@ -81,30 +243,25 @@ class Pretreatment:
             if fileext[0] in ext_dict['php']:
                 # 下面是对于php文件的处理逻辑
                 for filepath in fileext[1]['list']:
-                    all_nodes = []
-
                     filepath = os.path.join(self.target_directory, filepath)
-                    self.pre_result[filepath] = {}
-                    self.pre_result[filepath]['language'] = 'php'
-                    self.pre_result[filepath]['ast_nodes'] = []
 
                     fi = codecs.open(filepath, "r", encoding='utf-8', errors='ignore')
                     code_content = fi.read()
 
-                    self.pre_result[filepath]['content'] = code_content
-
-                    try:
-                        parser = make_parser()
-                        all_nodes = parser.parse(code_content, debug=False, lexer=lexer.clone(), tracking=True)
+                    self.range_cache.pop(os.path.normpath(filepath), None)
 
-                        # 合并字典
-                        self.pre_result[filepath]['ast_nodes'] = all_nodes
+                    cached = self.pre_result.get(filepath, {})
+                    if cached.get('content') == code_content and 'token_ranges' in cached:
+                        # 文件没有修改过时使用上次的语法分析结果，常驻进程中重复扫描同一目标时不需要重新解析
+                        all_nodes = cached['ast_nodes']
+                    else:
+                        all_nodes = self.parse_php(filepath, code_content)
 
-                    except SyntaxError as e:
-                        logger.warning('[AST] [ERROR] parser {}: {}'.format(filepath, traceback.format_exc()))
+                    self.token_dict[os.path.normpath(filepath)] = self.pre_result[filepath]['token_ranges']
 
-                    except AssertionError as e:
-                        logger.warning('[AST] [ERROR] parser {}: {}'.format(filepath, traceback.format_exc()))
+                    # 建立调用点索引以及类索引
+                    self.index_calls(filepath, all_nodes)
+                    self.index_classes(filepath, all_nodes)
 
                     # 搜索所有的常量
                     for node in all_nodes:
@@ -151,6 +308,460 @@ class Pretreatment:
                         logger.warning("[Pretreatment][Chrome Ext] File {} parse error...".format(target_files_path))
                         continue
 
+    def parse_php(self, filepath, code_content):
+        """
+        语法分析php文件，同时记录注释和字符串的范围
+        :param filepath: 
+        :param code_content: 
+        :return: ast nodes，解析失败时为空
+        """
+        all_nodes = []
+
+        self.pre_result[filepath] = {}
+        self.pre_result[filepath]['language'] = 'php'
+        self.pre_result[filepath]['ast_nodes'] = []
+        self.pre_result[filepath]['content'] = code_content
+
+        # 语法分析时顺便记录注释和字符串的范围
+        record_lexer = RecordLexer(lexer.lexer.clone())
+
+        try:
+            parser = get_parser()
+            all_nodes = parser.parse(code_content, debug=False, lexer=FilteredLexer(record_lexer), tracking=True)
+
+            # 合并字典
+            self.pre_result[filepath]['ast_nodes'] = all_nodes
+            self.pre_result[filepath]['parsed'] = True
+
+        except SyntaxError as e:
+            logger.warning('[AST] [ERROR] parser {}: {}'.format(filepath, traceback.format_exc()))
+            record_lexer.drain()
+
+        except AssertionError as e:
+            logger.warning('[AST] [ERROR] parser {}: {}'.format(filepath, traceback.format_exc()))
+            record_lexer.drain()
+
+        self.pre_result[filepath]['token_ranges'] = record_lexer.ranges
+        return all_nodes
+
+    def trim(self, target_directory):
+        """
+        只保留扫描目标中文件的预处理结果，常驻进程中避免缓存不断增长
+        :param target_directory: 
+        :return: 
+        """
+        target_directory = os.path.join(os.path.normpath(target_directory), '')
+        for filepath in list(self.pre_result):
+            if not filepath.startswith(target_directory):
+                self.pre_result.pop(filepath)
+
+    def index_calls(self, filepath, nodes):
+        """
+        遍历文件的ast，记录所有的函数调用、方法调用以及new
+        函数、方法名不区分大小写，统一转为小写
+        :param filepath: 
+        :param nodes: 
+        :return: 
+        """
+        # 重新预处理同一文件时，先去掉旧的调用点
+        for key in self.call_files.get(filepath, []):
+            self.call_dict[key].pop(filepath, None)
+
+        calls = {}
+        stack = list(nodes)[::-1]
+
+        while stack:
+            node = stack.pop()
+
+            if isinstance(node, list):
+                stack.extend(node[::-1])
+                continue
+
+            if not isinstance(node, php.Node):
+                continue
+
+            key = None
+            if isinstance(node, (php.FunctionCall, php.MethodCall, php.StaticMethodCall)):
+                key = 'call'
+            elif isinstance(node, php.New):
+                key = 'new'
+
+            if key is not None and isinstance(node.name, str):
+                key = (key, node.name.lstrip('\\').lower())
+                calls.setdefault(key, []).append((node.lineno, node))
+
+            stack.extend(getattr(node, field) for field in node.fields[::-1])
+
+        for key in calls:
+            calls[key].sort(key=lambda call: call[0])
+            self.call_dict.setdefault(key, {})[filepath] = calls[key]
+
+        self.call_files[filepath] = list(calls)
+
+    def get_calls(self, name, kind='call', filepath=None):
+        """
+        获取函数或类的所有调用点
+        :param name: 函数、方法或类名
+        :param kind: call or new
+        :param filepath: 只获取指定文件中的调用点
+        :return: [(filepath, lineno, node)]
+        """
+        result = []
+        files = self.call_dict.get((kind, name.lstrip('\\').lower()), {})
+
+        if filepath is not None:
+            filepath = os.path.normpath(filepath)
+            if filepath not in files:
+                filepath = os.path.join(self.target_directory, filepath)
+            files = {filepath: files[filepath]} if filepath in files else {}
+
+        for filepath in files:
+            for lineno, node in files[filepath]:
+                result.append((filepath, lineno, node))
+
+        return result
+
+    def index_namespaces(self, filepath, nodes):
+        """
+        记录文件中的命名空间以及use导入的类，命名空间只会出现在顶层
+        :param filepath: 
+        :param nodes: 
+        :return: [(lineno, namespace, uses)]，按开始行排序
+        """
+        scopes = [(0, None, {})]
+
+        for node in nodes:
+            if isinstance(node, php.Namespace):
+                namespace = node.name.lstrip('\\').lower() if isinstance(node.name, str) and node.name else None
+                scopes.append((node.lineno, namespace, {}))
+                declarations = [child for child in node.nodes if isinstance(child, php.UseDeclarations)]
+
+            elif isinstance(node, php.UseDeclarations):
+                declarations = [node]
+
+            else:
+                continue
+
+            uses = scopes[-1][2]
+            for declaration in declarations:
+                for use in declaration.nodes:
+                    if not isinstance(use.name, str):
+                        continue
+
+                    name = use.name.lstrip('\\').lower()
+                    alias = use.alias.lower() if isinstance(use.alias, str) else name.split('\\')[-1]
+                    uses[alias] = name
+
+        self.namespace_dict[os.path.normpath(filepath)] = scopes
+        return scopes
+
+    def get_namespace(self, filepath, lineno=0):
+        """
+        获取文件中某一行所在的命名空间以及use导入的类
+        :param filepath: 
+        :param lineno: 
+        :return: (namespace, uses)，没有记录的文件返回(None, {})
+        """
+        if filepath is None:
+            return None, {}
+
+        filepath = os.path.normpath(filepath)
+        scopes = self.namespace_dict.get(filepath)
+        if scopes is None:
+            scopes = self.namespace_dict.get(os.path.normpath(os.path.join(self.target_directory, filepath)))
+        if not scopes:
+            return None, {}
+
+        try:
+            lineno = int(lineno or 0)
+        except ValueError:
+            lineno = 0
+
+        index = max(bisect.bisect_right([scope[0] for scope in scopes], lineno) - 1, 0)
+        return scopes[index][1], scopes[index][2]
+
+    def index_classes(self, filepath, nodes):
+        """
+        记录文件中定义的类(包括trait)，保存父类、方法以及属性，类名、方法名不区分大小写
+        类以完整类名索引，父类和trait按照所在的命名空间以及use导入的类转为完整类名
+        :param filepath: 
+        :param nodes: 
+        :return: 
+        """
+        for name in self.class_files.get(filepath, []):
+            if name in self.class_dict and self.class_dict[name]['file'] == filepath:
+                self.class_dict.pop(name)
+
+                short_names = self.class_names.get(name.split('\\')[-1], [])
+                if name in short_names:
+                    short_names.remove(name)
+
+        scopes = self.index_namespaces(filepath, nodes)
+        scope_linenos = [scope[0] for scope in scopes]
+
+        classes = []
+        stack = list(nodes)[::-1]
+
+        while stack:
+            node = stack.pop()
+
+            # 类定义只会出现在顶层、命名空间或者代码块中
+            if isinstance(node, (php.Namespace, php.Block)):
+                stack.extend(node.nodes[::-1])
+                continue
+
+            if isinstance(node, php.If):
+                stack.extend([node.node] + [elseif.node for elseif in node.elseifs] +
+                             [getattr(node.else_, 'node', None)])
+                continue
+
+            if not isinstance(node, (php.Class, php.Trait)) or not isinstance(node.name, str):
+                continue
+
+            scope = scopes[max(bisect.bisect_right(scope_linenos, getattr(node, 'lineno', 0) or 0) - 1, 0)]
+            namespace, uses = scope[1], scope[2]
+
+            methods = {}
+            properties = {}
+            for class_node in node.nodes:
+                if isinstance(class_node, php.Method):
+                    methods[class_node.name.lower()] = class_node
+
+                elif isinstance(class_node, php.ClassVariables):
+                    for variable in class_node.nodes:
+                        properties[variable.name.lstrip('$')] = variable
+
+            traits = []
+            for trait_use in getattr(node, 'traits', None) or []:
+                trait_names = trait_use.name if isinstance(trait_use.name, list) else [trait_use.name]
+                traits.extend(get_fullname(trait, namespace, uses) for trait in trait_names if isinstance(trait, str))
+
+            parent = getattr(node, 'extends', None)
+            if isinstance(parent, str):
+                parent = get_fullname(parent, namespace, uses)
+            else:
+                parent = None
+
+            name = get_fullname(node.name, namespace)
+            self.class_dict[name] = {
+                'name': node.name,
+                'fullname': name,
+                'file': filepath,
+                'node': node,
+                'parent': parent,
+                'traits': traits,
+                'methods': methods,
+                'properties': properties,
+            }
+
+            short_names = self.class_names.setdefault(node.name.lower(), [])
+            if name not in short_names:
+                short_names.append(name)
+            classes.append(name)
+
+        self.class_files[filepath] = classes
+
+    def find_class(self, fullname):
+        """
+        按照完整类名查找类定义，找不到时如果短类名只对应一个类则使用该类
+        :param fullname: 小写的完整类名
+        :return: dict or None
+        """
+        if fullname in self.class_dict:
+            return self.class_dict[fullname]
+
+        short_names = self.class_names.get(fullname.split('\\')[-1], [])
+        if len(short_names) == 1:
+            return self.class_dict[short_names[0]]
+
+        return None
+
+    def get_class(self, class_name, filepath=None, lineno=0):
+        """
+        获取类定义，类名按照filepath中lineno所在的命名空间解析
+        :param class_name: 
+        :param filepath: 使用类名的文件
+        :param lineno: 使用类名的行号
+        :return: dict or None
+        """
+        if not isinstance(class_name, str):
+            return None
+
+        namespace, uses = self.get_namespace(filepath, lineno)
+        return self.find_class(get_fullname(class_name, namespace, uses))
+
+    def get_class_chain(self, class_name, filepath=None, lineno=0):
+        """
+        获取类以及所有父类、trait，子类在前
+        :param class_name: 
+        :param filepath: 使用类名的文件
+        :param lineno: 使用类名的行号
+        :return: [dict]
+        """
+        chain = []
+        seen = set()
+        entry = self.get_class(class_name, filepath, lineno)
+        entries = [entry] if entry is not None else []
+
+        while entries:
+            entry = entries.pop(0)
+            if entry is None or entry['fullname'] in seen:
+                continue
+
+            seen.add(entry['fullname'])
+            chain.append(entry)
+
+            names = entry['traits'] + ([entry['parent']] if entry['parent'] else [])
+            entries = [self.find_class(name) for name in names] + entries
+
+        return chain
+
+    def get_method(self, class_name, method_name, filepath=None, lineno=0):
+        """
+        沿继承链查找方法
+        :param class_name: 
+        :param method_name: 
+        :param filepath: 使用类名的文件
+        :param lineno: 使用类名的行号
+        :return: (类定义, Method) or (None, None)
+        """
+        for entry in self.get_class_chain(class_name, filepath, lineno):
+            if method_name.lower() in entry['methods']:
+                return entry, entry['methods'][method_name.lower()]
+
+        return None, None
+
+    def get_property(self, class_name, property_name, filepath=None, lineno=0):
+        """
+        沿继承链查找属性定义
+        :param class_name: 
+        :param property_name: 
+        :param filepath: 使用类名的文件
+        :param lineno: 使用类名的行号
+        :return: (类定义, ClassVariable) or (None, None)
+        """
+        for entry in self.get_class_chain(class_name, filepath, lineno):
+            if property_name.lstrip('$') in entry['properties']:
+                return entry, entry['properties'][property_name.lstrip('$')]
+
+        return None, None
+
+    def get_lines(self, filepath):
+        """
+        按行切分后的文件内容，第一次使用时生成，未经过预处理的文件直接读取
+        :param filepath: 
+        :return: 
+        """
+        filepath = os.path.normpath(filepath)
+
+        if filepath in self.pre_result and 'content' in self.pre_result[filepath]:
+            if 'lines' not in self.pre_result[filepath]:
+                self.pre_result[filepath]['lines'] = self.pre_result[filepath]['content'].split('\n')
+            return self.pre_result[filepath]['lines']
+
+        if filepath not in self.file_lines:
+            if not os.path.isfile(filepath):
+                logger.warning("[AST] file {} parser not found...".format(filepath))
+                return False
+
+            with codecs.open(filepath, "r", encoding='utf-8', errors='ignore') as f:
+                self.file_lines[filepath] = f.read().split('\n')
+
+        return self.file_lines[filepath]
+
+    def get_token_ranges(self, filepath):
+        filepath = os.path.normpath(filepath)
+
+        if filepath in self.token_dict:
+            return self.token_dict[filepath]
+
+        return self.token_dict.get(os.path.normpath(os.path.join(self.target_directory, filepath)))
+
+    def in_token_range(self, filepath, lineno, kind):
+        """
+        某一行是否完全处于注释或字符串中，即该行没有代码
+        :param filepath: 
+        :param lineno: 
+        :param kind: comment or string
+        :return: True/False，文件没有经过词法分析时返回None
+        """
+        token_ranges = self.get_token_ranges(filepath)
+        if token_ranges is None:
+            return None
+
+        try:
+            lineno = int(lineno)
+        except ValueError:
+            return None
+
+        if lineno in token_ranges['code']:
+            return False
+
+        ranges = token_ranges[kind]
+        index = bisect.bisect_right(ranges, (lineno, float('inf'))) - 1
+
+        return index >= 0 and ranges[index][0] <= lineno <= ranges[index][1]
+
+    def is_comment(self, filepath, lineno):
+        return self.in_token_range(filepath, lineno, 'comment')
+
+    def is_string(self, filepath, lineno):
+        return self.in_token_range(filepath, lineno, 'string')
+
+    def get_ranges(self, filepath, regex=None):
+        """
+        文件中函数、方法以及类的行号范围，外层在前，每个文件只生成一次
+        有ast时根据ast生成，否则根据函数定义的正则匹配，结束行为下一个函数的开始行
+        :param filepath: 
+        :param regex: 函数定义的正则，第一个非空分组为函数名
+        :return: [(name, start, end)]
+        """
+        filepath = os.path.normpath(filepath)
+
+        if filepath in self.range_cache:
+            return self.range_cache[filepath]
+
+        lines = self.get_lines(filepath)
+        if lines is False:
+            return []
+
+        ranges = []
+        nodes = self.pre_result.get(filepath, {}).get('ast_nodes')
+
+        if nodes:
+            stack = list(nodes)[::-1]
+
+            while stack:
+                node = stack.pop()
+
+                if isinstance(node, list):
+                    stack.extend(node[::-1])
+                    continue
+
+                if not isinstance(node, php.Node):
+                    continue
+
+                if isinstance(node, (php.Function, php.Method, php.Class, php.Trait)):
+                    ranges.append((node.name, node.lineno, min(get_end_lineno(node), len(lines))))
+
+                stack.extend(getattr(node, field) for field in node.fields[::-1])
+
+        elif regex is not None:
+            for index, line in enumerate(lines):
+                function_name = re.findall(regex, line)
+                if not function_name:
+                    continue
+
+                if isinstance(function_name[0], tuple):
+                    function_name = [name for name in function_name[0] if name] or ['']
+
+                if ranges:
+                    ranges[-1] = (ranges[-1][0], ranges[-1][1], index + 1)
+                ranges.append((function_name[0], index + 1, len(lines)))
+
+        self.range_cache[filepath] = ranges
+        return ranges
+
     def get_nodes(self, filepath):
         filepath = os.path.normpath(filepath)
 
@@ -164,6 +775,19 @@ class Pretreatment:
             logger.warning("[AST] file {} parser not found...".format(filepath))
             return False
 
+    def is_parsed(self, filepath):
+        """
+        文件是否成功生成了ast，解析失败的文件调用点索引不完整
+        :param filepath: 
+        :return: 
+        """
+        filepath = os.path.normpath(filepath)
+
+        if filepath not in self.pre_result:
+            filepath = os.path.join(self.target_directory, filepath)
+
+        return self.pre_result.get(filepath, {}).get('parsed', False)
+
     def get_content(self, filepath):
         filepath = os.path.normpath(filepath)
 
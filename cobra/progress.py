@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+"""
+    progress
+    ~~~~~~~~
+
+    Implements scan progress and throughput telemetry
+
+    :author:    LoRexxar <LoRexxar@gmail.com>
+    :homepage:  https://github.com/LoRexxar/cobra
+    :license:   MIT, see LICENSE for more details.
+    :copyright: Copyright (c) 2017 LoRexxar. All rights reserved
+"""
+import json
+import os
+import sys
+import time
+
+import portalocker
+
+from .config import running_path
+
+
+def format_size(size):
+    """
+    字节数转为便于阅读的格式
+    :param size:
+    :return:
+    """
+    for unit in ['B', 'KB', 'MB']:
+        if size < 1024:
+            return '{s:.1f}{u}'.format(s=size, u=unit)
+        size /= 1024.0
+
+    return '{s:.1f}GB'.format(s=size)
+
+
+class Progress(object):
+    """
+    扫描进度：阶段、规则进度、处理的文件数以及字节数、已发现的漏洞、吞吐量和预计剩余时间
+    定时写入运行状态目录(<sid>_progress)，调度方据此判断是否继续等待，可以在终端单行刷新显示
+    """
+    def __init__(self, sid=None, console=False, interval=1):
+        self.file_path = os.path.join(running_path, '{sid}_progress'.format(sid=sid)) if sid is not None else None
+        self.console = console
+        self.interval = interval  # 两次写入之间的最小间隔(秒)
+
+        self.phase = None
+        self.start_time = time.time()
+        self.phase_time = self.start_time
+        self.last_update = 0
+        self.work = {}  # 规则名 -> (文件数, 字节数)
+
+        self.rules_total = self.rules_done = 0
+        self.files_total = self.files_done = 0
+        self.bytes_total = self.bytes_done = 0
+        self.findings = 0
+
+    def start(self, phase, files=0, size=0, work=None):
+        """
+        开始新的阶段
+        :param phase: pretreatment, scan, report, done
+        :param files: 该阶段需要处理的文件数
+        :param size: 该阶段需要处理的字节数
+        :param work: 规则名 -> (文件数, 字节数)，扫描阶段按规则统计
+        :return:
+        """
+        self.phase = phase
+        self.phase_time = time.time()
+        self.work = work or {}
+
+        self.rules_total, self.rules_done = len(self.work), 0
+        self.files_total = files + sum(w[0] for w in self.work.values())
+        self.bytes_total = size + sum(w[1] for w in self.work.values())
+        self.files_done = self.bytes_done = 0
+
+        self.update(force=True)
+
+    def advance(self, files=0, size=0, findings=0):
+        self.files_done += files
+        self.bytes_done += size
+        self.findings += findings
+        self.update()
+
+    def rule_done(self, rule_name):
+        """
+        规则扫描完成(包括跳过以及续扫还原的规则)
+        :param rule_name:
+        :return:
+        """
+        files, size = self.work.get(rule_name, (0, 0))
+        self.rules_done += 1
+        self.advance(files=files, size=size)
+
+    def data(self):
+        now = time.time()
+        elapsed = now - self.phase_time
+        throughput = self.bytes_done / elapsed if elapsed > 0 else 0
+
+        eta = None
+        if self.bytes_total and throughput > 0:
+            eta = (self.bytes_total - self.bytes_done) / throughput
+        elif self.rules_total and self.rules_done:
+            eta = elapsed / self.rules_done * (self.rules_total - self.rules_done)
+
+        return {
+            'phase': self.phase,
+            'rules_done': self.rules_done,
+            'rules_total': self.rules_total,
+            'files_done': self.files_done,
+            'files_total': self.files_total,
+            'bytes_done': self.bytes_done,
+            'bytes_total': self.bytes_total,
+            'findings': self.findings,
+            'throughput': round(throughput, 3),
+            'eta': None if eta is None else round(eta, 3),
+            'elapsed': round(now - self.start_time, 3),
+            'time': now,
+        }
+
+    def update(self, force=False):
+        """
+        写入进度记录，两次写入的间隔小于interval时跳过
+        :param force:
+        :return:
+        """
+        if not force and time.time() - self.last_update < self.interval:
+            return
+
+        self.last_update = time.time()
+        data = self.data()
+
+        if self.file_path is not None:
+            with open(self.file_path, 'w') as f:
+                portalocker.lock(f, portalocker.LOCK_EX)
+                f.write(json.dumps(data, sort_keys=True))
+
+        if self.console:
+            line = '[PROGRESS] {phase} rules: {rd}/{rt} files: {fd}/{ft} {bd}/{bt} findings: {fi} {tp}/s ETA: {eta}'.format(
+                phase=data['phase'], rd=data['rules_done'], rt=data['rules_total'], fd=data['files_done'],
+                ft=data['files_total'], bd=format_size(data['bytes_done']), bt=format_size(data['bytes_total']),
+                fi=data['findings'], tp=format_size(data['throughput']),
+                eta='unknown' if data['eta'] is None else '{:.0f}s'.format(data['eta']))
+            sys.stderr.write('\r' + line.ljust(100))
+            sys.stderr.flush()
+
+    def set_phase(self, phase):
+        """
+        切换阶段，保留当前的统计数据
+        :param phase:
+        :return:
+        """
+        self.phase = phase
+        self.update(force=True)
+
+    def finish(self):
+        self.set_phase('done')
+        if self.console:
+            sys.stderr.write('\n')
+            sys.stderr.flush()
@@ -11,6 +11,8 @@
     :license:   MIT, see LICENSE for more details.
     :copyright: Copyright (c) 2017 Feei. All rights reserved
 """
+import hashlib
+import os
 
 
 class VulnerabilityResult:
@@ -25,8 +27,26 @@ class VulnerabilityResult:
         self.line_number = None
         self.code_content = None
         self.commit_author = 'Unknown'
+        self.fingerprint = ''
 
     def convert_to_dict(self):
         _dict = {}
         _dict.update(self.__dict__)
         return _dict
+
+    def get_fingerprint(self):
+        """
+        漏洞指纹，由规则、路径、行号以及去掉空白后的代码生成，代码中包含了sink点
+        :return: sha1
+        """
+        code_content = self.code_content
+        if isinstance(code_content, bytes):
+            code_content = code_content.decode('utf-8', errors='ignore')
+
+        fingerprint = u'{id}|{path}|{line}|{code}'.format(
+            id=self.id,
+            path=os.path.normpath(self.file_path or '').replace('\\', '/').lstrip('/'),
+            line=self.line_number,
+            code=' '.join((code_content or '').split())
+        )
+        return hashlib.sha1(fingerprint.encode('utf-8')).hexdigest()
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+"""
+    stats
+    ~~~~~
+
+    Implements per-rule scan statistics and cost-aware rule scheduling
+
+    :author:    LoRexxar <LoRexxar@gmail.com>
+    :homepage:  https://github.com/LoRexxar/cobra
+    :license:   MIT, see LICENSE for more details.
+    :copyright: Copyright (c) 2017 LoRexxar. All rights reserved
+"""
+import json
+import os
+
+import portalocker
+
+from .config import rule_stats_path
+from .log import logger
+
+
+class RuleStats(object):
+    """
+    记录每个规则的匹配数量、验证数量以及耗时，多进程扫描时耗时长的规则先开始
+    同一规则在不同项目上的耗时差别很大，记录按扫描目标分开保存
+    """
+    def __init__(self, file_path=rule_stats_path, target=None):
+        self.file_path = file_path
+        self.target = os.path.abspath(target) if target else ''
+        self.stats = self.load().get(self.target, {})
+
+    def load(self):
+        """
+        读取所有扫描目标的记录，文件通过os.replace整体替换，读取时不会读到写了一半的内容
+        :return: {扫描目标: {规则名: 记录}}
+        """
+        if not os.path.isfile(self.file_path):
+            return {}
+
+        try:
+            with open(self.file_path) as f:
+                data = json.loads(f.read() or '{}')
+        except (IOError, ValueError) as e:
+            logger.warning('[STATS] Rule stats {} load error: {}'.format(self.file_path, e))
+            return {}
+
+        if not isinstance(data, dict) or any(isinstance(v, dict) and 'time' in v for v in data.values()):
+            # 旧格式的记录没有区分扫描目标，不再使用
+            return {}
+
+        return data
+
+    def save(self):
+        """
+        合并其他扫描目标的最新记录后写入临时文件，再替换原文件
+        读取、合并、替换的过程通过单独的锁文件互斥，同时结束的扫描不会覆盖彼此的记录
+        :return:
+        """
+        with open(self.file_path + '.lock', 'a') as lock:
+            portalocker.lock(lock, portalocker.LOCK_EX)
+
+            data = self.load()
+            data[self.target] = self.stats
+
+            tmp_path = '{path}.{pid}.tmp'.format(path=self.file_path, pid=os.getpid())
+            with open(tmp_path, 'w') as f:
+                f.write(json.dumps(data, sort_keys=True))
+            os.replace(tmp_path, self.file_path)
+
+    def predict(self, rule_name):
+        """
+        预计耗时，没有记录时返回None
+        :param rule_name: 
+        :return: 秒
+        """
+        return self.stats.get(rule_name, {}).get('time')
+
+    def schedule(self, rule_names):
+        """
+        按预计耗时从大到小排序，没有记录的规则耗时未知，最先开始
+        :param rule_names: 
+        :return: 
+        """
+        def cost(rule_name):
+            predict = self.predict(rule_name)
+            return float('inf') if predict is None else predict
+
+        return sorted(rule_names, key=cost, reverse=True)
+
+    def record(self, rule_name, hits, verified, seconds):
+        """
+        记录规则本次扫描的数据，耗时取和历史记录的平均，减少单次波动的影响
+        :param rule_name: 
+        :param hits: 正则匹配数量
+        :param verified: 验证数量
+        :param seconds: 耗时
+        :return: 
+        """
+        predict = self.predict(rule_name)
+
+        self.stats[rule_name] = {
+            'hits': hits,
+            'verified': verified,
+            'last_time': round(seconds, 3),
+            'time': round(seconds if predict is None else (predict + seconds) / 2, 3),
+        }
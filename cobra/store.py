@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+
+"""
+    store
+    ~~~~~
+
+    Implements running state store(SQLite)
+
+    :author:    LoRexxar <LoRexxar@gmail.com>
+    :homepage:  https://github.com/LoRexxar/cobra
+    :license:   MIT, see LICENSE for more details.
+    :copyright: Copyright (c) 2017 LoRexxar. All rights reserved
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from .config import running_path, running_db_path
+
+schema = """
+CREATE TABLE IF NOT EXISTS scans (
+    sid TEXT PRIMARY KEY,
+    total_target_num INTEGER,
+    data TEXT,
+    created REAL,
+    updated REAL
+);
+CREATE TABLE IF NOT EXISTS targets (
+    sid TEXT,
+    target_sid TEXT,
+    target TEXT,
+    PRIMARY KEY (sid, target_sid)
+);
+CREATE TABLE IF NOT EXISTS status (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    sid TEXT,
+    data TEXT,
+    time REAL
+);
+CREATE INDEX IF NOT EXISTS status_sid ON status (sid, id);
+CREATE TABLE IF NOT EXISTS findings (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    sid TEXT,
+    rule TEXT,
+    file_path TEXT,
+    line_number TEXT,
+    fingerprint TEXT,
+    data TEXT
+);
+CREATE INDEX IF NOT EXISTS findings_sid ON findings (sid, id);
+CREATE INDEX IF NOT EXISTS findings_rule ON findings (sid, rule);
+CREATE INDEX IF NOT EXISTS findings_file ON findings (sid, file_path);
+"""
+
+
+def read_findings(file_path):
+    """
+    逐行读取漏洞流(NDJSON)
+    :param file_path:
+    :return:
+    """
+    with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+class Store(object):
+    """
+    扫描运行状态：扫描、扫描目标、状态记录以及漏洞，漏洞逐行追加，按扫描、规则以及文件建立索引
+    使用WAL模式，多个扫描进程同时写入时不需要锁住整个文件，读取不会被写入阻塞
+    数据库中没有的扫描从原来的json文件(<sid>_list, <sid>_status, <sid>_data, <sid>_findings)读取
+    """
+    def __init__(self, db_path=running_db_path):
+        self.db_path = db_path
+        self.local = threading.local()
+
+    def connect(self):
+        # 每个线程使用各自的连接，多进程扫描时子进程不能使用父进程的连接
+        if getattr(self.local, 'conn', None) is None or self.local.pid != os.getpid():
+            self.local.conn = sqlite3.connect(self.db_path, timeout=30)
+            self.local.conn.execute('PRAGMA journal_mode=WAL')
+            self.local.conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn.executescript(schema)
+            self.local.pid = os.getpid()
+
+        return self.local.conn
+
+    def close(self):
+        if getattr(self.local, 'conn', None) is not None and self.local.pid == os.getpid():
+            self.local.conn.close()
+        self.local.conn = None
+
+    @staticmethod
+    def legacy_path(sid, ext):
+        return os.path.join(running_path, '{sid}_{ext}'.format(sid=sid, ext=ext))
+
+    def touch(self, conn, sid):
+        now = time.time()
+        conn.execute('INSERT OR IGNORE INTO scans (sid, created, updated) VALUES (?, ?, ?)', (sid, now, now))
+        conn.execute('UPDATE scans SET updated = ? WHERE sid = ?', (now, sid))
+
+    def has_scan(self, sid):
+        conn = self.connect()
+        return conn.execute('SELECT 1 FROM scans WHERE sid = ?', (sid,)).fetchone() is not None
+
+    def init_list(self, sid, total_target_num):
+        """
+        初始化扫描目标列表，已经存在时不修改
+        :param sid:
+        :param total_target_num:
+        :return:
+        """
+        conn = self.connect()
+        with conn:
+            self.touch(conn, sid)
+            conn.execute('UPDATE scans SET total_target_num = ? WHERE sid = ? AND total_target_num IS NULL',
+                         (total_target_num, sid))
+
+    def add_target(self, sid, target_sid, target):
+        conn = self.connect()
+        with conn:
+            self.touch(conn, sid)
+            conn.execute('INSERT OR REPLACE INTO targets (sid, target_sid, target) VALUES (?, ?, ?)',
+                         (sid, target_sid, json.dumps(target)))
+
+    def list(self, sid):
+        """
+        扫描目标列表，格式与<sid>_list相同
+        :param sid:
+        :return:
+        """
+        conn = self.connect()
+        row = conn.execute('SELECT total_target_num FROM scans WHERE sid = ?', (sid,)).fetchone()
+        if row is None or row[0] is None:
+            with open(self.legacy_path(sid, 'list'), 'r') as f:
+                return json.loads(f.read())
+
+        targets = conn.execute('SELECT target_sid, target FROM targets WHERE sid = ?', (sid,))
+        return {
+            'sids': dict((target_sid, json.loads(target)) for target_sid, target in targets),
+            'total_target_num': row[0],
+        }
+
+    def add_status(self, sid, data):
+        """
+        追加状态记录，保留状态变化的历史
+        :param sid:
+        :param data:
+        :return:
+        """
+        conn = self.connect()
+        with conn:
+            self.touch(conn, sid)
+            conn.execute('INSERT INTO status (sid, data, time) VALUES (?, ?, ?)', (sid, json.dumps(data), time.time()))
+
+    def status(self, sid):
+        """
+        最新的状态
+        :param sid:
+        :return:
+        """
+        conn = self.connect()
+        row = conn.execute('SELECT data FROM status WHERE sid = ? ORDER BY id DESC LIMIT 1', (sid,)).fetchone()
+        if row is None:
+            with open(self.legacy_path(sid, 'status')) as f:
+                return json.loads(f.read())
+
+        return json.loads(row[0])
+
+    def status_history(self, sid):
+        conn = self.connect()
+        return [(json.loads(data), t) for data, t in
+                conn.execute('SELECT data, time FROM status WHERE sid = ? ORDER BY id', (sid,))]
+
+    def set_data(self, sid, data):
+        """
+        保存扫描结果，结果中的漏洞保存在findings表中，漏洞流中已经有漏洞时不重复保存
+        :param sid:
+        :param data:
+        :return:
+        """
+        data = dict(data)
+        vulnerabilities = None
+        if isinstance(data.get('result'), dict) and 'vulnerabilities' in data['result']:
+            data['result'] = dict(data['result'])
+            vulnerabilities = data['result'].pop('vulnerabilities')
+
+        conn = self.connect()
+        with conn:
+            self.touch(conn, sid)
+            conn.execute('UPDATE scans SET data = ? WHERE sid = ?', (json.dumps(data, sort_keys=True), sid))
+            if vulnerabilities and not self.count_findings(sid):
+                self.insert_findings(conn, sid, vulnerabilities)
+
+    def data(self, sid, with_findings=True):
+        """
+        扫描结果，格式与<sid>_data相同
+        :param sid:
+        :param with_findings: 是否读取全部漏洞放入结果中，逐个处理漏洞时使用findings()
+        :return:
+        """
+        conn = self.connect()
+        row = conn.execute('SELECT data FROM scans WHERE sid = ?', (sid,)).fetchone()
+        if row is None or row[0] is None:
+            with open(self.legacy_path(sid, 'data')) as f:
+                return json.loads(f.read())
+
+        data = json.loads(row[0])
+        if with_findings and isinstance(data.get('result'), dict):
+            data['result']['vulnerabilities'] = list(self.findings(sid))
+
+        return data
+
+    def has_status(self, sid):
+        conn = self.connect()
+        if conn.execute('SELECT 1 FROM status WHERE sid = ? LIMIT 1', (sid,)).fetchone() is not None:
+            return True
+        return os.path.isfile(self.legacy_path(sid, 'status'))
+
+    def has_data(self, sid):
+        conn = self.connect()
+        row = conn.execute('SELECT data FROM scans WHERE sid = ?', (sid,)).fetchone()
+        if row is not None and row[0] is not None:
+            return True
+        return os.path.isfile(self.legacy_path(sid, 'data'))
+
+    def clear_findings(self, sid):
+        conn = self.connect()
+        with conn:
+            self.touch(conn, sid)
+            conn.execute('DELETE FROM findings WHERE sid = ?', (sid,))
+
+    @staticmethod
+    def insert_findings(conn, sid, findings):
+        conn.executemany(
+            'INSERT INTO findings (sid, rule, file_path, line_number, fingerprint, data) VALUES (?, ?, ?, ?, ?, ?)',
+            [(sid, str(finding.get('id')), finding.get('file_path'), str(finding.get('line_number')),
+              finding.get('fingerprint'), json.dumps(finding, sort_keys=True, default=str)) for finding in findings])
+
+    def add_findings(self, sid, findings):
+        """
+        追加漏洞，每个漏洞一行
+        :param sid:
+        :param findings: 漏洞字典列表
+        :return:
+        """
+        conn = self.connect()
+        with conn:
+            self.touch(conn, sid)
+            self.insert_findings(conn, sid, findings)
+
+    def count_findings(self, sid):
+        conn = self.connect()
+        return conn.execute('SELECT COUNT(*) FROM findings WHERE sid = ?', (sid,)).fetchone()[0]
+
+    def findings(self, sid, rule=None, file_path=None):
+        """
+        按写入顺序逐个返回漏洞，可以按规则(CVI)以及文件过滤
+        :param sid:
+        :param rule:
+        :param file_path:
+        :return:
+        """
+        if not self.has_scan(sid):
+            legacy = self.legacy_path(sid, 'findings')
+            if os.path.isfile(legacy):
+                for finding in read_findings(legacy):
+                    if (rule is None or str(finding.get('id')) == str(rule)) and \
+                            (file_path is None or finding.get('file_path') == file_path):
+                        yield finding
+            return
+
+        sql = 'SELECT data FROM findings WHERE sid = ?'
+        args = [sid]
+        if rule is not None:
+            sql += ' AND rule = ?'
+            args.append(str(rule))
+        if file_path is not None:
+            sql += ' AND file_path = ?'
+            args.append(file_path)
+
+        # 直接迭代游标，每次只读取一行
+        conn = self.connect()
+        for row in conn.execute(sql + ' ORDER BY id', args):
+            yield json.loads(row[0])
+
+
+store = Store()
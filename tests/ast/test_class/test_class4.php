@@ -0,0 +1,19 @@
+<?php
+class base4{
+    public $cmd = "ls";
+    public $arg;
+
+    function __construct(){
+        $this->arg = $_GET['arg'];
+    }
+}
+
+class child4 extends base4{
+    function run(){
+        system($this->cmd);
+    }
+
+    function run2(){
+        system($this->arg);
+    }
+}
@@ -0,0 +1,15 @@
+<?php
+
+class Walker {
+    function run() {
+        return $this->walk();
+    }
+
+    function walk() {
+        return $this->run();
+    }
+}
+
+$walker = new Walker();
+$cmd = $walker->run();
+system($cmd);
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+"""
+    tests.conftest
+    ~~~~~~~~~~~~~~
+
+    Shared fixtures for scan tests
+
+    :author:    LoRexxar <LoRexxar@gmail.com>
+    :homepage:  https://github.com/LoRexxar/cobra
+    :license:   MIT, see LICENSE for more details.
+    :copyright: Copyright (c) 2017 LoRexxar. All rights reserved
+"""
+import pytest
+
+from cobra.config import project_directory
+from cobra.pretreatment import ast_object
+
+
+def pretreat(target_directory, names):
+    """
+    预处理扫描目标中的php文件
+    :param target_directory:
+    :param names: 文件名列表
+    :return: (target_directory, files)
+    """
+    files = [('.php', {'list': list(names)})]
+    ast_object.init_pre(target_directory, files)
+    ast_object.pre_ast()
+    return target_directory, files
+
+
+@pytest.fixture
+def vulnerabilities_target():
+    """
+    预处理tests/vulnerabilities中的v.php和v_parser.php
+    :return: (target_directory, files)
+    """
+    return pretreat(project_directory + '/tests/vulnerabilities/', ["v.php", "v_parser.php"])
+
+
+@pytest.fixture
+def php_target(tmp_path):
+    """
+    在临时目录中写入php文件并预处理，文件修改后再次调用重新预处理
+    :return: 函数 {文件名: 内容} -> (target_directory, files)
+    """
+    def write(contents):
+        for name, content in contents.items():
+            (tmp_path / name).write_text(content)
+        return pretreat(str(tmp_path) + '/', sorted(path.name for path in tmp_path.glob('*.php')))
+
+    return write
@@ -0,0 +1,46 @@
+<?php
+
+$a = $_GET['a'];
+if ($a) {
+    $b = 'ls';
+} else {
+    $b = $a;
+}
+system($b);
+
+$c = 'ls';
+while (true) {
+    system($c);
+    $c = $_GET['c'];
+}
+
+foreach ($_POST as $key => $value) {
+    system($value);
+}
+
+$e = 'ls ';
+$e .= $_GET['e'];
+system($e);
+
+list($f, $g) = array($_GET['f'], 'ls');
+system($f);
+
+function run($cmd) {
+    system($cmd);
+}
+
+class Command {
+    function get() {
+        $cmd = $_GET['cmd'];
+        return $cmd;
+    }
+}
+
+$command = new Command();
+$h = $command->get();
+system($h);
+
+$i = 'ls';
+for ($j = 0; $j < 2; $j++) {
+    system($i);
+}
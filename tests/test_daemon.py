@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+"""
+    tests.test_daemon
+    ~~~~~~~~~~~~~~~~~
+
+    Tests cobra.daemon
+
+    :author:    LoRexxar <LoRexxar@gmail.com>
+    :homepage:  https://github.com/LoRexxar/cobra
+    :license:   MIT, see LICENSE for more details.
+    :copyright: Copyright (c) 2017 LoRexxar. All rights reserved
+"""
+import asyncio
+import json
+import os
+
+from cobra import cli
+from cobra import daemon as cobra_daemon
+from cobra import engine
+from cobra import export
+from cobra import progress
+from cobra import store as cobra_store
+from cobra.config import project_directory
+from cobra.daemon import Daemon
+from cobra.engine import Running
+from cobra.pretreatment import ast_object
+from cobra.store import Store
+
+
+def use_tmp_running(monkeypatch, tmp_path):
+    """
+    扫描状态以及结果保存到临时目录，不受之前扫描的影响
+    :param monkeypatch:
+    :param tmp_path:
+    :return: Store
+    """
+    running_path = str(tmp_path / 'running')
+    os.mkdir(running_path)
+    store = Store(os.path.join(running_path, 'running.db'))
+    for module in [cobra_store, engine, progress]:
+        monkeypatch.setattr(module, 'running_path', running_path)
+    for module in [cobra_daemon, engine, export]:
+        monkeypatch.setattr(module, 'store', store)
+    return store
+
+
+def test_daemon_job(monkeypatch, tmp_path, php_target):
+    use_tmp_running(monkeypatch, tmp_path)
+    daemon = Daemon()
+    daemon.queue = asyncio.Queue()
+    target = project_directory + '/tests/vulnerabilities/'
+
+    # 其他目标的预处理结果在扫描结束后去掉
+    php_target({'other.php': "<?php\nsystem($_GET['a']);\n"})
+    assert ast_object.get_object(str(tmp_path / 'other.php'))
+
+    status, result = daemon.route('POST', '/api/add', {}, json.dumps({
+        'target': target, 'language': 'php', 'rule': 1011, 'format': 'json',
+        'output': str(tmp_path / 'daemon.json')}).encode('utf-8'))
+    a_sid = result['result']['sid']
+    assert status == 200 and a_sid.startswith('a')
+    assert daemon.route('GET', '/api/status', {'sid': a_sid}, b'')[1]['result']['status'] == 'queued'
+
+    # 扫描与命令行扫描相同，状态以及结果保存在Running中
+    daemon.run_job(daemon.queue.get_nowait())
+    status, result = daemon.route('GET', '/api/status', {'sid': a_sid}, b'')
+    assert result['result']['status'] == 'done'
+    assert len(result['result']['sids']) == 1
+    s_sid, target_status = list(result['result']['sids'].items())[0]
+    assert target_status['finished'] is True
+    assert len(Running(s_sid).data()['result']['vulnerabilities']) == 2
+
+    assert ast_object.get_object(str(tmp_path / 'other.php')) is False
+    assert ast_object.get_object(target + 'v.php')
+
+    status, result = daemon.route('GET', '/api/findings', {'sid': s_sid, 'file': 'v.php'}, b'')
+    assert [(str(f['id']), f['line_number']) for f in result['result']] == [('1011', '20')]
+
+    assert daemon.route('POST', '/api/add', {}, b'{"target": "", "engine": "x"}')[0] == 400
+    assert daemon.route('POST', '/api/add', {}, b'{"target": "x", "jobs": "two"}')[0] == 400
+    assert daemon.route('POST', '/api/add', {}, b'{"target": "x", "jobs": 0}')[0] == 400
+    assert daemon.route('POST', '/api/add', {}, b'{"target": "x", "deadline": 1.5}')[0] == 400
+    assert daemon.route('POST', '/api/add', {}, b'[1]')[0] == 400
+    assert daemon.route('GET', '/api/result', {'sid': 'snotexist'}, b'')[0] == 404
+    assert daemon.route('GET', '/api/unknown', {}, b'')[0] == 404
+
+
+def test_daemon_job_options(monkeypatch, tmp_path):
+    use_tmp_running(monkeypatch, tmp_path)
+    daemon = Daemon()
+    daemon.queue = asyncio.Queue()
+
+    # 整数参数可以是字符串，转为与命令行参数相同的类型
+    daemon.add({'target': 'x', 'jobs': '4', 'step_budget': 0, 'time_budget': ' 10 '})
+    job = daemon.queue.get_nowait()
+    assert (job['jobs'], job['step_budget'], job['time_budget']) == (4, 0, 10)
+
+
+def test_daemon_job_error(monkeypatch, tmp_path, php_target):
+    use_tmp_running(monkeypatch, tmp_path)
+    daemon = Daemon()
+    daemon.queue = asyncio.Queue()
+
+    def scan(**kwargs):
+        raise RuntimeError('scan error')
+
+    monkeypatch.setattr(cli, 'scan', scan)
+    php_target({'other.php': "<?php\nsystem($_GET['a']);\n"})
+    target = project_directory + '/tests/vulnerabilities/'
+
+    # 扫描出错时同样只保留出错目标的预处理结果
+    a_sid = daemon.add({'target': target, 'language': 'php', 'rule': 1011})
+    daemon.run_job(daemon.queue.get_nowait())
+    assert daemon.status(a_sid)['status'] == 'error'
+    assert ast_object.get_object(str(tmp_path / 'other.php')) is False
+    assert ast_object.get_object(target + 'v.php')
+
+
+def test_daemon_http(tmp_path):
+    daemon = Daemon(unix_socket=str(tmp_path / 'cobra.sock'))
+
+    async def request(raw):
+        reader, writer = await asyncio.open_unix_connection(daemon.unix_socket)
+        writer.write(raw)
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+        head, _, body = response.partition(b'\r\n\r\n')
+        return head.split(b'\r\n')[0], json.loads(body.decode('utf-8'))
+
+    async def main():
+        server = asyncio.ensure_future(daemon.serve())
+        while not os.path.exists(daemon.unix_socket):
+            await asyncio.sleep(0.01)
+
+        try:
+            status, result = await request(b'GET /api/ping HTTP/1.1\r\nHost: localhost\r\n\r\n')
+            assert status == b'HTTP/1.1 200 OK'
+            assert result['result'] == {'queue': 0, 'running': None}
+
+            status, result = await request(b'POST /api/add HTTP/1.1\r\nContent-Length: 2\r\n\r\n{}')
+            assert status == b'HTTP/1.1 400 Bad Request'
+            assert result['msg'] == 'target is required'
+        finally:
+            server.cancel()
+
+    asyncio.run(main())
@@ -14,8 +14,12 @@
 import json
 import os
 
+import csv
+
+from cobra import export
 from cobra.config import running_path, export_path
 from cobra.export import write_to_file, dict_to_pretty_table
+from cobra.store import Store
 
 scan_data_file = os.path.join(running_path, 'abcdefg_data')
 if not os.path.exists(scan_data_file):
@@ -27,8 +31,10 @@ target = "https://github.com/test/test.git"
 
 
 def test_export_to_json():
+    cwd = os.getcwd()
     write_to_file(target=target, sid='abcdefg', output_format='json', filename='test.json')
     assert os.path.exists(os.path.join(export_path, 'test.json'))
+    assert os.getcwd() == cwd
 
     with open(os.path.join(export_path, 'test.json')) as f:
         json_string = f.read()
@@ -96,3 +102,47 @@ def test_export_to_pretty_table():
     assert "2015-01-31" in table_string
     # vulnerability
     assert "硬编码IP" in table_string
+
+
+def test_export_stream(monkeypatch, tmp_path):
+    store = Store(str(tmp_path / 'running.db'))
+    monkeypatch.setattr(export, 'store', store)
+    findings = [{'id': '1011', 'file_path': 'v.php', 'line_number': '20', 'chain': ['start']},
+                {'id': '1009', 'file_path': 'v.php', 'line_number': '19', 'chain': ['start']}]
+    store.add_findings('s_sid', findings)
+    store.set_data('s_sid', {'code': 1001, 'result': {'file': 2, 'vulnerabilities': findings}})
+
+    # 漏洞只从漏洞流中读取一次
+    reads = []
+    store_findings = store.findings
+    monkeypatch.setattr(store, 'findings', lambda sid: reads.append(sid) or store_findings(sid))
+
+    filename = str(tmp_path / 'stream.json')
+    assert write_to_file(target=target, sid='s_sid', output_format='json', filename=filename)
+    assert write_to_file(target=target, sid='s_sid', output_format='json', filename=filename)
+    assert reads == ['s_sid', 's_sid']
+
+    # 同一个扫描重复导出时覆盖，其他扫描保留
+    with open(filename, 'r+') as f:
+        json_data = json.load(f)
+        json_data['other_sid'] = {'file': 1}
+        f.seek(0)
+        f.truncate()
+        json.dump(json_data, f)
+    assert write_to_file(target=target, sid='s_sid', output_format='json', filename=filename)
+
+    with open(filename) as f:
+        json_data = json.load(f)
+    assert sorted(json_data) == ['other_sid', 's_sid']
+    assert json_data['s_sid']['file'] == 2 and json_data['s_sid']['target'] == target
+    assert [(v['id'], v['chain']) for v in json_data['s_sid']['vulnerabilities']] == [('1011', ''), ('1009', '')]
+
+    filename = str(tmp_path / 'stream.csv')
+    assert write_to_file(target=target, sid='s_sid', output_format='csv', filename=filename)
+    with open(filename) as f:
+        rows = list(csv.DictReader(f))
+    assert [(row['target'], row['id']) for row in rows] == [(target, '1011'), (target, '1009')]
+
+    # 没有漏洞时不导出
+    store.set_data('empty_sid', {'code': 1001, 'result': {'file': 2, 'vulnerabilities': []}})
+    assert write_to_file(target=target, sid='empty_sid', output_format='json', filename=filename) is False
@@ -2,6 +2,7 @@
 
 from cobra.config import project_directory
 from cobra.file import FileParseAll
+from cobra.pretreatment import ast_object
 
 
 vul_path = project_directory+'/tests/vulnerabilities/'
@@ -13,3 +14,47 @@ def test_FileParseAll():
     match = "echo"
     result = f.grep(match)
     assert 'echo' in result[0][2]
+
+
+def test_multi_grep_all():
+    f = FileParseAll(file_list, vul_path)
+
+    result = f.multi_grep_all([r'echo', r'\$_GET'])
+    assert result == [r for r in f.multi_grep(r'echo') if r[0] in [g[0] for g in f.multi_grep(r'\$_GET')]]
+    assert len(result) > 0
+
+    # unmatch命中的文件被过滤
+    assert f.multi_grep_all([r'echo'], [r'echo']) == []
+
+
+def test_grep_calls(tmp_path):
+    (tmp_path / 'call.php').write_text("<?php\nsystem(\n  $_GET['a']\n);\n// system($b);\n$a->system($c);\necho $d;\n")
+    (tmp_path / 'broken.php').write_text("<?php\nsystem($e)\n")
+    files = [('.php', {'list': ['call.php', 'broken.php']})]
+    target = str(tmp_path) + '/'
+    ast_object.init_pre(target, files)
+    ast_object.pre_ast()
+    f = FileParseAll(files, target)
+
+    # 跨行的函数调用按调用开始的行号匹配，注释和方法调用不匹配，解析失败的文件使用正则
+    result = f.grep_calls(['system'], r'system\s*\((.*)(?:\))')
+    assert [(r[0], r[1]) for r in result] == [(target + 'call.php', '2'), (target + 'broken.php', '2')]
+    assert result[0][2] == 'system(\n'
+
+    # 语言结构使用正则
+    result = f.grep_calls(['system', 'echo'], r'(?:system|echo)\s*\((.*)(?:\))')
+    assert [r[1] for r in result if r[0] == target + 'call.php'] == ['2']
+    result = f.grep_calls(['echo'], r'(?:echo)\s*\((.*)(?:\))')
+    assert result == []
+
+
+def test_grep_calls_case(tmp_path):
+    (tmp_path / 'case.php').write_text("<?php\nSYSTEM($a);\n\\System($b);\n$c->system($d);\n")
+    files = [('.php', {'list': ['case.php']})]
+    target = str(tmp_path) + '/'
+    ast_object.init_pre(target, files)
+    ast_object.pre_ast()
+
+    # php函数名不区分大小写，也可以带命名空间前缀
+    result = FileParseAll(files, target).grep_calls(['system'], r'system\s*\((.*)(?:\))')
+    assert [r[1] for r in result] == ['2', '3']
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    tests.test_forward
+    ~~~~~~~~~~~~~~~~~~
+
+    Tests forward taint analysis
+
+    :author:    BlBana <635373043@qq.com>
+    :homepage:  https://github.com/wufeifei/cobra
+    :license:   MIT, see LICENSE for more details.
+    :copyright: Copyright (c) 2017 Feei. All rights reserved
+"""
+import glob
+import os
+
+import pytest
+from phply import phpast as php
+
+from cobra.config import project_directory
+from cobra.core_engine.php import forward
+from cobra.core_engine.php.forward import scan_forward
+from cobra.core_engine.php.forward import init_forward
+from cobra.core_engine.php.forward import get_forward
+from cobra.core_engine.php.forward import anlysis_params_forward
+from cobra.core_engine.php.parser import scan_parser
+from cobra.core_engine.php.parser import init_budget
+from cobra.core_engine.php.parser import init_cache
+from cobra.pretreatment import ast_object
+
+files = [('.php', {'list': ["v_parser.php", "v.php"]})]
+ast_object.init_pre(project_directory + '/tests/vulnerabilities/', files)
+ast_object.pre_ast()
+
+target_projects = project_directory + '/tests/vulnerabilities/v_parser.php'
+target_projects2 = project_directory + '/tests/vulnerabilities/v.php'
+target_forward = project_directory + '/tests/forward/test_forward.php'
+
+# 回溯引擎不区分作用域，函数参数与全局变量同名时结果不同，正向引擎的结果为准
+forward_differences = {
+    ('test_node.php', 'eval', 32): ([1], [4]),
+    ('test_node.php', 'e', 34): ([1], []),
+}
+
+
+def pre_forward(target_directory, name):
+    ast_object.init_pre(target_directory, [('.php', {'list': [name]})])
+    ast_object.pre_ast()
+    init_forward()
+    init_cache()
+    init_budget()
+
+
+def get_sinks(nodes):
+    """
+    文件中所有函数调用以及eval、echo的位置
+    :param nodes:
+    :return: [(函数名, 行号)]
+    """
+    sinks = set()
+    stack = list(nodes)
+    while stack:
+        node = stack.pop()
+
+        if isinstance(node, list):
+            stack.extend(node)
+            continue
+
+        if not isinstance(node, php.Node):
+            continue
+
+        if isinstance(node, php.FunctionCall) and isinstance(node.name, str):
+            sinks.add((node.name, node.lineno))
+        elif isinstance(node, (php.Eval, php.Echo)):
+            sinks.add((node.__class__.__name__.lower(), node.lineno))
+
+        stack.extend(getattr(node, field) for field in node.fields)
+
+    return sorted(sinks, key=lambda sink: (sink[1], sink[0]))
+
+
+def test_scan_forward():
+    result = scan_forward(['system'], 7, target_projects)
+    assert result[0]['code'] == 1
+
+
+def test_scan_forward_repair():
+    result = scan_forward(['system'], 7, target_projects, repair_functions=['trim'])
+    assert result[0]['code'] == 2
+
+
+def test_anlysis_params_forward():
+    is_co, cp, expr_lineno, chain = anlysis_params_forward('$callback', target_projects2, 10, isexternal=True)
+    assert is_co == 1
+    assert expr_lineno == 4
+
+
+def test_forward_merge():
+    pre_forward(project_directory + '/tests/forward/', 'test_forward.php')
+    result = get_forward(target_forward)
+
+    def query(lineno):
+        return [(taint.code, taint.lineno) for param, taint in result.query_sink('system', lineno)]
+
+    # 分支结束时合并，只在else中被污染的变量同样可控
+    assert query(9) == [(1, 3)]
+    # 循环体分析两遍，第二遍能看到循环后半部分的赋值
+    assert query(13) == [(1, 14)]
+    # foreach的值变量来自遍历的数组
+    assert query(18) == [(1, 17)]
+    # .= 合并原来的状态以及右边的状态
+    assert query(23) == [(1, 22)]
+    # list()中的变量来自右边的数组
+    assert query(26) == [(1, 25)]
+    # 没有被污染的变量在循环中保持不可控
+    assert query(45) == [(-1, 0)]
+
+    assert [r['code'] for r in scan_forward(['system'], 23, target_forward)] == [1]
+    assert scan_forward(['system'], 23, target_forward)[0]['chain'][-1][0] == 'Assignment'
+    assert scan_forward(['system'], 45, target_forward) == []
+
+
+def test_forward_function_param():
+    pre_forward(project_directory + '/tests/forward/', 'test_forward.php')
+
+    # 函数参数生成新规则
+    result = scan_forward(['system'], 29, target_forward)
+    assert [r['code'] for r in result] == [4]
+    assert result[0]['source'][0].name == 'run'
+    assert result[0]['source'][1].name == '$cmd'
+
+
+def test_forward_fallback(monkeypatch):
+    pre_forward(project_directory + '/tests/forward/', 'test_forward.php')
+    calls = []
+
+    def parser(sensitive_func, vul_lineno, file_path, **kwargs):
+        calls.append(vul_lineno)
+        return scan_parser(sensitive_func, vul_lineno, file_path, **kwargs)
+
+    monkeypatch.setattr(forward, 'scan_parser', parser)
+
+    # 正向结果为3(方法调用的返回值)时交给回溯引擎，由回溯引擎分析方法
+    assert [(taint.code, taint.lineno) for param, taint in get_forward(target_forward).query_sink('system', 41)] == \
+        [(3, 40)]
+    assert [r['code'] for r in scan_forward(['system'], 41, target_forward)] == [1]
+    assert calls == [41]
+
+    # 正向结果可以确定时不再回溯
+    scan_forward(['system'], 9, target_forward)
+    assert calls == [41]
+
+
+@pytest.mark.parametrize('file_path', sorted(glob.glob(project_directory + '/tests/ast/**/*.php', recursive=True)),
+                         ids=os.path.basename)
+def test_forward_parser_agree(file_path):
+    target_directory, name = os.path.split(file_path)
+    pre_forward(target_directory + '/', name)
+
+    # 所有调用点的结果码与回溯引擎一致
+    for sink, lineno in get_sinks(ast_object.get_nodes(file_path) or []):
+        backward = [r['code'] for r in scan_parser([sink], lineno, file_path)]
+        codes = [r['code'] for r in scan_forward([sink], lineno, file_path)]
+        assert (backward, codes) == forward_differences.get((name, sink, lineno), (codes, codes)), (sink, lineno)
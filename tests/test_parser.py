@@ -15,6 +15,13 @@
 from cobra.config import project_directory
 from cobra.core_engine.php.parser import anlysis_params
 from cobra.core_engine.php.parser import scan_parser
+from cobra.core_engine.php.parser import init_budget
+from cobra.core_engine.php.parser import get_binaryop_params
+from cobra.core_engine.php.parser import init_cache
+from cobra.core_engine.php.parser import verify_cache
+from cobra.core_engine.php.parser import ChainCode
+from cobra.core_engine.php.parser import token_check
+from phply import phpast as php
 from cobra.pretreatment import ast_object
 
 files = [('.php', {'list': ["v_parser.php", "v.php"]})]
@@ -43,3 +50,141 @@ def test_scan_parser():
 
 def test_anlysis_params():
     assert anlysis_params(param, target_projects2, lineno2)
+
+
+def test_anlysis_params_budget():
+    init_budget(max_steps=1)
+    try:
+        is_co, cp, expr_lineno, chain = anlysis_params(param, target_projects2, lineno2, isexternal=True)
+    finally:
+        init_budget()
+    assert is_co == 5
+
+
+def test_get_binaryop_params_deep():
+    node = php.Variable('$v0')
+    for i in range(1, 3000):
+        node = php.BinaryOp('.', node, php.Variable('$v{}'.format(i)))
+
+    params = get_binaryop_params(node)
+    assert len(params) == 3000
+    assert params[0] == '$v0' and params[-1] == '$v2999'
+
+
+def test_verify_cache():
+    init_cache()
+    result = scan_parser(sensitive_func, lineno, target_projects)
+    assert len(verify_cache) == 1
+
+    # 其他规则的sink函数列表包含相同函数时直接复用结果，回溯链互不影响
+    result[0]['chain'].insert(1, ('NewScan', 'code', target_projects, lineno))
+    shared = scan_parser(['exec', 'system'], lineno, target_projects)
+    assert shared[0]['code'] == result[0]['code']
+    assert len(shared[0]['chain']) == len(result[0]['chain']) - 1
+
+    # 修复函数不同时重新回溯
+    scan_parser(sensitive_func, lineno, target_projects, repair_functions=['trim'])
+    assert len(verify_cache) == 3
+
+
+def test_chain_code():
+    node = php.BinaryOp('.', php.Variable('$a'), php.Variable('$b'))
+    code = ChainCode("{}={}", '$c', node)
+    assert str(code) == "$c={}".format(node)
+    assert "{}".format(('Assignment', code, target_projects, 1)) == \
+        "{}".format(('Assignment', "$c={}".format(node), target_projects, 1))
+
+
+def test_scan_parser_class_index():
+    ast_object.init_pre(project_directory + '/tests/ast/test_class/', [('.php', {'list': ["test_class3.php"]})])
+    ast_object.pre_ast()
+    target = project_directory + '/tests/ast/test_class/test_class3.php'
+
+    # 继承自父类的__toString
+    result = scan_parser(['eval'], 21, target)
+    assert result[0]['code'] == 1
+
+    # 继承自父类的方法
+    result = scan_parser(['system'], 24, target)
+    assert result[0]['code'] == 1
+    assert result[0]['source_lineno'] == 10
+
+
+def test_scan_parser_class_property():
+    ast_object.init_pre(project_directory + '/tests/ast/test_class/', [('.php', {'list': ["test_class4.php"]})])
+    ast_object.pre_ast()
+    target = project_directory + '/tests/ast/test_class/test_class4.php'
+
+    # 属性的默认值不可控
+    assert scan_parser(['system'], 13, target) == []
+
+    # 属性在父类的构造函数中赋值
+    result = scan_parser(['system'], 17, target)
+    assert result[0]['code'] == 1
+    assert result[0]['source_lineno'] == 7
+
+
+def test_scan_parser_class_namespace(tmp_path):
+    (tmp_path / 'base.php').write_text("<?php\nnamespace App;\nclass Base{\nfunction get(){\n$cmd = $_GET['cmd'];\nreturn $cmd;\n}\n}\n")
+    (tmp_path / 'child.php').write_text("<?php\nnamespace Lib;\nclass Base{\nfunction get(){\nreturn 'ls';\n}\n}\n"
+                                        "class Child extends \\App\\Base{}\n$c = new Child();\n$cmd = $c->get();\n"
+                                        "system($cmd);\n$b = new Base();\n$cmd2 = $b->get();\nsystem($cmd2);\n")
+    ast_object.init_pre(str(tmp_path) + '/', [('.php', {'list': ['base.php', 'child.php']})])
+    ast_object.pre_ast()
+    target = str(tmp_path / 'child.php')
+
+    # 父类按完整类名查找，同名的类不会互相覆盖
+    result = scan_parser(['system'], 11, target)
+    assert result[0]['code'] == 1
+    assert result[0]['source_lineno'] == 5
+    assert scan_parser(['system'], 14, target) == []
+
+
+def test_scan_parser_recursion():
+    ast_object.init_pre(project_directory + '/tests/ast/test_class/', [('.php', {'list': ["test_class5.php"]})])
+    ast_object.pre_ast()
+    target = project_directory + '/tests/ast/test_class/test_class5.php'
+
+    # 方法之间互相调用，回溯状态重复时停止，不依赖预算
+    init_budget(max_steps=100)
+    try:
+        is_co, cp, expr_lineno, chain = anlysis_params('$cmd', target, 15, isexternal=True)
+    finally:
+        init_budget()
+    assert is_co == 3
+    assert cp.name == 'walk'
+
+
+def test_token_check(tmp_path):
+    target = tmp_path / 'token.php'
+    target.write_text("<?php\nsystem('ls');\nsystem($_GET['cmd']);\nsystem('ls ' . $cmd);\nexec('ls', $out);\n")
+    ast_object.init_pre(str(tmp_path) + '/', [('.php', {'list': ['token.php']})])
+    ast_object.pre_ast()
+
+    # 常量参数直接判定为不可控
+    result = token_check(['system'], 2, str(target))
+    assert result[0]['code'] == -1
+
+    # 直接使用输入变量判定为可控
+    result = token_check(['system'], 3, str(target))
+    assert result[0]['code'] == 1
+    assert result[0]['source'].name == '$_GET'
+    assert result[0]['chain'][1][0] == 'NewFind'
+
+    # 需要回溯的参数交给ast
+    assert token_check(['system'], 4, str(target)) is None
+    assert token_check(['exec'], 5, str(target)) is None
+
+    # 没有sink函数调用
+    assert token_check(['exec'], 2, str(target)) is None
+
+
+def test_token_check_case(tmp_path):
+    target = tmp_path / 'token.php'
+    target.write_text("<?php\nSYSTEM($_GET['cmd']);\n\\System('ls');\n")
+    ast_object.init_pre(str(tmp_path) + '/', [('.php', {'list': ['token.php']})])
+    ast_object.pre_ast()
+
+    # 函数名不区分大小写，带命名空间前缀的调用同样检查
+    assert token_check(['system'], 2, str(target))[0]['code'] == 1
+    assert token_check(['system'], 3, str(target))[0]['code'] == -1
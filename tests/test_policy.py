@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+
+"""
+    tests.test_policy
+    ~~~~~~~~~~~~~~~~~
+
+    Tests cobra.policy
+
+    :author:    LoRexxar <LoRexxar@gmail.com>
+    :homepage:  https://github.com/LoRexxar/cobra
+    :license:   MIT, see LICENSE for more details.
+    :copyright: Copyright (c) 2017 LoRexxar. All rights reserved
+"""
+from cobra.policy import Policy
+
+
+def test_policy_default():
+    policy = Policy()
+    assert 'escapeshellarg' in policy.repair_functions(1009)
+    assert 'htmlspecialchars' not in policy.repair_functions(1009)
+    assert '$_GET' in policy.controlled_functions
+    assert policy.sink_functions('(system|exec)') == ['system', 'exec']
+
+
+def test_policy_secret():
+    policy = Policy('wordpress')
+    assert 'esc_sql' in policy.repair_functions(1004)
+    assert 'addslashes' in policy.repair_functions(1004)
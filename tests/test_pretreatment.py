@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+"""
+    tests.test_pretreatment
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    Tests cobra.pretreatment
+
+    :author:    LoRexxar <LoRexxar@gmail.com>
+    :homepage:  https://github.com/LoRexxar/cobra
+    :license:   MIT, see LICENSE for more details.
+    :copyright: Copyright (c) 2017 LoRexxar. All rights reserved
+"""
+from cobra.config import project_directory
+from cobra.pretreatment import ast_object, Pretreatment
+
+files = [('.php', {'list': ["v_parser.php", "v.php"]})]
+target_projects = project_directory + '/tests/vulnerabilities/v.php'
+
+
+def test_get_calls():
+    ast_object.init_pre(project_directory + '/tests/vulnerabilities/', files)
+    ast_object.pre_ast()
+
+    calls = ast_object.get_calls('CURL')
+    assert len(calls) == 1
+    file_path, lineno, node = calls[0]
+    assert file_path == target_projects
+    assert lineno == 44
+    assert node.params[0].node.name == '$cmd'
+
+    assert ast_object.get_calls('curl', kind='new') == []
+
+
+def test_class_index():
+    ast_object.init_pre(project_directory + '/tests/ast/test_class/', [('.php', {'list': ["test_class3.php"]})])
+    ast_object.pre_ast()
+
+    assert [entry['name'] for entry in ast_object.get_class_chain('CHILD3')] == ['child3', 'base3']
+
+    entry, method = ast_object.get_method('child3', '__tostring')
+    assert entry['name'] == 'base3'
+    assert method.name == '__toString'
+
+    entry, variable = ast_object.get_property('child3', '$name')
+    assert entry['name'] == 'child3'
+    assert ast_object.get_method('child3', 'not_exist') == (None, None)
+
+
+def test_class_index_namespace(tmp_path):
+    (tmp_path / 'app.php').write_text("<?php\nnamespace App;\nclass Base{function run(){}}\n"
+                                      "class Child extends \\App\\Base{}\n")
+    (tmp_path / 'lib.php').write_text("<?php\nnamespace Lib {\nuse App\\Child as AppChild;\nclass Base{function stop(){}}\n"
+                                      "class Child extends AppChild{}\nclass Other extends Base{}\n}\n")
+    ast_object.init_pre(str(tmp_path) + '/', [('.php', {'list': ['app.php', 'lib.php']})])
+    ast_object.pre_ast()
+    target = str(tmp_path / 'lib.php')
+
+    # 父类带命名空间
+    assert [entry['fullname'] for entry in ast_object.get_class_chain('\\App\\Child')] == ['app\\child', 'app\\base']
+    assert ast_object.get_method('App\\Child', 'run')[0]['fullname'] == 'app\\base'
+
+    # 短类名相同的类互不覆盖，按照使用位置的命名空间以及use解析
+    assert ast_object.get_class('Base', target, 6)['fullname'] == 'lib\\base'
+    assert [entry['fullname'] for entry in ast_object.get_class_chain('Child', target, 6)] == \
+        ['lib\\child', 'app\\child', 'app\\base']
+    assert ast_object.get_method('Other', 'stop', target, 6)[0]['fullname'] == 'lib\\base'
+
+    # 短类名不唯一时不再猜测，唯一时直接使用
+    assert ast_object.get_class('Base') is None
+    assert ast_object.get_class('other')['fullname'] == 'lib\\other'
+
+
+def test_get_ranges():
+    ast_object.init_pre(project_directory + '/tests/ast/test_class/', [('.php', {'list': ["test_class3.php"]})])
+    ast_object.pre_ast()
+    target = project_directory + '/tests/ast/test_class/test_class3.php'
+
+    ranges = ast_object.get_ranges(target)
+    assert ranges[0] == ('base3', 2, 13)
+    assert ('get_cmd', 9, 12) in ranges
+    assert ast_object.get_ranges(target) is ranges
+
+    # 没有ast的文件使用正则
+    ranges = ast_object.get_ranges(project_directory + '/tests/test_pretreatment.py', r'(?:def\s+)(\w+)\s*\(')
+    assert [r[0] for r in ranges][:2] == ['test_get_calls', 'test_class_index']
+
+
+def test_token_ranges(tmp_path):
+    (tmp_path / 'comment.php').write_text('<?php\n// system($a);\n$u = "http://x"; system($u); # tail\n/* block\nsystem($b);\n*/\n'
+                                          '$s = "multi\nsystem(\nline";\n')
+    ast_object.init_pre(str(tmp_path) + '/', [('.php', {'list': ['comment.php']})])
+    ast_object.pre_ast()
+    target = str(tmp_path / 'comment.php')
+
+    assert ast_object.is_comment(target, 2)
+    assert not ast_object.is_comment(target, 3)
+    assert ast_object.is_comment('comment.php', 5)
+
+    # 只有字符串的行
+    assert ast_object.is_string(target, 8)
+    assert not ast_object.is_string(target, 7)
+
+    # 没有经过预处理的文件
+    assert ast_object.is_comment(target_projects, 2) is None
+
+
+def test_pre_ast_cache(tmp_path):
+    (tmp_path / 'a.php').write_text("<?php\nsystem($_GET['a']);\n")
+    (tmp_path / 'b.php').write_text("<?php\n// system($_GET['b']);\n")
+    target_directory = str(tmp_path) + '/'
+    cache_files = [('.php', {'list': ["a.php", "b.php"]})]
+    # 使用单独的预处理对象，trim不影响其他测试使用的全局预处理结果
+    pre = Pretreatment()
+
+    pre.init_pre(target_directory, cache_files)
+    pre.pre_ast()
+    nodes_a = pre.get_nodes(target_directory + 'a.php')
+    nodes_b = pre.get_nodes(target_directory + 'b.php')
+
+    # 没有修改的文件使用上次的ast，修改过的文件重新解析，索引重新建立
+    (tmp_path / 'b.php').write_text("<?php\n\nsystem($_GET['b']);\n")
+    pre.init_pre(target_directory, cache_files)
+    pre.pre_ast()
+    assert pre.get_nodes(target_directory + 'a.php') is nodes_a
+    assert pre.get_nodes(target_directory + 'b.php') is not nodes_b
+    assert [lineno for file_path, lineno, node in pre.get_calls('system')] == [2, 3]
+    assert pre.is_comment(target_directory + 'b.php', 2) is False
+
+    # 常量只在定义它的扫描目标中可见
+    (tmp_path / 'a.php').write_text("<?php\ndefine('CMD', $_GET['a']);\nsystem($_GET['a']);\n")
+    pre.init_pre(target_directory, cache_files)
+    pre.pre_ast()
+    assert pre.get_define('CMD') != 'not_found'
+
+    # 只保留扫描目标中文件的预处理结果
+    pre.init_pre(project_directory + '/tests/vulnerabilities/', files)
+    pre.pre_ast()
+    pre.trim(target_directory)
+    assert pre.get_object(target_directory + 'a.php')
+    assert pre.get_object(target_projects) is False
+    assert pre.get_define('CMD') == 'not_found'
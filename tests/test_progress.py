@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+"""
+    tests.test_progress
+    ~~~~~~~~~~~~~~~~~~~
+
+    Tests cobra.progress
+
+    :author:    LoRexxar <LoRexxar@gmail.com>
+    :homepage:  https://github.com/LoRexxar/cobra
+    :license:   MIT, see LICENSE for more details.
+    :copyright: Copyright (c) 2017 LoRexxar. All rights reserved
+"""
+from cobra.engine import scan, Running
+from cobra.progress import Progress, format_size
+
+
+def test_progress():
+    progress = Progress(interval=60)
+    progress.start('scan', work={'CVI_1000': (2, 1000), 'CVI_1001': (2, 3000)})
+    assert progress.data()['eta'] is None
+
+    progress.rule_done('CVI_1000')
+    progress.advance(findings=2)
+    data = progress.data()
+    assert (data['rules_done'], data['rules_total']) == (1, 2)
+    assert (data['files_done'], data['files_total']) == (2, 4)
+    assert (data['bytes_done'], data['bytes_total']) == (1000, 4000)
+    assert data['findings'] == 2
+    assert data['eta'] is not None
+
+    # 切换阶段时保留统计数据
+    progress.set_phase('report')
+    assert progress.data()['rules_done'] == 1
+
+    assert format_size(512) == '512.0B'
+    assert format_size(3 * 1024 * 1024) == '3.0MB'
+
+
+def test_scan_progress(vulnerabilities_target):
+    target_directory, files = vulnerabilities_target
+
+    scan(target_directory, s_sid='progresstest', language=['php'], files=files)
+    progress = Running('progresstest').progress()
+    assert progress['phase'] == 'done'
+    assert progress['rules_done'] == progress['rules_total'] > 0
+    assert progress['bytes_done'] == progress['bytes_total'] > 0
+    assert progress['findings'] == len(Running('progresstest').data()['result']['vulnerabilities'])
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+
+"""
+    tests.test_result
+    ~~~~~~~~~~~~~~~~~
+
+    Tests cobra.result
+
+    :author:    Feei <feei@feei.cn>
+    :homepage:  https://github.com/wufeifei/cobra
+    :license:   MIT, see LICENSE for more details.
+    :copyright: Copyright (c) 2017 Feei. All rights reserved
+"""
+from cobra.result import VulnerabilityResult
+
+
+def vulnerability(file_path, line_number, code_content, svid='1009'):
+    vr = VulnerabilityResult()
+    vr.id = svid
+    vr.file_path = file_path
+    vr.line_number = line_number
+    vr.code_content = code_content
+    return vr
+
+
+def test_get_fingerprint():
+    fingerprint = vulnerability('/v.php', '10', 'eval($a);').get_fingerprint()
+
+    # 路径、行号类型以及代码中的空白不影响指纹
+    assert vulnerability('v.php', 10, '  eval($a);\n').get_fingerprint() == fingerprint
+    assert vulnerability('/v.php', '11', 'eval($a);').get_fingerprint() != fingerprint
+    assert vulnerability('/v.php', '10', 'eval($a);', svid='1011').get_fingerprint() != fingerprint
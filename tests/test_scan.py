@@ -1,7 +1,18 @@
+from cobra import const
 from cobra.engine import scan
 from cobra.engine import init_match_rule
-from cobra.config import examples_path
+from cobra.engine import NewCore
+from cobra.engine import Running
+from cobra.engine import Checkpoint
+from cobra.engine import SingleRule
+from cobra.engine import Summary
+from cobra import engine
+from cobra.file import get_file_hashes
+from cobra.config import examples_path, project_directory
+from cobra.pretreatment import ast_object
 from cobra.log import logger
+from cobra.result import VulnerabilityResult
+from cobra.core_engine.php.parser import ChainCode
 from phply import phpast as php
 
 
@@ -15,3 +26,254 @@ data = (php.Method(u'eval_function', [], [php.FormalParameter(u'$a', None, False
 def test_init_match_rule():
     assert isinstance(init_match_rule(data), tuple)
     assert "eval_function" in init_match_rule(data)[1]
+
+
+def test_new_core_visited():
+    target_directory = project_directory + '/tests/vulnerabilities/'
+    files = [('.php', {'list': ["v.php"]})]
+    ast_object.init_pre(target_directory, files)
+    ast_object.pre_ast()
+
+    class rule(object):
+        svid = 1001
+        language = 'php'
+
+    function = [node for node in ast_object.get_nodes(target_directory + 'v.php')
+                if isinstance(node, php.Function) and node.name == 'curl'][0]
+    new_rules = (function, php.Variable('$url'))
+
+    visited = set()
+    result = NewCore(rule(), target_directory, new_rules, files, visited=visited)
+    assert [int(v.line_number) for v in result] == [44]
+
+    # 同一规则不会重复添加同一新规则的结果
+    assert NewCore(rule(), target_directory, new_rules, files, visited=visited) == []
+
+
+def test_scan_rule_dedup(monkeypatch):
+    target_directory = project_directory + '/tests/vulnerabilities/'
+    rendered = []
+
+    def vulnerability(line_number):
+        v = VulnerabilityResult()
+        v.id, v.file_path, v.line_number, v.code_content = '1011', target_directory + 'v.php', line_number, 'system($a);'
+        v.chain = ['start', ('NewFind', ChainCode("find param {}", '$a'), v.file_path, line_number)]
+        return v
+
+    class rule(object):
+        pass
+
+    def render_chain(chain):
+        rendered.append(chain)
+        return [tuple(str(item) for item in c) if isinstance(c, tuple) else c for c in chain]
+
+    monkeypatch.setattr(engine, 'scan_single', lambda *args, **kwargs: [vulnerability('3'), vulnerability('3'),
+                                                                         vulnerability('4')])
+    monkeypatch.setattr(engine, 'render_chain', render_chain)
+    monkeypatch.setitem(engine.scan_context, 'rules', {'CVI_1011': rule})
+    for key in ['target_directory', 'files', 'language', 'secret_name', 'engine', 'policy', 'deadline', 'checkpoint']:
+        monkeypatch.setitem(engine.scan_context, key, target_directory if key == 'target_directory' else None)
+
+    # 子进程中先去重，重复的漏洞不转换回溯链
+    result, stats = engine.scan_chunk('CVI_1011', (0, []))
+    assert [(v.file_path, v.line_number) for v in result] == [('v.php', '3'), ('v.php', '4')]
+    assert len(rendered) == 2
+    assert result[0].chain[1][1] == 'find param $a'
+
+
+def test_scan_jobs(vulnerabilities_target):
+    target_directory, files = vulnerabilities_target
+
+    def results(jobs):
+        scan(target_directory, s_sid='jobstest', language=['php'], files=files, jobs=jobs)
+        return Running('jobstest').data()['result']['vulnerabilities']
+
+    # 多进程扫描结果与单进程一致，包括顺序
+    assert results(2) == results(1)
+
+
+def test_split_matches():
+    matches = [('a.php', '2', ''), ('a.php', '3', ''), (), ('b.php', '2', ''), ('c.php', '2', ''), ('c.php', '5', '')]
+
+    # 按文件切分，同一文件的匹配结果不会分开，序号为在所有匹配结果中的位置
+    assert engine.split_matches(matches, 3) == [(0, matches[:3]), (3, matches[3:])]
+    assert engine.split_matches(matches, 1) == [(0, matches)]
+    assert engine.split_matches(matches, 10) == [(0, matches[:3]), (3, matches[3:4]), (4, matches[4:])]
+    assert engine.split_matches([], 4) == []
+
+
+def test_scan_jobs_single_rule(php_target):
+    target_directory, files = php_target(dict(('s{}.php'.format(i), "<?php\n$a = $_GET['a'];\nsystem($a);\n"
+                                                                     "system('ls');\nsystem($_POST['b']);\n")
+                                              for i in range(6)))
+
+    def results(jobs):
+        scan(target_directory, s_sid='chunkstest', special_rules='CVI_1011.py', language=['php'], files=files,
+             jobs=jobs)
+        return Running('chunkstest').data()['result']['vulnerabilities']
+
+    # 只有一个规则时匹配结果切分后由多个进程验证，结果以及顺序与单进程一致
+    rule = engine.Rule(['php']).rules('CVI_1011.py')['CVI_1011']
+    sr = SingleRule(target_directory, rule.CVI_1011(), files, ['php'])
+    assert len(engine.split_matches(sr.matches(), 2 * const.scan_chunks_per_job)) == 6
+    assert len(results(2)) == 12
+    assert results(2) == results(1)
+
+
+def test_scan_findings_stream(vulnerabilities_target):
+    target_directory, files = vulnerabilities_target
+
+    scan(target_directory, s_sid='streamtest', language=['php'], files=files)
+
+    # 漏洞流中的漏洞与最终结果一致，回溯链以字符串保存
+    findings = list(Running('streamtest').findings())
+    vulnerabilities = Running('streamtest').data()['result']['vulnerabilities']
+    assert len(findings) == len(vulnerabilities) > 0
+    assert [(f['id'], f['line_number']) for f in findings] == [(v['id'], v['line_number']) for v in vulnerabilities]
+    assert findings[0]['chain'][0] == 'start'
+
+
+def test_scan_fingerprint(vulnerabilities_target):
+    target_directory, files = vulnerabilities_target
+
+    scan(target_directory, s_sid='fingerprinttest', language=['php'], files=files)
+    fingerprints = [v['fingerprint'] for v in Running('fingerprinttest').data()['result']['vulnerabilities']]
+    assert len(fingerprints) > 0
+    assert len(fingerprints) == len(set(fingerprints))
+
+
+def test_scan_deadline(vulnerabilities_target):
+    target_directory, files = vulnerabilities_target
+
+    scan(target_directory, s_sid='deadlinetest', language=['php'], files=files, deadline=3600)
+    result = Running('deadlinetest').data()['result']
+    assert result['partial'] is False
+    assert len(result['vulnerabilities']) > 0
+
+    # 超出截止时间后的规则不再扫描，结果中标记未完成的规则
+    scan(target_directory, s_sid='deadlinetest', language=['php'], files=files, deadline=0.000001)
+    result = Running('deadlinetest').data()['result']
+    assert result['partial'] is True
+    assert result['vulnerabilities'] == []
+    assert 'CVI_1011' in result['incomplete_rules']
+
+
+def test_scan_comment(php_target):
+    target_directory, files = php_target({
+        'comment.php': "<?php\n// system($_GET['a']);\nsystem($_GET['b']); // http://x\n/*\nsystem($_GET['c']);\n*/\n"})
+
+    scan(target_directory, s_sid='commenttest', language=['php'], files=files)
+    result = Running('commenttest').data()['result']
+    assert [int(v['line_number']) for v in result['vulnerabilities']] == [3]
+
+
+def test_filter_tokens_only_match(php_target):
+    target_directory, files = php_target({'comment.php': "<?php\n// TODO: password\n$a = 'password';\n"})
+
+    class rule(object):
+        svid = 1000
+        language = 'php'
+        match_mode = const.mm_regex_only_match
+
+    origin = [(target_directory + 'comment.php', '2', '// TODO: password'),
+              (target_directory + 'comment.php', '3', "$a = 'password';")]
+
+    # only-regex规则只做匹配，注释中的匹配同样保留
+    assert SingleRule(target_directory, rule(), files).filter_tokens(origin) == origin
+
+    rule.match_mode = const.mm_function_param_controllable
+    assert SingleRule(target_directory, rule(), files).filter_tokens(origin) == origin[1:]
+
+
+def test_scan_resume(php_target):
+    target_directory, files = php_target({'a.php': "<?php\nsystem($_GET['a']);\n", 'b.php': "<?php\nsystem('ls');\n"})
+
+    scan(target_directory, s_sid='resumetest', language=['php'], files=files)
+    result = Running('resumetest').data()['result']['vulnerabilities']
+    assert [(v['file_path'], v['line_number']) for v in result] == [('a.php', '2')]
+
+    # 没有修改过的目标直接还原已经完成的规则
+    checkpoint = Checkpoint('resumetest')
+    assert checkpoint.load(target_directory, get_file_hashes(files, target_directory))
+    assert 'CVI_1011' in checkpoint.rules
+    scan(target_directory, s_sid='resumetest', language=['php'], files=files, resume=True)
+    assert Running('resumetest').data()['result']['vulnerabilities'] == result
+
+    # 修改过的文件重新扫描，没有修改的文件还原
+    php_target({'b.php': "<?php\nsystem($_POST['b']);\n"})
+    scan(target_directory, s_sid='resumetest', language=['php'], files=files, resume=True)
+    result = Running('resumetest').data()['result']['vulnerabilities']
+    assert [(v['file_path'], v['line_number']) for v in result] == [('a.php', '2'), ('b.php', '2')]
+
+
+def test_scan_resume_include(php_target):
+    target_directory, files = php_target({'a.php': "<?php\ninclude 'b.php';\nsystem($x);\n",
+                                          'b.php': "<?php\n$x = 'ls';\n"})
+
+    scan(target_directory, s_sid='resumeincludetest', language=['php'], files=files, special_rules=['CVI_1011.py'])
+    assert Running('resumeincludetest').data()['result']['vulnerabilities'] == []
+
+    # 没有修改的文件的结果取决于include的文件，同样需要重新扫描
+    php_target({'b.php': "<?php\n$x = $_GET['x'];\n"})
+    scan(target_directory, s_sid='resumeincludetest', language=['php'], files=files, special_rules=['CVI_1011.py'],
+         resume=True)
+    result = Running('resumeincludetest').data()['result']['vulnerabilities']
+    assert [(v['file_path'], v['line_number']) for v in result] == [('a.php', '3')]
+
+
+def test_scan_report(vulnerabilities_target):
+    target_directory, files = vulnerabilities_target
+
+    # 两种输出方式的扫描结果一致，没有终端时也可以输出
+    def results(report_mode):
+        scan(target_directory, s_sid='reporttest', language=['php'], files=files, report_mode=report_mode)
+        return Running('reporttest').data()['result']['vulnerabilities']
+
+    assert results(const.report_full) == results(const.report_summary)
+
+
+def test_scan_budget(php_target):
+    target_directory, files = php_target({'budget.php': "<?php\n$a = $_GET['a'];\n$b = $a;\nsystem($b);\n"})
+
+    scan(target_directory, s_sid='budgettest', language=['php'], files=files, special_rules=['CVI_1011.py'])
+    result = Running('budgettest').data()['result']['vulnerabilities']
+    assert [(v['line_number'], v['analysis']) for v in result] == [('4', 'Function-param-controllable')]
+
+    # 预算耗尽时无法确定是否可控，不作为漏洞输出
+    scan(target_directory, s_sid='budgettest', language=['php'], files=files, special_rules=['CVI_1011.py'],
+         step_budget=1)
+    assert Running('budgettest').data()['result']['vulnerabilities'] == []
+
+
+def test_process_stream(php_target):
+    target_directory, files = php_target({'a.php': "<?php\nsystem($_GET['a']);\nsystem($_GET['b']);\n",
+                                          'b.php': "<?php\nsystem($_GET['c']);\n"})
+
+    from rules.php.CVI_1011 import CVI_1011
+    sr = SingleRule(target_directory, CVI_1011(), files)
+    process = sr.process()
+
+    # 每个文件验证完成后即产出其中的漏洞，不需要等待整个规则完成
+    assert [next(process).line_number, next(process).line_number] == ['2', '3']
+    assert sr.stats['verified'] == 2
+    assert [v.line_number for v in process] == ['2']
+    assert sr.stats['verified'] == 3
+
+
+def test_summary():
+    def vulnerability(cvi, file_path):
+        v = VulnerabilityResult()
+        v.id, v.rule_name, v.file_path = cvi, 'rule {}'.format(cvi), file_path
+        return v
+
+    summary = Summary({'1000': 1, '1001': 3}, top=2)
+    for cvi, file_path in [('1000', 'a.php'), ('1001', 'a.php'), ('1000', 'b.php'), ('1001', 'c.php')]:
+        summary.add(vulnerability(cvi, file_path))
+
+    assert summary.count == 4
+    assert summary.trigger_rules == ['1000', '1001']
+    assert summary.rules == {('1000', 'rule 1000'): 2, ('1001', 'rule 1001'): 2}
+    assert summary.files == {'a.php': 2, 'b.php': 1, 'c.php': 1}
+
+    # 只保留危害等级最高的前N个漏洞，相同等级保持扫描顺序
+    assert [(index, v.file_path) for index, v in summary.top_vulnerabilities()] == [(1, 'a.php'), (3, 'c.php')]
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+"""
+    tests.test_stats
+    ~~~~~~~~~~~~~~~~
+
+    Tests cobra.stats
+
+    :author:    LoRexxar <LoRexxar@gmail.com>
+    :homepage:  https://github.com/LoRexxar/cobra
+    :license:   MIT, see LICENSE for more details.
+    :copyright: Copyright (c) 2017 LoRexxar. All rights reserved
+"""
+import os
+
+from cobra.stats import RuleStats
+
+
+def test_rule_stats(tmp_path):
+    file_path = os.path.join(str(tmp_path), 'rule_stats')
+    rule_stats = RuleStats(file_path)
+    assert rule_stats.predict('CVI_1000') is None
+
+    rule_stats.record('CVI_1000', 100, 80, 4.0)
+    rule_stats.record('CVI_1010', 1, 1, 0.1)
+    rule_stats.save()
+
+    rule_stats = RuleStats(file_path)
+    assert rule_stats.predict('CVI_1000') == 4.0
+
+    # 耗时取历史平均
+    rule_stats.record('CVI_1000', 100, 80, 2.0)
+    assert rule_stats.predict('CVI_1000') == 3.0
+
+    # 没有记录的规则最先开始，其余按耗时从大到小
+    assert rule_stats.schedule(['CVI_1010', 'CVI_1000', 'CVI_1011']) == ['CVI_1011', 'CVI_1000', 'CVI_1010']
+
+
+def test_rule_stats_target(tmp_path):
+    file_path = os.path.join(str(tmp_path), 'rule_stats')
+    rule_stats = RuleStats(file_path, target='/a/')
+    rule_stats.record('CVI_1000', 100, 80, 4.0)
+    rule_stats.save()
+
+    # 不同扫描目标的记录分开保存，保存时不覆盖其他扫描目标的记录
+    rule_stats = RuleStats(file_path, target='/b/')
+    assert rule_stats.predict('CVI_1000') is None
+    rule_stats.record('CVI_1000', 1, 1, 0.5)
+    rule_stats.save()
+
+    assert RuleStats(file_path, target='/a').predict('CVI_1000') == 4.0
+    assert RuleStats(file_path, target='/b/').predict('CVI_1000') == 0.5
+    assert sorted(os.listdir(str(tmp_path))) == ['rule_stats', 'rule_stats.lock']
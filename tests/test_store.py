@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+"""
+    tests.test_store
+    ~~~~~~~~~~~~~~~~
+
+    Tests cobra.store
+
+    :author:    LoRexxar <LoRexxar@gmail.com>
+    :homepage:  https://github.com/LoRexxar/cobra
+    :license:   MIT, see LICENSE for more details.
+    :copyright: Copyright (c) 2017 LoRexxar. All rights reserved
+"""
+import json
+import multiprocessing
+import os
+
+from cobra.config import running_path
+from cobra.store import Store
+
+
+def test_store_status(tmp_path):
+    store = Store(str(tmp_path / 'running.db'))
+    store.init_list('a_sid', 2)
+    store.add_target('a_sid', 's_sid', 'tests/vulnerabilities/')
+    assert store.list('a_sid') == {'sids': {'s_sid': 'tests/vulnerabilities/'}, 'total_target_num': 2}
+
+    # 状态追加记录，读取最新的状态
+    store.add_status('a_sid', {'status': 'running', 'report': ''})
+    store.add_status('a_sid', {'status': 'done', 'report': '?sid=a_sid'})
+    assert store.status('a_sid') == {'status': 'done', 'report': '?sid=a_sid'}
+    assert [data['status'] for data, t in store.status_history('a_sid')] == ['running', 'done']
+    assert store.has_status('a_sid')
+    assert not store.has_data('a_sid')
+
+
+def test_store_findings(tmp_path):
+    store = Store(str(tmp_path / 'running.db'))
+    findings = [{'id': '1011', 'file_path': 'v.php', 'line_number': '20', 'fingerprint': 'a'},
+                {'id': '1009', 'file_path': 'v.php', 'line_number': '19', 'fingerprint': 'b'},
+                {'id': '1011', 'file_path': 'v_parser.php', 'line_number': '7', 'fingerprint': 'c'}]
+    store.clear_findings('s_sid')
+    store.add_findings('s_sid', findings[:1])
+    store.add_findings('s_sid', findings[1:])
+
+    assert list(store.findings('s_sid')) == findings
+    assert [f['fingerprint'] for f in store.findings('s_sid', rule=1011)] == ['a', 'c']
+    assert [f['fingerprint'] for f in store.findings('s_sid', file_path='v.php')] == ['a', 'b']
+
+    # 结果中的漏洞从漏洞表中读取，不重复保存
+    store.set_data('s_sid', {'code': 1001, 'result': {'file': 2, 'vulnerabilities': findings}})
+    assert store.count_findings('s_sid') == 3
+    assert store.data('s_sid') == {'code': 1001, 'result': {'file': 2, 'vulnerabilities': findings}}
+    assert store.data('s_sid', with_findings=False) == {'code': 1001, 'result': {'file': 2}}
+
+    # 漏洞逐行从游标中读取
+    rows = store.findings('s_sid')
+    assert next(rows) == findings[0]
+    assert [f['fingerprint'] for f in rows] == ['b', 'c']
+
+    # 没有漏洞流时保存结果中的漏洞
+    store.set_data('other_sid', {'code': 1001, 'result': {'vulnerabilities': findings[:1]}})
+    assert list(store.findings('other_sid')) == findings[:1]
+
+
+def append_findings(db_path, idx):
+    Store(db_path).add_findings('parallel_sid', [{'id': str(idx), 'fingerprint': str(idx)}])
+
+
+def test_store_parallel(tmp_path):
+    db_path = str(tmp_path / 'running.db')
+    store = Store(db_path)
+    store.clear_findings('parallel_sid')
+
+    # 多个进程同时追加漏洞
+    processes = [multiprocessing.Process(target=append_findings, args=(db_path, idx)) for idx in range(8)]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+
+    assert sorted(int(f['id']) for f in store.findings('parallel_sid')) == list(range(8))
+
+
+def test_store_legacy(tmp_path):
+    store = Store(str(tmp_path / 'running.db'))
+    sid = 'legacystoretest'
+    data = {'code': 1001, 'result': {'vulnerabilities': [{'id': '1011', 'file_path': 'v.php'}]}}
+    with open(os.path.join(running_path, '{sid}_data'.format(sid=sid)), 'w') as f:
+        f.write(json.dumps(data))
+    with open(os.path.join(running_path, '{sid}_findings'.format(sid=sid)), 'w') as f:
+        f.write(json.dumps({'id': '1011', 'file_path': 'v.php'}) + '\n')
+
+    # 数据库中没有的扫描读取原来的json文件
+    try:
+        assert store.has_data(sid)
+        assert store.data(sid) == data
+        assert list(store.findings(sid, rule='1011')) == [{'id': '1011', 'file_path': 'v.php'}]
+        assert list(store.findings(sid, rule='1009')) == []
+    finally:
+        os.remove(os.path.join(running_path, '{sid}_data'.format(sid=sid)))
+        os.remove(os.path.join(running_path, '{sid}_findings'.format(sid=sid)))